@@ -1,13 +1,74 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
 import numpy as np
 import re
-from streamlit_option_menu import option_menu
+import asyncio
 import base64
+import collections
 import pathlib
-from huggingface_hub import InferenceClient
+import datetime
+import hashlib
+import io
+import json
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+import unicodedata
+import uuid
+from cosmos_analise import (
+    DIMENSOES, ESQUEMA_DIMENSAO, ESQUEMA_RESUMO, ESQUEMA_USOS, ESQUEMA_VISITA, SECOES_LEGISLATIVA,
+    classificar_usos, comparar_parametros, encontrar_coluna, extrair_dado_visita, extrair_primeiro_numero,
+    ler_grades_excel, localizar_secoes, montar_dados,
+    processar_tabela_parametros, processar_tabela_usos, resolver_colunas, tabela_drivers,
+)
+from cosmos_cache import gravar_cache_disco, ler_cache_disco
+from cosmos_chat import dados_resposta_rapida, normalizar_pergunta, responder_rapido
+# plotly, streamlit_option_menu e huggingface_hub são importados só onde são usados:
+# a tela inicial (sem planilha) não paga ~450 ms de imports que não vai usar.
+
+try:
+    SCRIPT_DIR = pathlib.Path(__file__).parent
+except NameError:
+    SCRIPT_DIR = pathlib.Path.cwd()
+
+CACHE_DIR = pathlib.Path(os.environ.get("COSMOS_CACHE_DIR", SCRIPT_DIR / ".cache_cosmos"))
+CACHE_MAX_BYTES = int(float(os.environ.get("COSMOS_CACHE_MAX_MB", "512")) * 1024 * 1024)
+CACHE_MIN_SEGUNDOS = float(os.environ.get("COSMOS_CACHE_MIN_S", "0.1"))
+INDICADORES_POR_PAGINA = int(os.environ.get("COSMOS_INDICADORES_POR_PAGINA", "15"))
+LARGURAS_MAPA = (640, 1280)
+LARGURA_MAPA = int(os.environ.get("COSMOS_LARGURA_MAPA", "1280"))
+QUALIDADE_MAPA = 80
+TEMA_GRAFICOS = "plotly_dark"
+MODELO_LLM = "google/gemma-2-9b-it"
+LLM_BASE_URL = os.environ.get("COSMOS_LLM_BASE_URL", "").strip()
+LLM_POOL_CONEXOES = int(os.environ.get("COSMOS_LLM_POOL_CONEXOES", "32"))
+LLM_TIMEOUT = float(os.environ.get("COSMOS_LLM_TIMEOUT", "120"))
+LLM_TIMEOUT_CONEXAO = float(os.environ.get("COSMOS_LLM_TIMEOUT_CONEXAO", "10"))
+LLM_KEEPALIVE = float(os.environ.get("COSMOS_LLM_KEEPALIVE", "60"))
+LLM_USOS_POR_CLIENTE = 256
+LLM_MAX_SIMULTANEAS = int(os.environ.get("COSMOS_LLM_MAX_SIMULTANEAS", "4"))
+LLM_FILA_MAX = int(os.environ.get("COSMOS_LLM_FILA_MAX", "64"))
+LLM_ESPERA_MAX = float(os.environ.get("COSMOS_LLM_ESPERA_MAX", "120"))
+LLM_TENTATIVAS = int(os.environ.get("COSMOS_LLM_TENTATIVAS", "3"))
+STATUS_TRANSITORIOS = {429, 500, 502, 503, 504}
+AVISO_FILA = "O assistente está com muitas solicitações no momento. Tente novamente em instantes."
+LLM_ORCAMENTO_CONTEXTO = int(os.environ.get("COSMOS_LLM_ORCAMENTO_CONTEXTO", "1500"))
+LLM_TOP_K = int(os.environ.get("COSMOS_LLM_TOP_K", "8"))
+LLM_TETO_ENTRADA = int(os.environ.get("COSMOS_LLM_TETO_ENTRADA", "6000"))
+LLM_MENSAGENS_RECENTES = int(os.environ.get("COSMOS_LLM_MENSAGENS_RECENTES", "6"))
+LLM_TOKENS_RESUMO = int(os.environ.get("COSMOS_LLM_TOKENS_RESUMO", "400"))
+LLM_PAPEL_PREFIXO = os.environ.get("COSMOS_LLM_PAPEL_PREFIXO", "user")
+PARAMETROS_LLM = {'max_tokens': 1024, 'temperature': 0.5, 'top_p': 0.95}
+PARAMETROS_RESUMO = {'max_tokens': 512, 'temperature': 0.3, 'top_p': 0.95}
+LLM_RESUMOS_SIMULTANEOS = int(os.environ.get("COSMOS_LLM_RESUMOS_SIMULTANEOS", "8"))
+LLM_TOKENS_SECAO = int(os.environ.get("COSMOS_LLM_TOKENS_SECAO", "2500"))
+CACHE_RESPOSTAS_DIR = CACHE_DIR / ".respostas"
+CACHE_RESPOSTAS_MODO = os.environ.get("COSMOS_CACHE_RESPOSTAS", "sempre")
+CACHE_RESPOSTAS_TTL = float(os.environ.get("COSMOS_CACHE_RESPOSTAS_TTL_H", "24")) * 3600
+CACHE_RESPOSTAS_MAX = int(os.environ.get("COSMOS_CACHE_RESPOSTAS_MAX", "500"))
 
 st.set_page_config(
     page_title="Studio Cosmos - Análise de Viabilidade",
@@ -120,182 +181,306 @@ st.markdown(
     unsafe_allow_html=True
 )
 
-def encontrar_coluna(df, nomes_possiveis):
-    for nome in nomes_possiveis:
-        nome_limpo = nome.lower()
-        for col in df.columns:
-            col_limpa = str(col).lower()
-            if nome_limpo in col_limpa:
-                return col 
-    return None
-
-def extrair_dado_visita(df, aspecto_procurado, col_aspecto, col_obs):
+@st.cache_data(max_entries=8)
+def carregar_dados_por_hash(hash_conteudo, _conteudo):
+    # A análise em si está em cosmos_analise.py; aqui fica o cache. Os diagnósticos voltam junto
+    # com os dados e são exibidos fora do cache, a cada execução.
+    diagnosticos = []
     try:
-        resultado = df[df[col_aspecto].str.contains(aspecto_procurado, case=False, na=False)]
-        if not resultado.empty:
-            valor = resultado.iloc[0][col_obs]
-            if pd.isna(valor) or str(valor).strip() == "":
-                return "N/A"
-            return str(valor)
-    except Exception as e:
-        pass
-    return "N/A"
-
-def extrair_primeiro_numero(texto):
-    if not isinstance(texto, str):
-        return None
-    
-    match = re.search(r'(\d[\d.,]*)', str(texto))
-    if not match:
-        return None
-    
-    texto_limpo = match.group(1)
-    
-    num_dots = texto_limpo.count('.')
-    num_commas = texto_limpo.count(',')
-
-    if num_dots > 0 and num_commas > 0:
-        if texto_limpo.rfind('.') > texto_limpo.rfind(','):
-            texto_limpo = texto_limpo.replace(',', '')
+        em_cache = ler_cache_disco(CACHE_DIR, hash_conteudo)
+        if em_cache is not None:
+            abas_brutas, metricas, diagnosticos = em_cache
         else:
-            texto_limpo = texto_limpo.replace('.', '').replace(',', '.')
-    
-    elif num_commas > 0:
-        if num_commas == 1 and len(texto_limpo.split(',')[-1]) == 3:
-             texto_limpo = texto_limpo.replace(',', '')
-        else:
-             texto_limpo = texto_limpo.replace(',', '.')
+            inicio = time.perf_counter()
+            abas_brutas = ler_grades_excel(io.BytesIO(_conteudo), diagnosticos=diagnosticos)
+            if abas_brutas is None:
+                return None, tuple(diagnosticos)
+            metricas = None
+            duracao_leitura = time.perf_counter() - inicio
+
+        abas_encontradas = montar_dados(abas_brutas, metricas, diagnosticos)
+        # Planilhas pequenas são lidas mais rápido do que o cache em disco seria carregado.
+        if metricas is None and duracao_leitura >= CACHE_MIN_SEGUNDOS:
+            gravar_cache_disco(CACHE_DIR, hash_conteudo, abas_brutas, abas_encontradas['metricas'], diagnosticos, CACHE_MAX_BYTES)
+        abas_encontradas['hash'] = hash_conteudo
+        return abas_encontradas, tuple(diagnosticos)
 
-    elif num_dots > 0:
-        if num_dots == 1 and len(texto_limpo.split('.')[-1]) == 3:
-             texto_limpo = texto_limpo.replace('.', '')
+    except Exception as e:
+        diagnosticos.append(('erro', f"Erro Crítico ao processar o Excel: {e}"))
+        diagnosticos.append(('erro', "Verifique se o formato do arquivo corresponde ao template original e não está corrompido."))
+        return None, tuple(diagnosticos)
+
+def mostrar_diagnosticos(diagnosticos):
+    for nivel, mensagem in diagnosticos:
+        if nivel == 'erro':
+            st.error(mensagem)
         else:
-             pass 
+            st.warning(mensagem)
+
+def hash_do_arquivo(arquivo):
+    # O file_id do upload não muda entre reruns, então o SHA-256 é calculado uma vez por sessão.
+    file_id = getattr(arquivo, 'file_id', None)
+    hashes = st.session_state.setdefault('hashes_de_arquivos', {})
+    if file_id is None or file_id not in hashes:
+        hash_conteudo = hashlib.sha256(arquivo.getvalue()).hexdigest()
+        if file_id is None:
+            return hash_conteudo
+        hashes[file_id] = hash_conteudo
+    return hashes[file_id]
 
+def carregar_dados_excel(ficheiro_carregado):
+    dados, diagnosticos = carregar_dados_por_hash(hash_do_arquivo(ficheiro_carregado), ficheiro_carregado.getvalue())
+    mostrar_diagnosticos(diagnosticos)
+    return dados
+
+@st.cache_data(max_entries=64)
+def gerar_derivados_mapa(hash_conteudo, _conteudo):
+    # Decodifica o mapa uma vez e gera versões reduzidas (WebP, ou JPEG sem suporte a WebP)
+    # para cada largura de LARGURAS_MAPA. Devolve None se a imagem não puder ser lida.
+    from PIL import Image, ImageOps, features
+
+    formato = 'WEBP' if features.check('webp') else 'JPEG'
     try:
-        return float(texto_limpo)
-    except ValueError:
+        with Image.open(io.BytesIO(_conteudo)) as imagem:
+            imagem = ImageOps.exif_transpose(imagem)
+            tem_alfa = 'A' in imagem.getbands() or 'transparency' in imagem.info
+            imagem = imagem.convert('RGBA' if tem_alfa and formato == 'WEBP' else 'RGB')
+            derivados = {}
+            for largura in LARGURAS_MAPA:
+                copia = imagem.copy()
+                copia.thumbnail((largura, largura * 10), Image.Resampling.LANCZOS)
+                buffer = io.BytesIO()
+                copia.save(buffer, format=formato, quality=QUALIDADE_MAPA)
+                derivado = buffer.getvalue()
+                derivados[largura] = derivado if len(derivado) < len(_conteudo) else _conteudo
+    except Exception:
         return None
+    return derivados
 
+def imagem_do_mapa(arquivo, original=False):
+    if original:
+        return arquivo
+    derivados = gerar_derivados_mapa(hash_do_arquivo(arquivo), arquivo.getvalue())
+    if not derivados:
+        return arquivo
+    largura = next((largura for largura in sorted(derivados) if largura >= LARGURA_MAPA), max(derivados))
+    return derivados[largura]
 
-def clean_str(s):
-    return str(s).lower().strip()
+def construir_grafico_medias(metricas_df, tema):
+    import plotly.express as px
 
-@st.cache_data
-def carregar_dados_excel(ficheiro_carregado):
-    try:
-        try:
-            ficheiro_carregado.seek(0)
-            xls = pd.ExcelFile(ficheiro_carregado)
-            nomes_das_abas = xls.sheet_names
-        except Exception as e:
-            st.error(f"Erro ao ler a estrutura do arquivo Excel: {e}")
-            return None
+    fig = px.bar(
+        metricas_df,
+        x='Média',
+        y='Dimensão',
+        orientation='h',
+        text='Média',
+        color='Média',
+        color_continuous_scale=px.colors.sequential.Viridis,
+        range_x=[0, 5.5], 
+        template=tema
+    )
+    
+    fig.update_traces(texttemplate='%{x:.2f}', textposition='outside')
+    fig.update_layout(
+        yaxis_title="", 
+        xaxis_title="Média (0-5)", 
+        showlegend=False,
+        coloraxis_showscale=False,
+        plot_bgcolor='var(--color-container)',
+        paper_bgcolor='var(--color-container)'
+    )
+    return fig
 
-        mapeamento = {
-            'urbana': 'KPIs (Urbana)',
-            'ambiental': 'KPIs (Ambiental)',
-            'social': 'KPIs (Social)',
-            'economica': 'KPIs (Econômica)',
-            'fisica': 'KPIs (Física)',
-            'sensorial': 'KPIs (Sensorial)',
-            'leg_ade': 'KPIs (Legislativa) - ADE',
-            'leg_zr3': 'KPIs (Legislativa) - ZR3',
-            'visita': 'Dados de campo (Relatório)',
-            'matriz': 'Matriz, pesos e índices',
-            'resumo_analitico': 'Resumo analítico' 
-        }
+def construir_grafico_perfil(df_grafico, tema, col_indicador, col_escala, nome_dimensao):
+    import plotly.express as px
 
-        abas_encontradas = {}
-        
-        mapa_nomes_reais = {}
-        for chave, nome_parcial in mapeamento.items():
-            nome_encontrado = next((nome_aba for nome_aba in nomes_das_abas if nome_parcial.lower() in nome_aba.lower()), None)
-            if nome_encontrado:
-                mapa_nomes_reais[chave] = nome_encontrado
-            else:
-                abas_encontradas[chave] = pd.DataFrame()
-                st.warning(f"Aviso: Não foi possível encontrar a aba que contém '{nome_parcial}'")
+    fig = px.bar(
+        df_grafico,
+        x=col_indicador,
+        y=col_escala,
+        color=col_escala,
+        color_continuous_scale=px.colors.sequential.Blues,
+        text=col_escala,
+        title=f"Notas dos indicadores - {nome_dimensao.capitalize()}",
+        range_y=[0, 6], 
+        template=tema 
+    )
+    
+    fig.update_traces(
+        texttemplate='%{y:.1f}', 
+        textposition='outside',
+    )
+    fig.update_layout(
+        yaxis_title="Escala (0-5)", 
+        xaxis_title="Indicador",
+        plot_bgcolor='var(--color-container)',
+        paper_bgcolor='var(--color-container)'
+    )
+    return fig
 
-        chaves_para_ler = [chave for chave in mapa_nomes_reais if chave != 'economica']
-        nomes_reais_para_ler = [mapa_nomes_reais[chave] for chave in chaves_para_ler]
-        
-        if nomes_reais_para_ler:
-            try:
-                ficheiro_carregado.seek(0)
-                dfs_normais = pd.read_excel(ficheiro_carregado, sheet_name=nomes_reais_para_ler)
-                for i, chave in enumerate(chaves_para_ler):
-                    abas_encontradas[chave] = dfs_normais[nomes_reais_para_ler[i]]
-            except Exception as e:
-                st.error(f"Erro ao ler abas normais: {e}")
+def construir_grafico_legislativo(df_plot, tema):
+    import plotly.express as px
 
-        if 'economica' in mapa_nomes_reais:
-            try:
-                ficheiro_carregado.seek(0)
-                df_eco_normal = pd.read_excel(ficheiro_carregado, sheet_name=mapa_nomes_reais['economica'])
-                abas_encontradas['economica'] = df_eco_normal
-            except Exception as e:
-                st.error(f"Erro ao ler a aba 'Econômica' (leitura normal): {e}")
-                abas_encontradas['economica'] = pd.DataFrame()
+    fig = px.bar(
+        df_plot,
+        x="Parâmetro",
+        y="Valor",
+        color="Zoneamento",
+        barmode="group",
+        template=tema, 
+        color_discrete_map={
+            "ADE (Local)": "#007BFF",
+            "ZR3 (Entorno)": "#28A745"
+        },
+        title="Comparativo de Zoneamento: ADE (Local) vs. ZR3 (Entorno)",
+        log_y=True,
+        hover_data={"Valor": True}
+    )
+    
+    fig.update_yaxes(title="Valor (Escala Log)")
+    fig.update_xaxes(title=None) 
+    fig.update_layout(
+        legend_title="Zoneamento",
+        plot_bgcolor='var(--color-container)',
+        paper_bgcolor='var(--color-container)'
+    )
+    return fig
+
+def construir_grafico_ruido(df_ruido, tema):
+    import plotly.express as px
+
+    fig_ruido = px.bar(
+        df_ruido, 
+        x="Fonte", 
+        y="Intensidade", 
+        title="Fontes de Ruído Predominantes",
+        template=tema, 
+        color="Fonte",
+        color_discrete_map={
+            "Trânsito": "#007BFF",
+            "Natureza": "#28A745",
+            "Pessoas": "#B0E0E6"
+        }
+    )
+    fig_ruido.update_layout(
+        yaxis_title=None, 
+        yaxis_visible=False, 
+        showlegend=False,
+        plot_bgcolor='var(--color-container)',
+        paper_bgcolor='var(--color-container)'
+    )
+    return fig_ruido
+
+CONSTRUTORES_GRAFICO = {
+    'medias': construir_grafico_medias,
+    'perfil': construir_grafico_perfil,
+    'legislativo': construir_grafico_legislativo,
+    'ruido': construir_grafico_ruido,
+}
+
+def impressao_dados(df):
+    conteudo = hashlib.sha256(repr((list(df.columns), list(df.dtypes.astype(str)))).encode())
+    conteudo.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return conteudo.hexdigest()
+
+@st.cache_data(max_entries=128)
+def especificacao_grafico(tipo, impressao, tema, parametros, _df):
+    # Guarda o JSON da figura pronta: reruns causados por outros widgets não refazem o px.bar.
+    return CONSTRUTORES_GRAFICO[tipo](_df, tema, *parametros).to_json()
+
+def mostrar_grafico(tipo, df, *parametros, tema=TEMA_GRAFICOS):
+    import plotly.graph_objects as go
+
+    especificacao = especificacao_grafico(tipo, impressao_dados(df), tema, parametros, df)
+    st.plotly_chart(go.Figure(json.loads(especificacao), _validate=False), use_container_width=True)
+
+def expander_preguicoso(titulo, key):
+    # Com on_change="rerun" o Streamlit só executa o conteúdo do expander aberto.
+    # Versões antigas não aceitam o parâmetro; nelas o conteúdo é sempre enviado.
+    try:
+        return st.expander(titulo, key=key, on_change="rerun")
+    except TypeError:
+        return st.expander(titulo)
+
+def mostrar_detalhes_indicador(row, col_analise, col_projeto, col_mapa, mapas_carregados, indice_mapas, key):
+    nomes_dos_mapas_str = None
+    if col_mapa and col_mapa in row and pd.notna(row[col_mapa]):
+        nomes_dos_mapas_str = str(row[col_mapa])
+    
+    if nomes_dos_mapas_str:
+        lista_de_mapas_excel = nomes_dos_mapas_str.split(',')
+        ver_original = False
+        if any(indice_mapas['por_referencia'].get(nome.strip().lower()) for nome in lista_de_mapas_excel):
+            ver_original = st.toggle("Ver mapas em resolução original", key=f"{key}_original")
+        mapas_encontrados_count = 0
         
+        for nome_excel_sujo in lista_de_mapas_excel:
+            nome_excel_limpo = nome_excel_sujo.strip().lower() 
+            if not nome_excel_limpo: continue 
 
-        metricas = {}
-        
-        for chave in ['fisica', 'social', 'urbana', 'ambiental', 'economica', 'sensorial']:
-            df = abas_encontradas[chave]
-            if df.empty:
-                metricas[f'media_{chave}'] = 0
-                continue
-                
-            col_escala = encontrar_coluna(df, ['ESCALA (0–5)', 'ESCALA'])
-            if col_escala:
-                df[col_escala] = pd.to_numeric(df[col_escala], errors='coerce')
-                df = df.dropna(subset=[col_escala])
-                abas_encontradas[chave] = df 
-                metricas[f'media_{chave}'] = df[col_escala].mean()
-            else:
-                metricas[f'media_{chave}'] = 0
-        
-        df_matriz = abas_encontradas['matriz']
-        metricas['it_total'] = 0.0
+            mapa_encontrado_nome_real = indice_mapas['por_referencia'].get(nome_excel_limpo)
+            
+            if mapa_encontrado_nome_real:
+                st.image(
+                    imagem_do_mapa(mapas_carregados[mapa_encontrado_nome_real], original=ver_original),
+                    caption=f"Mapa: {mapa_encontrado_nome_real}",
+                    use_container_width=True
+                )
+                mapas_encontrados_count += 1
         
-        if not df_matriz.empty:
-            try:
-                col_vp = encontrar_coluna(df_matriz, ['VALOR PONDERADO', 'VALOR'])
-                
-                if col_vp:
-                    valores_ponderados = pd.to_numeric(df_matriz[col_vp], errors='coerce')
-                    soma_total = valores_ponderados.dropna().sum()
-                    metricas['it_total'] = soma_total
-                    
-                    if soma_total == 0:
-                        st.warning("A coluna 'VALOR PONDERADO' foi encontrada, mas a soma é 0. Verifique os dados.")
-                else:
-                    st.error("Não foi possível encontrar a coluna 'VALOR PONDERADO' na aba 'Matriz' para calcular o Índice.")
-                    metricas['it_total'] = 0.0
-                    
-            except Exception as e:
-                metricas['it_total'] = 0.0
-                st.error(f"Erro ao CALCULAR o Índice Territorial a partir da 'Matriz': {e}")
-
-        abas_encontradas['metricas'] = metricas
-        return abas_encontradas
+        if mapas_encontrados_count > 0:
+            st.markdown("---") 
 
-    except Exception as e:
-        st.error(f"Erro Crítico ao processar o Excel: {e}")
-        st.error("Verifique se o formato do arquivo corresponde ao template original e não está corrompido.")
-        return None
+    if pd.notna(row[col_analise]):
+        st.markdown("#### Análise")
+        st.write(row[col_analise])
+    
+    if pd.notna(row[col_projeto]):
+        st.markdown("#### Relação com o Projeto")
+        st.write(row[col_projeto])
+
+@st.cache_data(max_entries=16)
+def construir_indice_mapas(hash_conteudo, nomes_arquivos, _dados):
+    # Resolve de uma vez todas as referências da coluna 'MAPA CORRESPONDENTE' das abas de
+    # dimensão contra os nomes dos mapas enviados (mesma regra de antes: o primeiro arquivo
+    # cujo nome contém a referência).
+    nomes_minusculos = [(nome, nome.lower()) for nome in nomes_arquivos]
+    por_referencia = {}
+    nao_encontrados = {}
+    for nome_dimensao, chave in DIMENSOES.items():
+        df_dimensao = _dados[chave]
+        colunas = resolver_colunas(df_dimensao, ESQUEMA_DIMENSAO)
+        if df_dimensao.empty or not colunas['mapa']:
+            continue
+        if colunas['indicador'] and colunas['escala']:
+            df_dimensao = df_dimensao.dropna(subset=[colunas['indicador'], colunas['escala']])
+        for texto in df_dimensao[colunas['mapa']].dropna():
+            for nome_excel_sujo in str(texto).split(','):
+                referencia = nome_excel_sujo.strip().lower()
+                if not referencia:
+                    continue
+                if referencia not in por_referencia:
+                    por_referencia[referencia] = next((nome for nome, minusculo in nomes_minusculos if referencia in minusculo), None)
+                faltando = nao_encontrados.setdefault(nome_dimensao, [])
+                if por_referencia[referencia] is None and referencia not in faltando:
+                    faltando.append(referencia)
+    return {
+        'por_referencia': por_referencia,
+        'nao_encontrados': {nome: refs for nome, refs in nao_encontrados.items() if refs},
+    }
 
-def criar_pagina_dimensao(nome_dimensao, df_dimensao, mapas_carregados):
+def criar_pagina_dimensao(nome_dimensao, df_dimensao, mapas_carregados, indice_mapas):
     if df_dimensao.empty:
         st.warning(f"Dados da dimensão '{nome_dimensao}' não encontrados. Verifique a aba correspondente no Excel.")
         return
 
-    col_escala = encontrar_coluna(df_dimensao, ['ESCALA (0–5)', 'ESCALA'])
-    col_indicador = encontrar_coluna(df_dimensao, ['INDICADOR'])
-    col_analise = encontrar_coluna(df_dimensao, ['ANÁLISE', 'ANALISE'])
-    col_projeto = encontrar_coluna(df_dimensao, ['RELAÇÃO COM O PROJETO', 'RELAÇÃO'])
-    col_mapa = encontrar_coluna(df_dimensao, ['MAPA CORRESPONDENTE', 'MAPA'])
+    colunas = resolver_colunas(df_dimensao, ESQUEMA_DIMENSAO)
+    col_escala = colunas['escala']
+    col_indicador = colunas['indicador']
+    col_analise = colunas['analise']
+    col_projeto = colunas['projeto']
+    col_mapa = colunas['mapa']
 
     if col_escala and col_indicador:
         st.subheader("Perfil da Dimensão")
@@ -304,211 +489,620 @@ def criar_pagina_dimensao(nome_dimensao, df_dimensao, mapas_carregados):
         if df_grafico.empty:
             st.warning(f"Não há dados válidos para o gráfico de perfil da dimensão '{nome_dimensao}'.")
         else:
-            fig = px.bar(
-                df_grafico,
-                x=col_indicador,
-                y=col_escala,
-                color=col_escala,
-                color_continuous_scale=px.colors.sequential.Blues,
-                text=col_escala,
-                title=f"Notas dos indicadores - {nome_dimensao.capitalize()}",
-                range_y=[0, 6], 
-                template="plotly_dark" 
-            )
-            
-            fig.update_traces(
-                texttemplate='%{y:.1f}', 
-                textposition='outside',
-            )
-            fig.update_layout(
-                yaxis_title="Escala (0-5)", 
-                xaxis_title="Indicador",
-                plot_bgcolor='var(--color-container)',
-                paper_bgcolor='var(--color-container)'
-            )
-            st.plotly_chart(fig, use_container_width=True)
+            mostrar_grafico('perfil', df_grafico, col_indicador, col_escala, nome_dimensao)
     else:
         st.warning(f"Não foi possível gerar o gráfico de perfil para '{nome_dimensao}'. Colunas 'INDICADOR' ou 'ESCALA' não encontradas.")
     
     st.divider()
 
     st.subheader("Análise Detalhada dos Indicadores")
+    mapas_faltando = indice_mapas['nao_encontrados'].get(nome_dimensao, [])
+    if mapas_faltando:
+        lista_faltando = ", ".join(f"'{referencia}'" for referencia in mapas_faltando)
+        st.warning(f"Mapas referenciados nesta dimensão sem arquivo correspondente nos uploads (ex: '{mapas_faltando[0]}.png'): {lista_faltando}.")
     if col_analise and col_projeto and col_indicador and col_escala:
         df_analise = df_dimensao.dropna(subset=[col_indicador, col_escala])
         
-        for index, row in df_analise.iterrows():
-            titulo = f"**{row[col_indicador]}** (Nota: {row[col_escala]:.1f})"
-            with st.expander(titulo):
-                
-                nomes_dos_mapas_str = None
-                if col_mapa and col_mapa in row and pd.notna(row[col_mapa]):
-                    nomes_dos_mapas_str = str(row[col_mapa])
-                
-                if nomes_dos_mapas_str:
-                    lista_de_mapas_excel = nomes_dos_mapas_str.split(',')
-                    mapas_encontrados_count = 0
-                    
-                    for nome_excel_sujo in lista_de_mapas_excel:
-                        nome_excel_limpo = nome_excel_sujo.strip().lower() 
-                        if not nome_excel_limpo: continue 
-
-                        mapa_encontrado_nome_real = None
-                        for nome_arquivo_upload in mapas_carregados.keys():
-                            if nome_excel_limpo in nome_arquivo_upload.lower():
-                                mapa_encontrado_nome_real = nome_arquivo_upload
-                                break 
-                        
-                        if mapa_encontrado_nome_real:
-                            st.image(
-                                mapas_carregados[mapa_encontrado_nome_real],
-                                caption=f"Mapa: {mapa_encontrado_nome_real}",
-                                use_container_width=True
-                            )
-                            mapas_encontrados_count += 1
-                        else:
-                            st.warning(f"O mapa '{nome_excel_limpo}' foi referenciado, mas um arquivo correspondente (ex: '{nome_excel_limpo}.png') não foi encontrado nos uploads.")
-                    
-                    if mapas_encontrados_count > 0:
-                        st.markdown("---") 
+        total_indicadores = len(df_analise)
+        n_paginas = max(1, math.ceil(total_indicadores / INDICADORES_POR_PAGINA))
+        inicio = 0
+        if n_paginas > 1:
+            pagina = st.number_input(
+                f"Página de indicadores (1 a {n_paginas})",
+                min_value=1,
+                max_value=n_paginas,
+                value=1,
+                step=1,
+                key=f"pagina_indicadores_{nome_dimensao}"
+            )
+            inicio = (int(pagina) - 1) * INDICADORES_POR_PAGINA
+            fim = min(inicio + INDICADORES_POR_PAGINA, total_indicadores)
+            st.caption(f"Mostrando indicadores {inicio + 1} a {fim} de {total_indicadores}.")
 
-                if pd.notna(row[col_analise]):
-                    st.markdown("#### Análise")
-                    st.write(row[col_analise])
-                
-                if pd.notna(row[col_projeto]):
-                    st.markdown("#### Relação com o Projeto")
-                    st.write(row[col_projeto])
+        for index, row in df_analise.iloc[inicio:inicio + INDICADORES_POR_PAGINA].iterrows():
+            titulo = f"**{row[col_indicador]}** (Nota: {row[col_escala]:.1f})"
+            chave_indicador = f"indicador_{nome_dimensao}_{index}"
+            expander = expander_preguicoso(titulo, key=chave_indicador)
+            with expander:
+                if getattr(expander, 'open', True) is not False:
+                    mostrar_detalhes_indicador(row, col_analise, col_projeto, col_mapa, mapas_carregados, indice_mapas, chave_indicador)
     else:
         st.error("Não foi possível encontrar as colunas 'Indicador', 'Análise' ou 'Relação' no Excel.")
         st.dataframe(df_dimensao)
 
-def find_header_row(df_raw, keywords):
-    for i, row in df_raw.head(30).iterrows():
-        row_values = [clean_str(val) for val in row.values]
-        has_all_keywords = True
-        for keyword in keywords:
-            if keyword not in row_values:
-                has_all_keywords = False
-                break
-        if has_all_keywords:
-            return i
-    return -1
-
-def processar_tabela_parametros(df_raw):
-    keywords = ['indicador', 'valor indicado']
-    header_row_idx = find_header_row(df_raw, keywords)
-    
-    if header_row_idx == -1:
-        return pd.DataFrame() 
+CARACTERES_POR_TOKEN = 4
+TOKENS_POR_TRECHO = 200
+BM25_K1 = 1.5
+BM25_B = 0.75
+PALAVRAS_VAZIAS = frozenset(
+    "a o e as os ao aos da de do das dos em na no nas nos um uma uns umas "
+    "para por pela pelo com sem que se ou como mais qual quais sao ser foi".split()
+)
 
-    df_processado = df_raw.loc[header_row_idx:].copy()
-    new_cols = [clean_str(col) if pd.notna(col) else f"unnamed_{j}" for j, col in enumerate(df_processado.iloc[0])]
-    df_processado.columns = new_cols
-    df_processado = df_processado.iloc[1:].reset_index(drop=True)
-    
-    stop_keyword = 'usos'
-    stop_row_mask = df_processado.apply(lambda row: row.astype(str).str.contains(stop_keyword, case=False, na=False).any(), axis=1)
-    
-    if stop_row_mask.any():
-        stop_row_idx = stop_row_mask.idxmax()
-        df_processado = df_processado.loc[:stop_row_idx-1]
-        
-    df_processado = df_processado.dropna(how='all')
-    return df_processado
-
-def processar_tabela_usos(df_raw):
-    header_row_idx = -1
-    col_usos_str = 'usos'
-    col_adeq_str = 'adequação'
-    col_adeq_str_alt = 'adequacao'
-
-    for i, row in df_raw.head(30).iterrows():
-        row_values = [clean_str(val) for val in row.values]
-        has_usos = col_usos_str in row_values
-        has_adeq = any(col_adeq_str in val or col_adeq_str_alt in val for val in row_values)
-        
-        if has_usos and has_adeq:
-            header_row_idx = i
-            break
-    
-    if header_row_idx == -1:
-        return pd.DataFrame() 
-
-    df_processado = df_raw.loc[header_row_idx:].copy()
-    new_cols = [clean_str(col) if pd.notna(col) else f"unnamed_{j}" for j, col in enumerate(df_processado.iloc[0])]
-    df_processado.columns = new_cols
-    df_processado = df_processado.iloc[1:].reset_index(drop=True)
-
-    col_adeq_final = encontrar_coluna(df_processado, [col_adeq_str, col_adeq_str_alt])
-    col_usos_final = encontrar_coluna(df_processado, [col_usos_str])
-    col_indicador_final = encontrar_coluna(df_processado, ['indicador'])
-
-    if col_adeq_final and col_usos_final:
-        df_processado[col_adeq_final] = df_processado[col_adeq_final].replace(r'^\s*$', np.nan, regex=True)
-        df_processado[col_adeq_final] = df_processado[col_adeq_final].fillna('Inadequado')
-        df_processado = df_processado.dropna(subset=[col_usos_final])
-        df_processado = df_processado[~df_processado[col_usos_final].str.contains(col_usos_str, case=False, na=False)]
-        if col_indicador_final:
-             df_processado = df_processado[~df_processado[col_indicador_final].str.contains('adequação dos usos', case=False, na=False)]
-    
-    df_processado = df_processado.dropna(how='all')
-    return df_processado
-
-def processar_tabela_infra(df_raw, start_keyword):
-    header_row_idx = -1
-    for i, row in df_raw.head(40).iterrows():
-        first_cell_val = clean_str(str(row.iloc[0]))
-        if first_cell_val.startswith(start_keyword.lower()):
-            header_row_idx = i + 1
+def estimar_tokens(texto):
+    return math.ceil(len(texto) / CARACTERES_POR_TOKEN)
+
+def termos_do_texto(texto):
+    texto = unicodedata.normalize('NFKD', str(texto).lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return [t for t in re.findall(r'\w+', texto) if len(t) > 1 and t not in PALAVRAS_VAZIAS]
+
+def dividir_trecho(texto, max_caracteres=TOKENS_POR_TRECHO * CARACTERES_POR_TOKEN):
+    if len(texto) <= max_caracteres:
+        return [texto]
+    partes, atual = [], ""
+    for palavra in texto.split():
+        if atual and len(atual) + len(palavra) + 1 > max_caracteres:
+            partes.append(atual)
+            atual = ""
+        atual = f"{atual} {palavra}" if atual else palavra
+    if atual:
+        partes.append(atual)
+    return partes
+
+def trechos_da_tabela(df, rotulo):
+    if df is None or df.empty:
+        return []
+    colunas = [str(c) for c in df.columns]
+    trechos = []
+    for valores in df.itertuples(index=False, name=None):
+        campos = [
+            f"{coluna}: {str(valor).strip()}"
+            for coluna, valor in zip(colunas, valores)
+            if not coluna.lower().startswith('unnamed') and pd.notna(valor) and str(valor).strip()
+        ]
+        if campos:
+            trechos.extend(f"[{rotulo}] {parte}" for parte in dividir_trecho(" | ".join(campos)))
+    return trechos
+
+def trechos_do_workbook(dados):
+    trechos = []
+    df_resumo = dados['resumo_analitico']
+    if not df_resumo.empty:
+        col_dimensao_nome = encontrar_coluna(df_resumo, ['DIMENSÃO'])
+        if col_dimensao_nome:
+            df_resumo = df_resumo[~df_resumo[col_dimensao_nome].astype(str).str.contains('➡️|📍|^\s*-', na=False, regex=True)]
+            df_resumo = df_resumo.iloc[:, 0:4].dropna(how='all').dropna(subset=[col_dimensao_nome])
+        trechos += trechos_da_tabela(df_resumo, "Resumo analítico")
+
+    for nome_dimensao, chave in DIMENSOES.items():
+        df_dimensao = dados[chave]
+        colunas = resolver_colunas(df_dimensao, ESQUEMA_DIMENSAO)
+        selecionadas = [colunas[campo] for campo in ('indicador', 'escala', 'analise', 'projeto') if colunas[campo]]
+        if selecionadas:
+            df_dimensao = df_dimensao[selecionadas]
+        trechos += trechos_da_tabela(df_dimensao, f"Dimensão {nome_dimensao}")
+
+    trechos += trechos_da_tabela(dados['visita'].dropna(how='all'), "Visita")
+    if dados['stakeholders']['situacao'] == 'ok':
+        trechos += trechos_da_tabela(dados['stakeholders']['tabela'].drop(columns=['Potencial_Num', 'Topicos']), "Stakeholders")
+    return trechos
+
+def construir_indice_recuperacao(dados):
+    # BM25 em NumPy, guardado como lista de postings (trecho, termo, frequência): compacto
+    # mesmo com milhares de trechos e vocabulário grande.
+    trechos = trechos_do_workbook(dados)
+    vocabulario = {}
+    docs, termos, freqs, comprimentos = [], [], [], []
+    for i, trecho in enumerate(trechos):
+        contagem = {}
+        lista = termos_do_texto(trecho)
+        for termo in lista:
+            indice_termo = vocabulario.setdefault(termo, len(vocabulario))
+            contagem[indice_termo] = contagem.get(indice_termo, 0) + 1
+        docs.extend([i] * len(contagem))
+        termos.extend(contagem.keys())
+        freqs.extend(contagem.values())
+        comprimentos.append(len(lista))
+
+    termos = np.array(termos, dtype=np.int32)
+    n_trechos = len(trechos)
+    freq_documento = np.bincount(termos, minlength=len(vocabulario))
+    return {
+        'trechos': tuple(trechos),
+        'vocabulario': vocabulario,
+        'doc': np.array(docs, dtype=np.int32),
+        'termo': termos,
+        'freq': np.array(freqs, dtype=np.float32),
+        'comprimentos': np.array(comprimentos, dtype=np.float32),
+        'media_comprimento': float(np.mean(comprimentos)) if comprimentos else 0.0,
+        'idf': np.log1p((n_trechos - freq_documento + 0.5) / (freq_documento + 0.5)).astype(np.float32),
+    }
+
+def buscar_trechos(indice, pergunta, k=LLM_TOP_K):
+    ids = [indice['vocabulario'][t] for t in set(termos_do_texto(pergunta)) if t in indice['vocabulario']]
+    if not ids:
+        return []
+    mascara = np.isin(indice['termo'], ids)
+    docs = indice['doc'][mascara]
+    freq = indice['freq'][mascara]
+    normalizacao = 1 - BM25_B + BM25_B * indice['comprimentos'][docs] / max(indice['media_comprimento'], 1.0)
+    parcial = indice['idf'][indice['termo'][mascara]] * freq * (BM25_K1 + 1) / (freq + BM25_K1 * normalizacao)
+    pontuacao = np.bincount(docs, weights=parcial, minlength=len(indice['trechos']))
+    ordem = np.argsort(-pontuacao, kind='stable')[:k]
+    return [int(i) for i in ordem if pontuacao[i] > 0]
+
+def texto_metricas(metricas):
+    return f"""Métricas Chave:
+- Média Física: {metricas['media_fisica']:.2f}, Média Social: {metricas['media_social']:.2f}, Média Ambiental: {metricas['media_ambiental']:.2f}
+- Média Urbana: {metricas['media_urbana']:.2f}, Média Econômica: {metricas['media_economica']:.2f}, Média Sensorial: {metricas['media_sensorial']:.2f}
+- Índice Territorial (IT) Total: {metricas['it_total']:.2f}"""
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def contexto_chatbot(hash_conteudo, _dados):
+    # Montado uma vez por conteúdo de planilha e compartilhado sem cópia (cache_resource): o caminho
+    # de cada mensagem só faz a busca em NumPy, sem pandas. Os arrays ficam somente-leitura.
+    indice = construir_indice_recuperacao(_dados)
+    for valor in indice.values():
+        if isinstance(valor, np.ndarray):
+            valor.setflags(write=False)
+    return {
+        'indice': indice,
+        'prefixo': prefixo_prompt(texto_metricas(_dados['metricas'])),
+        'rapido': dados_resposta_rapida(_dados),
+    }
+
+def montar_contexto_pergunta(indice, pergunta, orcamento=LLM_ORCAMENTO_CONTEXTO, k=LLM_TOP_K):
+    if indice is None:
+        return ""
+    selecionados = buscar_trechos(indice, pergunta, k)
+    if not selecionados:
+        # Pergunta sem termo em comum com a planilha: manda o começo (resumo analítico).
+        selecionados = range(min(k, len(indice['trechos'])))
+
+    usados = 0
+    escolhidos = []
+    for i in selecionados:
+        trecho = indice['trechos'][i]
+        custo = estimar_tokens(trecho)
+        if usados + custo > orcamento:
+            continue
+        escolhidos.append(trecho)
+        usados += custo
+    if not escolhidos:
+        return ""
+    return "Trechos relevantes da planilha:\n" + "\n".join(f"- {t}" for t in escolhidos)
+
+INSTRUCOES_LLM = """Você é um assistente especialista em arquitetura e análise de viabilidade de terreno. Seu trabalho é ajudar a responder perguntas sobre um projeto.
+
+REGRAS IMPORTANTES:
+1. Responda usando APENAS o contexto de dados fornecido.
+2. Se a informação não estiver no contexto, diga "Essa informação não foi encontrada nos dados carregados".
+3. Seja direto e profissional, como em uma apresentação."""
+
+CONFIRMACAO_PREFIXO = "Entendido. Vou responder apenas com base nesses dados."
+
+def prefixo_prompt(contexto_metricas):
+    return f"{INSTRUCOES_LLM}\n\nDados do projeto:\n{contexto_metricas}"
+
+def mensagens_prefixo(prefixo, papel=LLM_PAPEL_PREFIXO):
+    # Instruções + dados fixos da planilha vêm primeiro e são idênticos byte a byte em todos os
+    # turnos do mesmo projeto, para servidores com cache de prefixo (KV) reaproveitarem o cálculo.
+    # Modelos sem papel "system" (ex.: Gemma) recebem o prefixo como um turno de usuário fixo.
+    if papel == "system":
+        return [{"role": "system", "content": prefixo}]
+    return [{"role": "user", "content": prefixo}, {"role": "assistant", "content": CONFIRMACAO_PREFIXO}]
+
+def conteudo_pergunta(pergunta, contexto_pergunta, resumo_conversa=""):
+    partes = []
+    if resumo_conversa:
+        partes.append(f"RESUMO DA CONVERSA ANTERIOR:\n{resumo_conversa}")
+    if contexto_pergunta:
+        partes.append(f"Contexto:\n{contexto_pergunta}")
+    partes.append(f"PERGUNTA:\n{pergunta}")
+    return "\n\n".join(partes)
+
+def contextos_das_secoes(dados):
+    # Um bloco de texto por seção do briefing (seis dimensões, legislação e visita), limitado a
+    # LLM_TOKENS_SECAO para nenhuma seção estourar a entrada do modelo.
+    secoes = {}
+    for nome_dimensao, chave in DIMENSOES.items():
+        df_dimensao = dados[chave]
+        colunas = resolver_colunas(df_dimensao, ESQUEMA_DIMENSAO)
+        selecionadas = [colunas[campo] for campo in ('indicador', 'escala', 'analise', 'projeto') if colunas[campo]]
+        if selecionadas:
+            df_dimensao = df_dimensao[selecionadas]
+        trechos = trechos_da_tabela(df_dimensao, f"Dimensão {nome_dimensao}")
+        if trechos:
+            trechos.insert(0, f"Média da dimensão: {dados['metricas'][f'media_{chave}']:.2f}")
+        secoes[nome_dimensao] = trechos
+
+    trechos = []
+    for rotulo, chave in (("ADE (Local)", 'leg_ade'), ("ZR3 (Entorno)", 'leg_zr3')):
+        df_raw = dados['brutas'][chave]
+        if df_raw.empty:
+            continue
+        secoes_leg = localizar_secoes(df_raw, SECOES_LEGISLATIVA)
+        trechos += trechos_da_tabela(processar_tabela_parametros(df_raw, secoes_leg), f"Parâmetros {rotulo}")
+        trechos += trechos_da_tabela(processar_tabela_usos(df_raw, secoes_leg), f"Usos {rotulo}")
+    secoes["Legislativa"] = trechos
+    secoes["Visita"] = trechos_da_tabela(dados['visita'].dropna(how='all'), "Visita")
+    return {secao: limitar_tokens("\n".join(trechos), LLM_TOKENS_SECAO) for secao, trechos in secoes.items()}
+
+def mensagens_resumo(prefixo, secao, contexto_secao):
+    return mensagens_prefixo(prefixo) + [{
+        "role": "user",
+        "content": (
+            f"Escreva um resumo executivo da seção '{secao}' em até 5 tópicos curtos: situação atual, "
+            f"pontos fortes, riscos e recomendações para o projeto.\n\nDados da seção:\n{contexto_secao}"
+        ),
+    }]
+
+def limitar_tokens(texto, max_tokens):
+    max_caracteres = max(0, max_tokens) * CARACTERES_POR_TOKEN
+    return texto if len(texto) <= max_caracteres else texto[:max_caracteres]
+
+def resumir_mensagem(mensagem, limite=160):
+    texto = " ".join(str(mensagem["content"]).split())
+    if len(texto) > limite:
+        texto = texto[:limite].rsplit(" ", 1)[0] + "…"
+    papel = "Usuário" if mensagem["role"] == "user" else "Assistente"
+    return f"- {papel}: {texto}"
+
+def atualizar_resumo_conversa(memoria, historico, ate):
+    # Resumo corrido: cada turno que sai da janela recente vira uma linha curta; se o resumo
+    # passar do orçamento, as linhas mais antigas são descartadas.
+    for mensagem in historico[memoria['resumidas']:ate]:
+        memoria['linhas'].append(resumir_mensagem(mensagem))
+    memoria['resumidas'] = max(memoria['resumidas'], ate)
+    while memoria['linhas'] and estimar_tokens("\n".join(memoria['linhas'])) > LLM_TOKENS_RESUMO:
+        memoria['linhas'].pop(0)
+    return "\n".join(memoria['linhas'])
+
+def montar_historico_llm(historico, memoria, tokens_fixos, teto=LLM_TETO_ENTRADA, recentes=LLM_MENSAGENS_RECENTES):
+    inicio = max(0, len(historico) - recentes)
+    while True:
+        # A janela verbatim começa sempre por uma pergunta do usuário (alternância exigida pelo modelo).
+        while inicio < len(historico) and historico[inicio]["role"] != "user":
+            inicio += 1
+        resumo = atualizar_resumo_conversa(memoria, historico, inicio)
+        janela = [{"role": m["role"], "content": m["content"]} for m in historico[inicio:]]
+        tokens_historico = sum(estimar_tokens(m["content"]) for m in janela)
+        tokens_resumo = estimar_tokens(resumo)
+        if tokens_fixos + tokens_resumo + tokens_historico <= teto or not janela:
             break
-            
-    if header_row_idx == -1 or header_row_idx >= len(df_raw):
-        return pd.DataFrame()
+        inicio += 1
+
+    if tokens_fixos + tokens_resumo + tokens_historico > teto:
+        resumo, tokens_resumo = "", 0
+    return janela, resumo, {'historico': tokens_historico, 'resumo': tokens_resumo}
+
+def cache_respostas_ativo(parametros):
+    # 'sempre' | 'deterministico' (só com temperature=0) | 'desligado'
+    modo = CACHE_RESPOSTAS_MODO.strip().lower()
+    if modo == 'desligado':
+        return False
+    if modo == 'deterministico':
+        return parametros.get('temperature', 1.0) == 0
+    return True
+
+def chave_resposta(pergunta, contexto, model_id, parametros, historico=(), resumo_conversa=""):
+    # A resposta depende também da conversa enviada (janela recente e resumo): perguntas de
+    # continuação ("e a ambiental?") só reaproveitam respostas dadas depois da mesma conversa.
+    hash_contexto = hashlib.sha256(contexto.encode("utf-8")).hexdigest()
+    conversa = json.dumps([[m["role"], m["content"]] for m in historico] + [resumo_conversa], ensure_ascii=False)
+    hash_conversa = hashlib.sha256(conversa.encode("utf-8")).hexdigest()
+    chave = json.dumps([normalizar_pergunta(pergunta), hash_contexto, hash_conversa, model_id, sorted(parametros.items())])
+    return hashlib.sha256(chave.encode("utf-8")).hexdigest()
+
+def ler_resposta_cache(chave):
+    arquivo = CACHE_RESPOSTAS_DIR / f"{chave}.json"
+    try:
+        entrada = json.loads(arquivo.read_text(encoding="utf-8"))
+        if time.time() - entrada['criado'] > CACHE_RESPOSTAS_TTL:
+            arquivo.unlink(missing_ok=True)
+            return None
+        os.utime(arquivo)
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    return entrada
 
-    df_processado = df_raw.loc[header_row_idx:].copy()
-    
-    new_cols = [clean_str(col) if pd.notna(col) else f"unnamed_{j}" for j, col in enumerate(df_processado.iloc[0])]
-    df_processado.columns = new_cols
-    df_processado = df_processado.iloc[1:].reset_index(drop=True)
-
-    all_nan_rows = df_processado.isnull().all(axis=1)
-    if all_nan_rows.any():
-        first_nan_row = all_nan_rows.idxmax()
-        df_processado = df_processado.loc[:first_nan_row-1]
-        
-    df_processado = df_processado.loc[:, ~df_processado.columns.str.startswith('unnamed')]
-    df_processado = df_processado.dropna(how='all')
-    
-    col_indicador = encontrar_coluna(df_processado, ['indicador'])
-    if col_indicador:
-        df_processado = df_processado.dropna(subset=[col_indicador])
-        df_processado = df_processado.set_index(col_indicador)
+def podar_cache_respostas():
+    # Mesma política do cache de planilhas: expira pelo TTL e descarta os menos usados (mtime).
+    agora = time.time()
+    entradas = []
+    for arquivo in CACHE_RESPOSTAS_DIR.glob("*.json"):
+        try:
+            modificado = arquivo.stat().st_mtime
+        except OSError:
+            continue
+        if agora - modificado > CACHE_RESPOSTAS_TTL:
+            arquivo.unlink(missing_ok=True)
+        else:
+            entradas.append((modificado, arquivo))
+    for _, arquivo in sorted(entradas)[:max(0, len(entradas) - CACHE_RESPOSTAS_MAX)]:
+        arquivo.unlink(missing_ok=True)
 
-    return df_processado
+def gravar_resposta_cache(chave, resposta):
+    try:
+        CACHE_RESPOSTAS_DIR.mkdir(parents=True, exist_ok=True)
+        descritor, caminho_tmp = tempfile.mkstemp(dir=CACHE_RESPOSTAS_DIR, prefix=".tmp-")
+        with os.fdopen(descritor, "w", encoding="utf-8") as f:
+            json.dump({'criado': time.time(), 'resposta': resposta}, f)
+        os.replace(caminho_tmp, CACHE_RESPOSTAS_DIR / f"{chave}.json")
+        podar_cache_respostas()
+    except OSError:
+        pass
+
+@st.cache_resource(show_spinner=False)
+def configurar_http_llm(pool_conexoes, timeout, timeout_conexao, keepalive):
+    # O huggingface_hub usa um único cliente HTTP por processo; aqui definimos o tamanho do pool
+    # e por quanto tempo as conexões keep-alive (TLS já negociado) ficam abertas entre mensagens.
+    # Os hooks e redirecionamentos vêm do cliente padrão da biblioteca; só o pool e o timeout mudam.
+    import httpx2
+    from huggingface_hub import get_session, set_client_factory
+
+    padrao = get_session()
+    hooks = {evento: list(funcoes) for evento, funcoes in padrao.event_hooks.items()}
+    redirecionar = padrao.follow_redirects
+
+    def fabrica():
+        return httpx2.Client(
+            event_hooks=hooks,
+            follow_redirects=redirecionar,
+            timeout=httpx2.Timeout(timeout, connect=timeout_conexao),
+            limits=httpx2.Limits(
+                max_connections=pool_conexoes,
+                max_keepalive_connections=pool_conexoes,
+                keepalive_expiry=keepalive,
+            ),
+        )
+
+    set_client_factory(fabrica)
+    return fabrica
+
+@st.cache_resource(show_spinner=False)
+def pool_cliente_llm(model_id, base_url, hash_token, timeout, _token):
+    return {'trava': threading.Lock(), 'cliente': None, 'usos': 0, 'token': _token, 'timeout': timeout}
+
+def obter_cliente_llm(model_id, token, base_url=LLM_BASE_URL):
+    from huggingface_hub import InferenceClient
+
+    configurar_http_llm(LLM_POOL_CONEXOES, LLM_TIMEOUT, LLM_TIMEOUT_CONEXAO, LLM_KEEPALIVE)
+    hash_token = hashlib.sha256(token.encode()).hexdigest()
+    pool = pool_cliente_llm(model_id, base_url, hash_token, LLM_TIMEOUT, token)
+    with pool['trava']:
+        # O InferenceClient guarda cada resposta no seu ExitStack até ser descartado; trocamos o
+        # cliente de tempos em tempos (o antigo é coletado quando as chamadas em curso terminam).
+        if pool['cliente'] is None or pool['usos'] >= LLM_USOS_POR_CLIENTE:
+            if base_url:
+                # Endpoint compatível com OpenAI/HF (ex.: ferramentas/servidor_llm_mock.py); o modelo vai no payload.
+                pool['cliente'] = InferenceClient(base_url=base_url, token=pool['token'], timeout=pool['timeout'])
+            else:
+                pool['cliente'] = InferenceClient(model=model_id, token=pool['token'], timeout=pool['timeout'])
+            pool['usos'] = 0
+        pool['usos'] += 1
+        return pool['cliente']
+
+@st.cache_resource(show_spinner=False)
+def agendador_llm(limite, fila_max):
+    # Agendador do processo: no máximo `limite` chamadas ao modelo em andamento; o excedente espera
+    # numa fila por sessão, atendida em rodízio (uma sessão não monopoliza a fila com várias abas).
+    return {
+        'trava': threading.Condition(),
+        'limite': limite,
+        'fila_max': fila_max,
+        'em_voo': 0,
+        'filas': {},
+        'ordem': collections.deque(),
+        'contadores': {'atendidas': 0, 'rejeitadas': 0, 'expiradas': 0, 'retentativas': 0, 'maior_fila': 0},
+    }
+
+def profundidade_fila(agendador):
+    return sum(len(fila) for fila in agendador['filas'].values())
+
+def despachar_fila(agendador):
+    while agendador['em_voo'] < agendador['limite'] and agendador['ordem']:
+        sessao = agendador['ordem'].popleft()
+        fila = agendador['filas'][sessao]
+        ticket = fila.popleft()
+        if fila:
+            agendador['ordem'].append(sessao)
+        else:
+            del agendador['filas'][sessao]
+        ticket['liberado'] = True
+        agendador['em_voo'] += 1
+        agendador['contadores']['atendidas'] += 1
+    agendador['trava'].notify_all()
+
+def posicao_na_fila(agendador, ticket):
+    posicao = 0
+    maior = max((len(fila) for fila in agendador['filas'].values()), default=0)
+    for volta in range(maior):
+        for sessao in agendador['ordem']:
+            fila = agendador['filas'][sessao]
+            if volta < len(fila):
+                posicao += 1
+                if fila[volta] is ticket:
+                    return posicao
+    return posicao
+
+def entrar_fila(agendador, sessao):
+    with agendador['trava']:
+        if profundidade_fila(agendador) >= agendador['fila_max']:
+            agendador['contadores']['rejeitadas'] += 1
+            return None
+        ticket = {'sessao': sessao, 'entrada': time.monotonic(), 'liberado': False}
+        if sessao not in agendador['filas']:
+            agendador['filas'][sessao] = collections.deque()
+            agendador['ordem'].append(sessao)
+        agendador['filas'][sessao].append(ticket)
+        agendador['contadores']['maior_fila'] = max(agendador['contadores']['maior_fila'], profundidade_fila(agendador))
+        despachar_fila(agendador)
+        return ticket
+
+def retirar_da_fila(agendador, ticket):
+    with agendador['trava']:
+        if ticket['liberado']:
+            agendador['em_voo'] -= 1
+        else:
+            fila = agendador['filas'].get(ticket['sessao'])
+            if fila is not None:
+                for indice, pendente in enumerate(fila):
+                    if pendente is ticket:
+                        del fila[indice]
+                        break
+                if not fila:
+                    del agendador['filas'][ticket['sessao']]
+                    agendador['ordem'].remove(ticket['sessao'])
+        despachar_fila(agendador)
+
+def aguardar_vez(agendador, ticket, ao_esperar=None, espera_max=LLM_ESPERA_MAX):
+    # Se a sessão for interrompida (rerun/fechamento) enquanto espera, o pedido sai da fila.
+    try:
+        while True:
+            with agendador['trava']:
+                if ticket['liberado']:
+                    return True
+                espera = time.monotonic() - ticket['entrada']
+                if espera > espera_max:
+                    agendador['contadores']['expiradas'] += 1
+                    expirou = True
+                else:
+                    expirou = False
+                    posicao = posicao_na_fila(agendador, ticket)
+                    agendador['trava'].wait(timeout=0.5)
+            if expirou:
+                retirar_da_fila(agendador, ticket)
+                return False
+            if ao_esperar and not ticket['liberado']:
+                ao_esperar(posicao, espera)
+    except BaseException:
+        retirar_da_fila(agendador, ticket)
+        raise
+
+def erro_transitorio(erro):
+    status = getattr(getattr(erro, 'response', None), 'status_code', None)
+    if status is not None:
+        return status in STATUS_TRANSITORIOS
+    return isinstance(erro, (TimeoutError, ConnectionError)) or type(erro).__name__ in (
+        'ConnectError', 'ConnectTimeout', 'ReadTimeout', 'RemoteProtocolError'
+    )
+
+def espera_retentativa(erro, tentativa):
+    cabecalhos = getattr(getattr(erro, 'response', None), 'headers', None) or {}
+    try:
+        return min(float(cabecalhos.get('retry-after')), 30.0)
+    except (TypeError, ValueError):
+        # Backoff exponencial com jitter completo, para as sessões não voltarem todas juntas.
+        return random.uniform(0, min(8.0, 0.5 * 2 ** tentativa))
+
+def chamar_com_retentativas(chamada, agendador, ao_retentar=None, tentativas=LLM_TENTATIVAS):
+    for tentativa in range(tentativas + 1):
+        try:
+            return chamada()
+        except Exception as erro:
+            if tentativa >= tentativas or not erro_transitorio(erro):
+                raise
+            espera = espera_retentativa(erro, tentativa)
+            with agendador['trava']:
+                agendador['contadores']['retentativas'] += 1
+            if ao_retentar:
+                ao_retentar(tentativa + 1, espera, erro)
+            time.sleep(espera)
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def resumos_do_workbook(hash_conteudo, model_id, base_url):
+    # Resumos por seção já gerados para esta planilha, compartilhados entre sessões. Só entram
+    # os que deram certo: uma nova geração pede apenas as seções que faltam.
+    return {'trava': threading.Lock(), 'resumos': {}}
+
+async def gerar_resumo_secao(cliente, agendador, sessao, limite, model_id, secao, mensagens):
+    # Passa pelo agendador do processo como qualquer mensagem do chat; aguardar_vez bloqueia,
+    # então roda numa thread para não travar o loop das outras seções.
+    async with limite:
+        ticket = entrar_fila(agendador, sessao)
+        if ticket is None:
+            raise RuntimeError(AVISO_FILA)
+        # Se não vier a vez, aguardar_vez já tirou o pedido da fila; só quem foi liberado devolve a vaga.
+        if not await asyncio.to_thread(aguardar_vez, agendador, ticket):
+            raise RuntimeError(AVISO_FILA)
+        try:
+            inicio = time.perf_counter()
+            for tentativa in range(LLM_TENTATIVAS + 1):
+                try:
+                    resposta = await cliente.chat_completion(
+                        messages=mensagens,
+                        model=model_id if LLM_BASE_URL else None,
+                        **PARAMETROS_RESUMO,
+                    )
+                    break
+                except Exception as erro:
+                    if tentativa >= LLM_TENTATIVAS or not erro_transitorio(erro):
+                        raise
+                    with agendador['trava']:
+                        agendador['contadores']['retentativas'] += 1
+                    await asyncio.sleep(espera_retentativa(erro, tentativa))
+        finally:
+            retirar_da_fila(agendador, ticket)
+        return secao, resposta.choices[0].message.content.strip(), time.perf_counter() - inicio
+
+async def gerar_resumos_secoes(model_id, token, agendador, sessao, pedidos, simultaneos=LLM_RESUMOS_SIMULTANEOS):
+    # pedidos: {secao: mensagens}. Todas as seções saem juntas (até `simultaneos` por vez), então
+    # o briefing leva mais ou menos o tempo da seção mais lenta, e não a soma delas.
+    from huggingface_hub import AsyncInferenceClient
+
+    if LLM_BASE_URL:
+        cliente = AsyncInferenceClient(base_url=LLM_BASE_URL, token=token, timeout=LLM_TIMEOUT)
+    else:
+        cliente = AsyncInferenceClient(model=model_id, token=token, timeout=LLM_TIMEOUT)
+    limite = asyncio.Semaphore(max(1, simultaneos))
+    async with cliente:
+        resultados = await asyncio.gather(
+            *(gerar_resumo_secao(cliente, agendador, sessao, limite, model_id, secao, mensagens)
+              for secao, mensagens in pedidos.items()),
+            return_exceptions=True,
+        )
+    return dict(zip(pedidos, resultados))
 
-try:
-    SCRIPT_DIR = pathlib.Path(__file__).parent
-except NameError:
-    SCRIPT_DIR = pathlib.Path.cwd()
-    
 LOGO_PATH = SCRIPT_DIR / "logo.jpg"
 
-logo_src = "https://raw.githubusercontent.com/streamlit/templates/main/multipage-apps/assets/dialogue.png"
-logo_style_override = "filter: brightness(0) invert(1);" 
+def versao_do_logo(caminho):
+    try:
+        estado = os.stat(caminho)
+        return (estado.st_mtime_ns, estado.st_size)
+    except OSError:
+        return None
+
+@st.cache_resource(show_spinner=False)
+def montar_cabecalho(caminho, versao):
+    # Lê e codifica o logo uma vez por processo; só refaz se o arquivo mudar (versao = mtime/tamanho).
+    logo_src = "https://raw.githubusercontent.com/streamlit/templates/main/multipage-apps/assets/dialogue.png"
+    logo_style_override = "filter: brightness(0) invert(1);" 
+    aviso = None
 
-try:
-    with open(LOGO_PATH, "rb") as f:
-        bytes_data = f.read()
-        base64_str = base64.b64encode(bytes_data).decode()
-        logo_src = f"data:image/jpeg;base64,{base64_str}"
-        logo_style_override = "filter: none;" 
-except FileNotFoundError:
-    st.sidebar.warning("Arquivo 'logo.jpg' não encontrado. Usando logo padrão.")
-except Exception as e:
-    st.sidebar.error(f"Erro ao carregar 'logo.jpg': {e}. Usando logo padrão.")
+    try:
+        with open(caminho, "rb") as f:
+            bytes_data = f.read()
+            base64_str = base64.b64encode(bytes_data).decode()
+            logo_src = f"data:image/jpeg;base64,{base64_str}"
+            logo_style_override = "filter: none;" 
+    except FileNotFoundError:
+        aviso = ('warning', "Arquivo 'logo.jpg' não encontrado. Usando logo padrão.")
+    except Exception as e:
+        aviso = ('error', f"Erro ao carregar 'logo.jpg': {e}. Usando logo padrão.")
 
-st.markdown(
-    f"""
+    html = f"""
     <div class="header">
         <img src="{logo_src}" alt="Logo Studio Cosmos" style="{logo_style_override}">
         <div class="titles">
@@ -516,8 +1110,66 @@ st.markdown(
             <h2>Análise de Viabilidade Territorial</h2>
         </div>
     </div>
-    """, 
-    unsafe_allow_html=True
+    """
+    return html, aviso
+
+cabecalho_html, aviso_logo = montar_cabecalho(LOGO_PATH, versao_do_logo(LOGO_PATH))
+if aviso_logo:
+    tipo_aviso, mensagem_aviso = aviso_logo
+    getattr(st.sidebar, tipo_aviso)(mensagem_aviso)
+
+st.markdown(cabecalho_html, unsafe_allow_html=True)
+
+MENU_PRINCIPAL = dict(
+    menu_title=None,
+    options=[
+        "Resumo Geral",
+        "Dimensões",
+        "Análise Legislativa",
+        "Relatório de Visita",
+        "Estratégia e Riscos",
+        "🤖 IA Chatbot"
+    ],
+    icons=[
+        "pie-chart-fill",
+        "grid-1x2-fill",
+        "building",
+        "clipboard-data",
+        "lightbulb-fill",
+        "robot"
+    ],
+    orientation="horizontal",
+    styles={
+        "container": {"padding": "0!important", "background-color": "transparent"},
+        "nav-link-selected": {"background-color": "var(--color-primary)"},
+    }
+)
+
+MENU_DIMENSOES = dict(
+    menu_title=None,
+    options=["Urbana", "Ambiental", "Social", "Econômica", "Física", "Sensorial"],
+    icons=["bi-building", "bi-tree", "bi-people", "bi-cash-coin", "bi-rulers", "bi-mic"],
+    orientation="horizontal",
+    styles={
+        "container": {
+            "padding": "0!important", 
+            "background-color": "transparent", 
+            "margin-bottom": "20px",
+            "border-bottom": f"2px solid var(--color-border)"
+        },
+        "nav-link": {
+            "color": "var(--color-text-secondary)", 
+            "--hover-color": "var(--color-container)",
+            "border-bottom": "2px solid transparent",
+            "padding": "10px 0"
+        },
+        "nav-link-selected": {
+            "background-color": "transparent", 
+            "color": "var(--color-secondary)", 
+            "border-bottom": f"2px solid var(--color-secondary)"
+        },
+        "icon": {"display": "none"}
+    }
 )
 
 st.sidebar.title("Configuração")
@@ -547,30 +1199,11 @@ dados = carregar_dados_excel(uploaded_file)
 if dados is None:
     st.stop()
 
-pagina_selecionada = option_menu(
-    menu_title=None,
-    options=[
-        "Resumo Geral",
-        "Dimensões",
-        "Análise Legislativa",
-        "Relatório de Visita",
-        "Estratégia e Riscos",
-        "🤖 IA Chatbot"
-    ],
-    icons=[
-        "pie-chart-fill",
-        "grid-1x2-fill",
-        "building",
-        "clipboard-data",
-        "lightbulb-fill",
-        "robot"
-    ],
-    orientation="horizontal",
-    styles={
-        "container": {"padding": "0!important", "background-color": "transparent"},
-        "nav-link-selected": {"background-color": "var(--color-primary)"},
-    }
-)
+indice_mapas = construir_indice_mapas(dados['hash'], tuple(mapas_carregados), dados)
+
+from streamlit_option_menu import option_menu
+
+pagina_selecionada = option_menu(**MENU_PRINCIPAL)
 
 dimensao_selecionada = None
 
@@ -610,50 +1243,17 @@ if pagina_selecionada == "Resumo Geral":
         ]
     }).sort_values(by='Média', ascending=False)
     
-    fig = px.bar(
-        metricas_df,
-        x='Média',
-        y='Dimensão',
-        orientation='h',
-        text='Média',
-        color='Média',
-        color_continuous_scale=px.colors.sequential.Viridis,
-        range_x=[0, 5.5], 
-        template="plotly_dark"
-    )
-    
-    fig.update_traces(texttemplate='%{x:.2f}', textposition='outside')
-    fig.update_layout(
-        yaxis_title="", 
-        xaxis_title="Média (0-5)", 
-        showlegend=False,
-        coloraxis_showscale=False,
-        plot_bgcolor='var(--color-container)',
-        paper_bgcolor='var(--color-container)'
-    )
-    st.plotly_chart(fig, use_container_width=True)
+    mostrar_grafico('medias', metricas_df)
 
     st.subheader("Principais Drivers de Impacto (da Matriz de Pesos)")
     df_matriz = dados['matriz']
     
     if not df_matriz.empty:
-        col_indicador = encontrar_coluna(df_matriz, ['INDICADOR'])
-        col_vp = encontrar_coluna(df_matriz, ['VALOR PONDERADO'])
+        df_drivers_show = tabela_drivers(df_matriz)
         
-        if col_indicador and col_vp:
-            df_drivers = df_matriz.dropna(subset=[col_indicador, col_vp])
-            df_drivers = df_drivers[~df_drivers[col_indicador].str.contains('Índice|Interpretação', na=False, case=False)]
-            
-            col_escala = encontrar_coluna(df_matriz, ['ESCALA'])
-            col_peso = encontrar_coluna(df_matriz, ['PESO'])
-            cols_to_show = [col_indicador, col_escala, col_peso, col_vp]
-            cols_existentes = [col for col in cols_to_show if col in df_drivers.columns]
-            
-            df_drivers_show = df_drivers[cols_existentes].copy()
-            df_drivers_show[col_vp] = pd.to_numeric(df_drivers_show[col_vp], errors='coerce')
-            
+        if df_drivers_show is not None:
             st.dataframe(
-                df_drivers_show.sort_values(by=col_vp, ascending=False),
+                df_drivers_show,
                 use_container_width=True
             )
         else:
@@ -663,227 +1263,98 @@ if pagina_selecionada == "Resumo Geral":
         st.error("Aba '3) Matriz, pesos e índices' não encontrada ou está vazia.")
 
 elif pagina_selecionada == "Dimensões":
-    dimensao_selecionada = option_menu(
-        menu_title=None,
-        options=["Urbana", "Ambiental", "Social", "Econômica", "Física", "Sensorial"],
-        icons=["bi-building", "bi-tree", "bi-people", "bi-cash-coin", "bi-rulers", "bi-mic"],
-        orientation="horizontal",
-        styles={
-            "container": {
-                "padding": "0!important", 
-                "background-color": "transparent", 
-                "margin-bottom": "20px",
-                "border-bottom": f"2px solid var(--color-border)"
-            },
-            "nav-link": {
-                "color": "var(--color-text-secondary)", 
-                "--hover-color": "var(--color-container)",
-                "border-bottom": "2px solid transparent",
-                "padding": "10px 0"
-            },
-            "nav-link-selected": {
-                "background-color": "transparent", 
-                "color": "var(--color-secondary)", 
-                "border-bottom": f"2px solid var(--color-secondary)"
-            },
-            "icon": {"display": "none"}
-        }
-    )
+    dimensao_selecionada = option_menu(**MENU_DIMENSOES)
 
     st.header(f"Dimensão: {dimensao_selecionada.capitalize()}")
 
     if dimensao_selecionada == "Urbana":
-        criar_pagina_dimensao("Urbana", dados['urbana'], mapas_carregados)
+        criar_pagina_dimensao("Urbana", dados['urbana'], mapas_carregados, indice_mapas)
     elif dimensao_selecionada == "Ambiental":
-        criar_pagina_dimensao("Ambiental", dados['ambiental'], mapas_carregados)
+        criar_pagina_dimensao("Ambiental", dados['ambiental'], mapas_carregados, indice_mapas)
     elif dimensao_selecionada == "Social":
-        criar_pagina_dimensao("Social", dados['social'], mapas_carregados)
+        criar_pagina_dimensao("Social", dados['social'], mapas_carregados, indice_mapas)
     
     elif dimensao_selecionada == "Física":
-        criar_pagina_dimensao("Física", dados['fisica'], mapas_carregados)
+        criar_pagina_dimensao("Física", dados['fisica'], mapas_carregados, indice_mapas)
         
     elif dimensao_selecionada == "Sensorial":
-        criar_pagina_dimensao("Sensorial", dados['sensorial'], mapas_carregados)
+        criar_pagina_dimensao("Sensorial", dados['sensorial'], mapas_carregados, indice_mapas)
         
     elif dimensao_selecionada == "Econômica":
-        criar_pagina_dimensao("Econômica", dados['economica'], mapas_carregados)
+        criar_pagina_dimensao("Econômica", dados['economica'], mapas_carregados, indice_mapas)
         
         st.divider()
         st.subheader("Análise de Parceiros Potenciais (Stakeholders)")
         st.caption("Dados extraídos dinamicamente da aba 'KPIs (Econômica)'")
         
-        df_eco_raw = pd.DataFrame()
-        nome_real_economica = None
-        
-        try:
-            uploaded_file.seek(0)
-            xls = pd.ExcelFile(uploaded_file)
-            for sheet_name in xls.sheet_names:
-                if "kpis (econômica)" in sheet_name.lower():
-                    nome_real_economica = sheet_name
-                    break
-        except Exception as e:
-            st.error(f"Erro ao re-abrir o Excel para encontrar a aba: {e}")
+        stakeholders = dados['stakeholders']
+        df_stakeholders = stakeholders['tabela']
+        col_inst_nome = stakeholders['colunas']['instituicao']
+        col_pot_nome = stakeholders['colunas']['potencial']
+        col_loc_nome = stakeholders['colunas']['localizacao']
 
-        if not nome_real_economica:
-            st.error("Não foi possível encontrar o nome da aba 'KPIs (Econômica)' no arquivo.")
-        else:
-            try:
-                uploaded_file.seek(0)
-                df_eco_raw = pd.read_excel(
-                    uploaded_file, 
-                    sheet_name=nome_real_economica, 
-                    header=None 
-                )
-            except Exception as e:
-                st.error(f"Erro ao re-ler a aba 'Econômica' com header=None: {e}")
-
-        if df_eco_raw.empty:
+        if stakeholders['situacao'] == 'sem_dados':
             st.warning("Aba 'Econômica' está vazia ou não pôde ser lida como dados brutos.")
+        elif stakeholders['situacao'] == 'sem_cabecalho':
+            st.error("Não foi possível encontrar a linha de cabeçalho (INSTITUIÇÃO, POTENCIAL) na aba 'Econômica', mesmo lendo os dados brutos.")
+        elif stakeholders['situacao'] == 'sem_colunas' or not col_loc_nome:
+            st.error("Encontrei o cabeçalho, mas as colunas 'INSTITUIÇÃO', 'POTENCIAL' ou 'LOCALIZAÇÃO' parecem estar ausentes.")
         else:
-            header_row_index = -1
-            df_stakeholders = pd.DataFrame()
-
-            for i, row in df_eco_raw.head(30).iterrows():
-                row_values = [clean_str(val) for val in row.values]
-                has_instituicao = any('instituição' in val or 'instituicao' in val for val in row_values)
-                has_potencial = any('potencial' in val for val in row_values)
-                
-                if has_instituicao and has_potencial:
-                    header_row_index = i
-                    break
-                        
-            if header_row_index == -1:
-                st.error("Não foi possível encontrar a linha de cabeçalho (INSTITUIÇÃO, POTENCIAL) na aba 'Econômica', mesmo lendo os dados brutos.")
+            df_stakeholders = df_stakeholders.dropna(subset=[col_loc_nome])
             
+            if df_stakeholders.empty:
+                    st.info("A tabela de stakeholders foi encontrada, mas está vazia.")
             else:
-                df_stakeholders = df_eco_raw.loc[header_row_index:].copy()
-                
-                header_row_values = df_stakeholders.iloc[0]
-                new_cols = []
-                counts = {}
                 
-                for col in header_row_values:
-                    col_name = clean_str(col) 
-                    
-                    if col_name == "nan" or col_name == "":
-                        col_name = "unnamed" 
-                    
-                    if col_name in counts:
-                        counts[col_name] += 1
-                        new_cols.append(f"{col_name}_{counts[col_name]}")
-                    else:
-                        counts[col_name] = 0
-                        new_cols.append(col_name)
-                        
-                df_stakeholders.columns = new_cols
-                df_stakeholders = df_stakeholders.iloc[1:]
+                st.markdown("#### Análise Detalhada por Parceiro")
+                st.caption("Clique em um parceiro para ver os detalhes.")
                 
-                col_inst_nome = encontrar_coluna(df_stakeholders, ['instituição', 'instituicao']) 
-                col_pot_nome = encontrar_coluna(df_stakeholders, ['potencial'])
-                col_loc_nome = encontrar_coluna(df_stakeholders, ['localização', 'localizacao'])
+                df_stakeholders = df_stakeholders.sort_values(by='Potencial_Num', ascending=False)
 
-                if col_inst_nome and col_pot_nome and col_loc_nome:
-                    df_stakeholders = df_stakeholders.dropna(subset=[col_inst_nome, col_pot_nome, col_loc_nome])
+                for nome_parceiro, localizacao_parceiro, topicos in df_stakeholders[[col_inst_nome, col_loc_nome, 'Topicos']].itertuples(index=False, name=None):
+                    titulo_expander = f"{nome_parceiro} | {localizacao_parceiro}"
                     
-                    if df_stakeholders.empty:
-                            st.info("A tabela de stakeholders foi encontrada, mas está vazia.")
-                    else:
-                        
-                        st.markdown("#### Análise Detalhada por Parceiro")
-                        st.caption("Clique em um parceiro para ver os detalhes.")
-                        
-                        mapeamento_potencial = {'Alto': 3, 'Médio': 2, 'Baixo': 1}
-                        
-                        df_stakeholders['Potencial_Nivel_Temp'] = 'Baixo' 
-                        if col_pot_nome in df_stakeholders.columns:
-                            df_stakeholders['Potencial_Nivel_Temp'] = df_stakeholders[col_pot_nome].astype(str).str.title()
-                        
-                        df_stakeholders['Potencial_Num'] = df_stakeholders['Potencial_Nivel_Temp'].map(mapeamento_potencial).fillna(0)
-                        df_stakeholders = df_stakeholders.sort_values(by='Potencial_Num', ascending=False)
-
-
-                        for index, row in df_stakeholders.iterrows():
-                            nome_parceiro = row[col_inst_nome]
-                            localizacao_parceiro = row[col_loc_nome]
-                            
-                            titulo_expander = f"{nome_parceiro} | {localizacao_parceiro}"
-                            
-                            with st.expander(titulo_expander):
-                                col_potencial_texto = encontrar_coluna(df_stakeholders, ['potencial'])
-                                potencial_texto = row[col_potencial_texto]
-
-                                if pd.notna(potencial_texto) and str(potencial_texto).strip():
-                                    topicos = [t.strip() for t in str(potencial_texto).split('\n') if t.strip()]
-                                    
-                                    markdown_formatado = ""
-                                    for topico in topicos:
-                                        if ":" not in topico and len(topico) < 50:
-                                             markdown_formatado += f"**{topico}**\n"
-                                        else:
-                                             markdown_formatado += f"- {topico}\n"
-                                    
-                                    if markdown_formatado:
-                                        st.markdown(markdown_formatado)
-                                    else:
-                                        st.write(potencial_texto)
+                    with st.expander(titulo_expander):
+                        if topicos:
+                            markdown_formatado = ""
+                            for topico in topicos:
+                                if ":" not in topico and len(topico) < 50:
+                                     markdown_formatado += f"**{topico}**\n"
                                 else:
-                                    st.info("Nenhuma análise de potencial fornecida.")
-                
-                else:
-                    st.error("Encontrei o cabeçalho, mas as colunas 'INSTITUIÇÃO', 'POTENCIAL' ou 'LOCALIZAÇÃO' parecem estar ausentes.")
+                                     markdown_formatado += f"- {topico}\n"
+                            st.markdown(markdown_formatado)
+                        else:
+                            st.info("Nenhuma análise de potencial fornecida.")
 
 elif pagina_selecionada == "Análise Legislativa":
     st.header("Análise Legislativa (ADE vs ZR3)")
     st.caption("Comparativo gráfico e de parâmetros-chave para as duas zonas.")
 
-    df_ade_raw = pd.DataFrame()
-    df_zr3_raw = pd.DataFrame()
-    nome_real_ade = None
-    nome_real_zr3 = None
-    
-    try:
-        uploaded_file.seek(0)
-        xls = pd.ExcelFile(uploaded_file)
-        for sheet_name in xls.sheet_names:
-            if "kpis (legislativa) - ade" in sheet_name.lower():
-                nome_real_ade = sheet_name
-            if "kpis (legislativa) - zr3" in sheet_name.lower():
-                nome_real_zr3 = sheet_name
-    except Exception as e:
-        st.error(f"Erro ao re-abrir o Excel para encontrar as abas de legislação: {e}")
-
-    if not nome_real_ade or not nome_real_zr3:
-        st.error("Não foi possível encontrar as abas 'Legislativa - ADE' ou 'Legislativa - ZR3' no arquivo.")
-        if 'st' in locals(): st.stop()
-        else: exit()
-
-    try:
-        uploaded_file.seek(0)
-        df_ade_raw = pd.read_excel(uploaded_file, sheet_name=nome_real_ade, header=None)
-        uploaded_file.seek(0)
-        df_zr3_raw = pd.read_excel(uploaded_file, sheet_name=nome_real_zr3, header=None)
-    except Exception as e:
-        st.error(f"Erro ao re-ler as abas de Legislação com header=None: {e}")
+    df_ade_raw = dados['brutas']['leg_ade']
+    df_zr3_raw = dados['brutas']['leg_zr3']
 
     if df_ade_raw.empty or df_zr3_raw.empty:
         st.warning("Abas de Legislação estão vazias ou não puderam ser lidas.")
         if 'st' in locals(): st.stop()
         else: exit()
     
-    df_ade_params = processar_tabela_parametros(df_ade_raw)
-    df_zr3_params = processar_tabela_parametros(df_zr3_raw)
-    df_ade_usos = processar_tabela_usos(df_ade_raw)
-    df_zr3_usos = processar_tabela_usos(df_zr3_raw)
+    secoes_ade = localizar_secoes(df_ade_raw, SECOES_LEGISLATIVA)
+    secoes_zr3 = localizar_secoes(df_zr3_raw, SECOES_LEGISLATIVA)
+    df_ade_params = processar_tabela_parametros(df_ade_raw, secoes_ade)
+    df_zr3_params = processar_tabela_parametros(df_zr3_raw, secoes_zr3)
+    df_ade_usos = processar_tabela_usos(df_ade_raw, secoes_ade)
+    df_zr3_usos = processar_tabela_usos(df_zr3_raw, secoes_zr3)
 
     if df_ade_usos.empty or df_zr3_usos.empty:
         st.error("Não foi possível localizar a tabela (cabeçalho 'USOS' e 'ADEQUAÇÃO') nas abas de legislação.")
     else:
-        col_usos_ade = encontrar_coluna(df_ade_usos, ['usos'])
-        col_adeq_ade = encontrar_coluna(df_ade_usos, ['adequação', 'adequacao'])
+        colunas_usos_ade = resolver_colunas(df_ade_usos, ESQUEMA_USOS)
+        col_usos_ade = colunas_usos_ade['usos']
+        col_adeq_ade = colunas_usos_ade['adequacao']
         
-        col_usos_zr3 = encontrar_coluna(df_zr3_usos, ['usos'])
-        col_adeq_zr3 = encontrar_coluna(df_zr3_usos, ['adequação', 'adequacao'])
+        colunas_usos_zr3 = resolver_colunas(df_zr3_usos, ESQUEMA_USOS)
+        col_usos_zr3 = colunas_usos_zr3['usos']
+        col_adeq_zr3 = colunas_usos_zr3['adequacao']
 
         if not (col_usos_ade and col_adeq_ade and col_usos_zr3 and col_adeq_zr3):
             st.error("Tabela de Usos encontrada, mas os nomes das colunas 'USOS' ou 'ADEQUAÇÃO' não puderam ser confirmados.")
@@ -892,15 +1363,10 @@ elif pagina_selecionada == "Análise Legislativa":
             col1, col2 = st.columns(2)
 
             def criar_cards_de_uso(df, col_usos, col_adeq):
-                df_usos = df.dropna(subset=[col_usos])
-                df_usos = df_usos.copy()
-                
-                df_usos['Categoria'] = df_usos[col_adeq].fillna('Inadequado').astype(str).str.strip().str.title()
-                df_usos['Categoria'] = df_usos['Categoria'].replace(['Nan', 'Não Adequado', ''], 'Inadequado')
-                
-                adequados = df_usos[df_usos['Categoria'] == 'Adequado'][col_usos]
-                proibidos = df_usos[df_usos['Categoria'] == 'Proibido'][col_usos]
-                inadequados = df_usos[df_usos['Categoria'] == 'Inadequado'][col_usos]
+                categorias = classificar_usos(df, col_usos, col_adeq)
+                adequados = categorias['Adequado']
+                proibidos = categorias['Proibido']
+                inadequados = categorias['Inadequado']
                 
                 with st.expander(f"✅ Adequadas ({len(adequados)})"):
                     st.dataframe(adequados, use_container_width=True)
@@ -921,67 +1387,15 @@ elif pagina_selecionada == "Análise Legislativa":
 
     st.divider()
 
-    col_param_ade = encontrar_coluna(df_ade_params, ['indicador'])
-    col_valor_ade = encontrar_coluna(df_ade_params, ['valor indicado'])
-    col_param_zr3 = encontrar_coluna(df_zr3_params, ['indicador'])
-    col_valor_zr3 = encontrar_coluna(df_zr3_params, ['valor indicado'])
-
-    parametros_numericos_comuns = [
-        'taxa de ocupação', 
-        'coeficiente de aproveitamento', 
-        'taxa de permeabilidade',
-        'área mínima de lote',
-        'testada mínima',
-        'afast. frontal',
-        'afast. lateral'
-    ]
-    dados_grafico = []
-
-    if col_param_ade and col_valor_ade and col_param_zr3 and col_valor_zr3:
-        for param_nome in parametros_numericos_comuns:
-            val_ade = extrair_dado_visita(df_ade_params, param_nome, col_param_ade, col_valor_ade)
-            val_zr3 = extrair_dado_visita(df_zr3_params, param_nome, col_param_zr3, col_valor_zr3)
-
-            num_ade = extrair_primeiro_numero(val_ade)
-            num_zr3 = extrair_primeiro_numero(val_zr3)
-
-            param_nome_formatado = param_nome.replace('taxa de ', 'T. ').replace('coeficiente de ', 'C. ').replace('afast. ', 'A. ').replace('área mínima de ', 'Área Mín. ').title()
-
-            if num_ade is not None:
-                dados_grafico.append({"Parâmetro": param_nome_formatado, "Zoneamento": "ADE (Local)", "Valor": num_ade})
-            if num_zr3 is not None:
-                dados_grafico.append({"Parâmetro": param_nome_formatado, "Zoneamento": "ZR3 (Entorno)", "Valor": num_zr3})
-        
+    dados_grafico = comparar_parametros(df_ade_params, df_zr3_params)
+
+    if dados_grafico is not None:
         if dados_grafico:
             st.subheader("Comparativo de Parâmetros Numéricos")
             st.caption("Eixo Y em escala logarítmica para melhor visualização. Passe o mouse sobre as barras para ver os valores exatos.")
             df_plot = pd.DataFrame(dados_grafico)
             
-            fig = px.bar(
-                df_plot,
-                x="Parâmetro",
-                y="Valor",
-                color="Zoneamento",
-                barmode="group",
-                template="plotly_dark", 
-                color_discrete_map={
-                    "ADE (Local)": "#007BFF",
-                    "ZR3 (Entorno)": "#28A745"
-                },
-                title="Comparativo de Zoneamento: ADE (Local) vs. ZR3 (Entorno)",
-                log_y=True,
-                hover_data={"Valor": True}
-            )
-            
-            fig.update_yaxes(title="Valor (Escala Log)")
-            fig.update_xaxes(title=None) 
-            fig.update_layout(
-                legend_title="Zoneamento",
-                plot_bgcolor='var(--color-container)',
-                paper_bgcolor='var(--color-container)'
-            )
-            
-            st.plotly_chart(fig, use_container_width=True)
+            mostrar_grafico('legislativo', df_plot)
         else:
             st.info("Não foram encontrados parâmetros numéricos comuns (Ex: 'Taxa de Ocupação') nas abas de legislação para gerar o gráfico.")
     else:
@@ -994,8 +1408,9 @@ elif pagina_selecionada == "Relatório de Visita":
     if df_visita.empty:
         st.error("Aba '1) Dados de campo (Relatório)' não encontrada.")
     else:
-        col_aspecto = encontrar_coluna(df_visita, ['ASPECTO / DADO'])
-        col_obs = encontrar_coluna(df_visita, ['OBSERVAÇÕES / RESPOSTAS'])
+        colunas_visita = resolver_colunas(df_visita, ESQUEMA_VISITA)
+        col_aspecto = colunas_visita['aspecto']
+        col_obs = colunas_visita['obs']
 
         if not col_aspecto or not col_obs:
             st.error("Colunas 'Aspecto' ou 'Observações' não encontradas no Relatório.")
@@ -1033,27 +1448,7 @@ elif pagina_selecionada == "Relatório de Visita":
                 
                 if fontes_ruido:
                     df_ruido = pd.DataFrame(fontes_ruido)
-                    fig_ruido = px.bar(
-                        df_ruido, 
-                        x="Fonte", 
-                        y="Intensidade", 
-                        title="Fontes de Ruído Predominantes",
-                        template="plotly_dark", 
-                        color="Fonte",
-                        color_discrete_map={
-                            "Trânsito": "#007BFF",
-                            "Natureza": "#28A745",
-                            "Pessoas": "#B0E0E6"
-                        }
-                    )
-                    fig_ruido.update_layout(
-                        yaxis_title=None, 
-                        yaxis_visible=False, 
-                        showlegend=False,
-                        plot_bgcolor='var(--color-container)',
-                        paper_bgcolor='var(--color-container)'
-                    )
-                    st.plotly_chart(fig_ruido, use_container_width=True)
+                    mostrar_grafico('ruido', df_ruido)
                 else:
                     st.info("Fontes de ruído não detalhadas.")
             
@@ -1082,11 +1477,11 @@ elif pagina_selecionada == "Estratégia e Riscos":
     else:
         st.subheader("Diretrizes Estratégicas por Dimensão")
         
-        col_dimensao = encontrar_coluna(df_resumo, ['DIMENSÃO'])
+        col_dimensao = resolver_colunas(df_resumo, ESQUEMA_RESUMO)['dimensao']
         df_resumo_display = pd.DataFrame() 
 
         if col_dimensao:
-            col_dimensao_nome = encontrar_coluna(df_resumo, ['DIMENSÃO'])
+            col_dimensao_nome = col_dimensao
             
             df_resumo_display = df_resumo[~df_resumo[col_dimensao_nome].astype(str).str.contains('➡️|📍|^\s*-', na=False, regex=True)]
             df_resumo_display = df_resumo_display.iloc[:, 0:4].dropna(how='all')
@@ -1101,9 +1496,10 @@ elif pagina_selecionada == "Estratégia e Riscos":
             st.stop()
             
         if not df_resumo_display.empty:
-            col_situacao = encontrar_coluna(df_resumo_display, ['SITUAÇÃO'])
-            col_potencial = encontrar_coluna(df_resumo_display, ['POTENCIAL'])
-            col_estrategia = encontrar_coluna(df_resumo_display, ['ESTRATÉGIA'])
+            colunas_resumo = resolver_colunas(df_resumo_display, ESQUEMA_RESUMO)
+            col_situacao = colunas_resumo['situacao']
+            col_potencial = colunas_resumo['potencial']
+            col_estrategia = colunas_resumo['estrategia']
 
             if col_situacao and col_potencial and col_estrategia:
                 for dimensao, row in df_resumo_display.iterrows():
@@ -1125,8 +1521,9 @@ elif pagina_selecionada == "Estratégia e Riscos":
         
         df_visita = dados['visita']
         if not df_visita.empty:
-            col_aspecto = encontrar_coluna(df_visita, ['ASPECTO / DADO'])
-            col_obs = encontrar_coluna(df_visita, ['OBSERVAÇÕES / RESPOSTAS'])
+            colunas_visita = resolver_colunas(df_visita, ESQUEMA_VISITA)
+            col_aspecto = colunas_visita['aspecto']
+            col_obs = colunas_visita['obs']
 
             if col_aspecto and col_obs:
                 st.warning(f"**Risco de Ruído:** {extrair_dado_visita(df_visita, 'Ruídos e odores', col_aspecto, col_obs)}")
@@ -1153,98 +1550,73 @@ elif pagina_selecionada == "🤖 IA Chatbot":
         st.stop()
 
     try:
-        model_id = "google/gemma-2-9b-it" 
-        client = InferenceClient(model=model_id, token=hf_token)
+        model_id = MODELO_LLM
+        client = obter_cliente_llm(model_id, hf_token)
+    except ImportError as e:
+        st.error(f"Versão incompatível do huggingface_hub: {e}")
+        st.error("Instale as dependências de requirements.txt (huggingface-hub 2.x).")
+        st.stop()
     except Exception as e:
         st.error(f"Erro ao inicializar o cliente do Hugging Face: {e}")
         st.error("Verifique se você aceitou os termos do modelo 'google/gemma-2-9b-it' no site do Hugging Face.")
         st.stop()
+
+    agendador = agendador_llm(LLM_MAX_SIMULTANEAS, LLM_FILA_MAX)
+    id_sessao = st.session_state.setdefault('id_sessao', uuid.uuid4().hex)
+    contadores_fila = agendador['contadores']
+    st.sidebar.caption(
+        f"Fila do modelo: {agendador['em_voo']}/{agendador['limite']} em andamento · "
+        f"{profundidade_fila(agendador)} aguardando · {contadores_fila['rejeitadas']} recusadas · "
+        f"{contadores_fila['expiradas']} expiradas · {contadores_fila['retentativas']} retentativas"
+    )
     
     try:
         with st.spinner("Preparando o contexto para a IA..."):
-            contexto_resumo = "Nenhum resumo analítico encontrado."
-            if not dados['resumo_analitico'].empty:
-                col_dimensao_nome = encontrar_coluna(dados['resumo_analitico'], ['DIMENSÃO'])
-                if col_dimensao_nome: 
-                    df_resumo_limpo = dados['resumo_analitico'][~dados['resumo_analitico'][col_dimensao_nome].astype(str).str.contains('➡️|📍|^\s*-', na=False, regex=True)]
-                    df_resumo_limpo = df_resumo_limpo.iloc[:, 0:4].dropna(how='all')
-                    df_resumo_limpo = df_resumo_limpo.dropna(subset=[col_dimensao_nome])
-                    contexto_resumo = df_resumo_limpo.to_string()
-            
-            contexto_visita = "Nenhum relatório de visita encontrado."
-            if not dados['visita'].empty:
-                contexto_visita = dados['visita'].dropna(how='all').to_string()
-            
-            contexto_stakeholders = "Nenhum stakeholder encontrado."
-            df_eco_raw_ia = pd.DataFrame()
-            nome_real_economica_ia = None
-            
-            try:
-                uploaded_file.seek(0)
-                xls_ia = pd.ExcelFile(uploaded_file)
-                for sheet_name in xls_ia.sheet_names:
-                    if "kpis (econômica)" in sheet_name.lower():
-                        nome_real_economica_ia = sheet_name
-                        break
-            except Exception: pass 
-
-            if nome_real_economica_ia:
-                try:
-                    uploaded_file.seek(0)
-                    df_eco_raw_ia = pd.read_excel(uploaded_file, sheet_name=nome_real_economica_ia, header=None)
-                except Exception: pass 
-
-            if not df_eco_raw_ia.empty:
-                header_row_index_ia = -1
-                for i, row in df_eco_raw_ia.head(30).iterrows():
-                    row_values_ia = [clean_str(val) for val in row.values]
-                    has_instituicao_ia = any('instituição' in val or 'instituicao' in val for val in row_values_ia)
-                    has_potencial_ia = any('potencial' in val for val in row_values_ia)
-                    if has_instituicao_ia and has_potencial_ia:
-                        header_row_index_ia = i
-                        break
-                if header_row_index_ia != -1:
-                    df_stakeholders_ia = df_eco_raw_ia.loc[header_row_index_ia:].copy()
-                    header_values_ia = df_stakeholders_ia.iloc[0]
-                    new_cols_ia = []
-                    counts_ia = {}
-                    for col_ia in header_values_ia:
-                        col_name_ia = clean_str(col_ia)
-                        if col_name_ia == "nan" or col_name_ia == "": col_name_ia = "unnamed"
-                        if col_name_ia in counts_ia:
-                            counts_ia[col_name_ia] += 1
-                            new_cols_ia.append(f"{col_name_ia}_{counts_ia[col_name_ia]}")
-                        else:
-                            counts_ia[col_name_ia] = 0
-                            new_cols_ia.append(col_name_ia)
-                    df_stakeholders_ia.columns = new_cols_ia
-                    df_stakeholders_ia = df_stakeholders_ia.iloc[1:]
-                    col_inst_ia = encontrar_coluna(df_stakeholders_ia, ['instituição', 'instituicao'])
-                    col_pot_ia = encontrar_coluna(df_stakeholders_ia, ['potencial'])
-                    if col_inst_ia and col_pot_ia:
-                        df_stakeholders_ia = df_stakeholders_ia.dropna(subset=[col_inst_ia, col_pot_ia])
-                        contexto_stakeholders = df_stakeholders_ia.to_string()
-
-            contexto_dados = f"""
-            Métricas Chave:
-            - Média Física: {dados['metricas']['media_fisica']:.2f}, Média Social: {dados['metricas']['media_social']:.2f}, Média Ambiental: {dados['metricas']['media_ambiental']:.2f}
-            - Média Urbana: {dados['metricas']['media_urbana']:.2f}, Média Econômica: {dados['metricas']['media_economica']:.2f}, Média Sensorial: {dados['metricas']['media_sensorial']:.2f}
-            - Índice Territorial (IT) Total: {dados['metricas']['it_total']:.2f}
-            
-            Resumo das Estratégias: {contexto_resumo}
-            
-            Observações da Visita: {contexto_visita}
-            
-            Parceiros e Stakeholders: {contexto_stakeholders}
-            """
-            
-            st.session_state.contexto_dados = contexto_dados
+            contexto = contexto_chatbot(dados['hash'], dados)
+            indice_chatbot, prefixo_llm, dados_rapidos = contexto['indice'], contexto['prefixo'], contexto['rapido']
             
     except Exception as e:
         st.error(f"Erro ao montar o contexto para a IA. Detalhe: {e}")
-        if "contexto_dados" not in st.session_state:
-            st.session_state.contexto_dados = "Erro ao carregar dados."
-            
+        indice_chatbot, dados_rapidos = None, None
+        prefixo_llm = prefixo_prompt("Erro ao carregar dados.")
+
+    resumos = resumos_do_workbook(dados['hash'], model_id, LLM_BASE_URL)
+    with st.expander("📝 Resumos de todas as seções", expanded=bool(resumos['resumos'])):
+        st.caption("Um resumo da IA para cada dimensão, para a legislação e para a visita, gerados em paralelo.")
+        if st.button("Gerar todos os resumos", key="gerar_resumos"):
+            try:
+                contextos = contextos_das_secoes(dados)
+                with resumos['trava']:
+                    faltando = [secao for secao in contextos if secao not in resumos['resumos']]
+                pedidos = {
+                    secao: mensagens_resumo(prefixo_llm, secao, contextos[secao])
+                    for secao in faltando if contextos[secao]
+                }
+                for secao in faltando:
+                    if not contextos[secao]:
+                        st.warning(f"Seção '{secao}' sem dados na planilha; resumo não gerado.")
+                if pedidos:
+                    inicio = time.perf_counter()
+                    with st.spinner(f"Gerando {len(pedidos)} resumos em paralelo..."):
+                        resultados = asyncio.run(gerar_resumos_secoes(model_id, hf_token, agendador, id_sessao, pedidos))
+                    total = time.perf_counter() - inicio
+                    mais_lenta = 0.0
+                    for secao, resultado in resultados.items():
+                        if isinstance(resultado, BaseException):
+                            st.warning(f"Não foi possível gerar o resumo de '{secao}': {resultado}")
+                            continue
+                        _, texto, duracao = resultado
+                        mais_lenta = max(mais_lenta, duracao)
+                        with resumos['trava']:
+                            resumos['resumos'][secao] = texto
+                    st.caption(f"{len(pedidos)} resumos em {total:.1f} s (chamada mais lenta: {mais_lenta:.1f} s)")
+            except Exception as e:
+                st.error(f"Erro ao gerar os resumos. Detalhe: {e}")
+        for secao in [*DIMENSOES, "Legislativa", "Visita"]:
+            if secao in resumos['resumos']:
+                st.markdown(f"#### {secao}")
+                st.markdown(resumos['resumos'][secao])
+
     if "messages" not in st.session_state:
         st.session_state.messages = []
         st.session_state.messages.append({
@@ -1255,48 +1627,140 @@ elif pagina_selecionada == "🤖 IA Chatbot":
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
+            if message.get("cache"):
+                st.caption("⚡ Resposta reaproveitada do cache")
+            if message.get("rapida"):
+                st.caption("⚡ Resposta direta das métricas calculadas (sem chamada ao modelo)")
 
     if prompt := st.chat_input("Qual a sua pergunta?"):
         st.session_state.messages.append({"role": "user", "content": prompt})
         with st.chat_message("user"):
             st.markdown(prompt)
 
+        resposta_rapida = responder_rapido(prompt, dados_rapidos) if dados_rapidos else None
+        if resposta_rapida:
+            with st.chat_message("assistant"):
+                st.markdown(resposta_rapida)
+                st.caption("⚡ Resposta direta das métricas calculadas (sem chamada ao modelo)")
+            st.session_state.messages.append({"role": "assistant", "content": resposta_rapida, "rapida": True})
+            st.stop()
+
         try:
-            messages_for_api = []
-            
-            system_prompt = f"""Você é um assistente especialista em arquitetura e análise de viabilidade de terreno. Seu trabalho é ajudar a responder perguntas sobre um projeto.
-            
-            REGRAS IMPORTANTES:
-            1. Responda usando APENAS o contexto de dados fornecido.
-            2. Se a informação não estiver no contexto, diga "Essa informação não foi encontrada nos dados carregados".
-            3. Seja direto e profissional, como em uma apresentação.
-            
-            Contexto:
-            {st.session_state.contexto_dados}
-            """
-            
-            for msg in st.session_state.messages[1:-1]:
-                messages_for_api.append(msg)
+            # A pergunta fica com no máximo 1/4 do teto e o contexto com no máximo metade;
+            # o que sobrar é do histórico (janela recente + resumo).
+            pergunta_llm = limitar_tokens(prompt, LLM_TETO_ENTRADA // 4)
+            contexto_pergunta = montar_contexto_pergunta(
+                indice_chatbot, pergunta_llm,
+                orcamento=min(LLM_ORCAMENTO_CONTEXTO, LLM_TETO_ENTRADA // 2),
+            )
+            prefixo = mensagens_prefixo(prefixo_llm)
             
-            messages_for_api.append({
+            memoria = st.session_state.setdefault('memoria_conversa', {'linhas': [], 'resumidas': 0})
+            tokens_fixos = sum(estimar_tokens(m["content"]) for m in prefixo)
+            tokens_fixos += estimar_tokens(conteudo_pergunta(pergunta_llm, contexto_pergunta))
+            janela, resumo_conversa, tokens_memoria = montar_historico_llm(
+                st.session_state.messages[1:-1], memoria, tokens_fixos
+            )
+            messages_for_api = prefixo + janela + [{
                 "role": "user",
-                "content": f"{system_prompt}\n\nPERGUNTA:\n{prompt}"
-            })
+                "content": conteudo_pergunta(pergunta_llm, contexto_pergunta, resumo_conversa)
+            }]
+            tokens_entrada = sum(estimar_tokens(m["content"]) for m in messages_for_api)
             
-            with st.spinner("Analisando..."):
-                response = client.chat_completion(
-                    messages=messages_for_api,
-                    max_tokens=1024,
-                    temperature=0.5,
-                    top_p=0.95,
+            chave_cache = None
+            if cache_respostas_ativo(PARAMETROS_LLM):
+                chave_cache = chave_resposta(
+                    prompt, prefixo_llm + contexto_pergunta, model_id, PARAMETROS_LLM, janela, resumo_conversa
                 )
-                
-                resposta_ia = response.choices[0].message.content
+            em_cache = ler_resposta_cache(chave_cache) if chave_cache else None
+
+            if em_cache:
+                resposta_ia = em_cache['resposta']
+                with st.chat_message("assistant"):
+                    st.markdown(resposta_ia)
+                    gerada_em = datetime.datetime.fromtimestamp(em_cache['criado']).strftime('%d/%m %H:%M')
+                    st.caption(f"⚡ Resposta reaproveitada do cache (gerada em {gerada_em})")
+                st.session_state.messages.append({"role": "assistant", "content": resposta_ia, "cache": True})
+            else:
+                with st.chat_message("assistant"):
+                    aguardando = st.empty()
+                    aguardando.caption("Analisando...")
+                    ticket = entrar_fila(agendador, id_sessao)
+
+                    def mostrar_fila(posicao, espera):
+                        aguardando.caption(f"⏳ Na fila do modelo: posição {posicao} · aguardando há {espera:.0f} s")
+
+                    def mostrar_retentativa(tentativa, espera, erro):
+                        aguardando.caption(f"Serviço ocupado; nova tentativa {tentativa}/{LLM_TENTATIVAS} em {espera:.1f} s...")
+
+                    if ticket is None or not aguardar_vez(agendador, ticket, mostrar_fila):
+                        aguardando.empty()
+                        resposta_ia = None
+                        st.warning(AVISO_FILA)
+                    else:
+                        # Daqui em diante a vaga é desta mensagem: qualquer chamada st.* pode levantar o
+                        # rerun/stop do Streamlit, então tudo até o fim do stream fica dentro do try.
+                        try:
+                            espera_fila = time.monotonic() - ticket['entrada']
+                            aguardando.caption("Analisando...")
+                            medicao = {'inicio': time.perf_counter()}
+
+                            def fluxo_resposta():
+                                # Renderiza os tokens à medida que chegam; guarda o tempo até o primeiro token.
+                                # Com stream=True a requisição sai na chamada, então 429/5xx são repetidos
+                                # antes de qualquer token aparecer.
+                                resposta = chamar_com_retentativas(
+                                    lambda: client.chat_completion(
+                                        messages=messages_for_api,
+                                        model=model_id if LLM_BASE_URL else None,
+                                        stream=True,
+                                        **PARAMETROS_LLM,
+                                    ),
+                                    agendador,
+                                    mostrar_retentativa,
+                                )
+                                for pedaco in resposta:
+                                    if not pedaco.choices:
+                                        continue
+                                    texto = pedaco.choices[0].delta.content
+                                    if texto:
+                                        if 'primeiro_token' not in medicao:
+                                            medicao['primeiro_token'] = time.perf_counter() - medicao['inicio']
+                                            aguardando.empty()
+                                        yield texto
+
+                            resposta_ia = st.write_stream(fluxo_resposta())
+                        finally:
+                            retirar_da_fila(agendador, ticket)
+                        aguardando.empty()
+                        if not isinstance(resposta_ia, str):
+                            resposta_ia = "".join(str(parte) for parte in resposta_ia)
+
+                        medicao['total'] = time.perf_counter() - medicao['inicio']
+                        st.session_state.setdefault('metricas_llm', []).append({
+                            'primeiro_token_s': medicao.get('primeiro_token'),
+                            'total_s': medicao['total'],
+                            'espera_fila_s': espera_fila,
+                            'caracteres': len(resposta_ia),
+                            'tokens_entrada': tokens_entrada,
+                            'tokens_historico': tokens_memoria['historico'],
+                            'tokens_resumo': tokens_memoria['resumo'],
+                        })
+                        if medicao.get('primeiro_token') is not None:
+                            st.caption(f"Primeiro token em {medicao['primeiro_token']:.2f} s · resposta completa em {medicao['total']:.2f} s")
+                        if espera_fila >= 0.5:
+                            st.caption(f"Aguardou {espera_fila:.1f} s na fila do modelo")
+                        st.caption(
+                            f"Entrada: ~{tokens_entrada} tokens (histórico {tokens_memoria['historico']}, "
+                            f"resumo {tokens_memoria['resumo']}) · teto {LLM_TETO_ENTRADA}"
+                        )
+                if resposta_ia is None:
+                    st.session_state.messages.append({"role": "assistant", "content": AVISO_FILA})
+                else:
+                    st.session_state.messages.append({"role": "assistant", "content": resposta_ia})
+                    if chave_cache and resposta_ia:
+                        gravar_resposta_cache(chave_cache, resposta_ia)
             
-            with st.chat_message("assistant"):
-                st.markdown(resposta_ia)
-            st.session_state.messages.append({"role": "assistant", "content": resposta_ia})
-        
         except Exception as e:
             erro_real = f"Erro DETALHADO do Hugging Face: {e}"
             st.error(erro_real)
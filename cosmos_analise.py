@@ -0,0 +1,785 @@
+import argparse
+import concurrent.futures
+import functools
+import glob
+import io
+import json
+import math
+import os
+import re
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+# Núcleo de análise das planilhas de KPIs do Studio Cosmos, sem Streamlit: leitura das abas,
+# métricas (médias e Índice Territorial), drivers da matriz e comparativo legislativo. Avisos e
+# erros não são exibidos aqui; vão para a lista `diagnosticos` como (nivel, mensagem), com
+# nivel 'erro' ou 'aviso', e quem chama decide como mostrar (o app.py usa st.error/st.warning).
+#
+#   python cosmos_analise.py planilha.xlsx > resultado.json
+#   python cosmos_analise.py pasta/ "outros/*.xlsx" --ranking ranking.csv
+
+MOTOR_EXCEL = os.environ.get("COSMOS_EXCEL_ENGINE", "auto")
+
+ESQUEMA_DIMENSAO = {
+    'escala': ['ESCALA (0–5)', 'ESCALA'],
+    'indicador': ['INDICADOR'],
+    'analise': ['ANÁLISE', 'ANALISE'],
+    'projeto': ['RELAÇÃO COM O PROJETO', 'RELAÇÃO'],
+    'mapa': ['MAPA CORRESPONDENTE', 'MAPA'],
+}
+
+ESQUEMA_MATRIZ = {
+    'indicador': ['INDICADOR'],
+    'valor_ponderado': ['VALOR PONDERADO'],
+    'escala': ['ESCALA'],
+    'peso': ['PESO'],
+}
+
+ESQUEMA_VISITA = {
+    'aspecto': ['ASPECTO / DADO'],
+    'obs': ['OBSERVAÇÕES / RESPOSTAS'],
+}
+
+ESQUEMA_RESUMO = {
+    'dimensao': ['DIMENSÃO'],
+    'situacao': ['SITUAÇÃO'],
+    'potencial': ['POTENCIAL'],
+    'estrategia': ['ESTRATÉGIA'],
+}
+
+ESQUEMA_STAKEHOLDERS = {
+    'instituicao': ['instituição', 'instituicao'],
+    'potencial': ['potencial'],
+    'localizacao': ['localização', 'localizacao'],
+}
+
+ESQUEMA_PARAMETROS = {
+    'indicador': ['indicador'],
+    'valor': ['valor indicado'],
+}
+
+ESQUEMA_USOS = {
+    'usos': ['usos'],
+    'adequacao': ['adequação', 'adequacao'],
+    'indicador': ['indicador'],
+}
+
+@functools.lru_cache(maxsize=512)
+def resolver_esquema_cabecalho(colunas, esquema):
+    # Memoizado pela impressão do template (a tupla do cabeçalho): o mesmo template
+    # carregado de novo não refaz a busca.
+    colunas_limpas = [str(col).lower() for col in colunas]
+    mapa = {}
+    for campo, nomes_possiveis in esquema:
+        mapa[campo] = None
+        for nome in nomes_possiveis:
+            nome_limpo = nome.lower()
+            posicao = next((j for j, col_limpa in enumerate(colunas_limpas) if nome_limpo in col_limpa), None)
+            if posicao is not None:
+                mapa[campo] = colunas[posicao]
+                break
+    return mapa
+
+def resolver_colunas(df, esquema):
+    esquema_congelado = tuple((campo, tuple(nomes)) for campo, nomes in esquema.items())
+    return dict(resolver_esquema_cabecalho(tuple(df.columns), esquema_congelado))
+
+def encontrar_coluna(df, nomes_possiveis):
+    return resolver_colunas(df, {'coluna': nomes_possiveis})['coluna']
+
+def extrair_dado_visita(df, aspecto_procurado, col_aspecto, col_obs):
+    try:
+        resultado = df[df[col_aspecto].str.contains(aspecto_procurado, case=False, na=False)]
+        if not resultado.empty:
+            valor = resultado.iloc[0][col_obs]
+            if pd.isna(valor) or str(valor).strip() == "":
+                return "N/A"
+            return str(valor)
+    except Exception as e:
+        pass
+    return "N/A"
+
+def extrair_primeiro_numero(texto):
+    if not isinstance(texto, str):
+        return None
+    
+    match = re.search(r'(\d[\d.,]*)', str(texto))
+    if not match:
+        return None
+    
+    texto_limpo = match.group(1)
+    
+    num_dots = texto_limpo.count('.')
+    num_commas = texto_limpo.count(',')
+
+    if num_dots > 0 and num_commas > 0:
+        if texto_limpo.rfind('.') > texto_limpo.rfind(','):
+            texto_limpo = texto_limpo.replace(',', '')
+        else:
+            texto_limpo = texto_limpo.replace('.', '').replace(',', '.')
+    
+    elif num_commas > 0:
+        if num_commas == 1 and len(texto_limpo.split(',')[-1]) == 3:
+             texto_limpo = texto_limpo.replace(',', '')
+        else:
+             texto_limpo = texto_limpo.replace(',', '.')
+
+    elif num_dots > 0:
+        if num_dots == 1 and len(texto_limpo.split('.')[-1]) == 3:
+             texto_limpo = texto_limpo.replace('.', '')
+        else:
+             pass 
+
+    try:
+        return float(texto_limpo)
+    except ValueError:
+        return None
+
+
+def clean_str(s):
+    return str(s).lower().strip()
+
+MAPEAMENTO_ABAS = {
+    'urbana': 'KPIs (Urbana)',
+    'ambiental': 'KPIs (Ambiental)',
+    'social': 'KPIs (Social)',
+    'economica': 'KPIs (Econômica)',
+    'fisica': 'KPIs (Física)',
+    'sensorial': 'KPIs (Sensorial)',
+    'leg_ade': 'KPIs (Legislativa) - ADE',
+    'leg_zr3': 'KPIs (Legislativa) - ZR3',
+    'visita': 'Dados de campo (Relatório)',
+    'matriz': 'Matriz, pesos e índices',
+    'resumo_analitico': 'Resumo analítico' 
+}
+
+def linhas_da_grade(df_raw):
+    # Volta a grade bruta (header=None) para as células como o leitor do pandas as entrega:
+    # vazio vira "" e números inteiros voltam a ser int (o openpyxl já converte 3.0 em 3).
+    linhas = df_raw.astype(object).where(df_raw.notna(), "").values.tolist()
+    return [
+        [int(val) if isinstance(val, float) and val.is_integer() else val for val in linha]
+        for linha in linhas
+    ]
+
+def derivar_tabela(df_raw):
+    # Equivalente a pd.read_excel(..., header=0), mas a partir da grade já lida em memória.
+    if df_raw.empty:
+        return pd.DataFrame()
+    parser = TextParser(linhas_da_grade(df_raw), header=0, skip_blank_lines=False)
+    try:
+        return parser.read()
+    finally:
+        parser.close()
+
+def ler_grade(linhas):
+    if not linhas:
+        return pd.DataFrame()
+    parser = TextParser(linhas, header=None, skip_blank_lines=False)
+    try:
+        return parser.read()
+    finally:
+        parser.close()
+
+MOTORES_EXCEL = ('calamine', 'streaming', 'openpyxl')
+ERROS_EXCEL = {'#NULL!', '#DIV/0!', '#VALUE!', '#REF!', '#NAME?', '#NUM!', '#N/A', '#GETTING_DATA'}
+
+def calamine_disponivel():
+    try:
+        import python_calamine
+    except ImportError:
+        return False
+    return True
+
+def escolher_motor_excel(motor=None):
+    motor = str(motor or MOTOR_EXCEL).strip().lower()
+    if motor not in MOTORES_EXCEL or (motor == 'calamine' and not calamine_disponivel()):
+        return 'calamine' if calamine_disponivel() else 'streaming'
+    return motor
+
+def converter_celula(val):
+    # Mesmas regras do leitor openpyxl do pandas, mas sem objetos de célula (values_only).
+    if val is None:
+        return ""
+    if isinstance(val, float) and val.is_integer():
+        return int(val)
+    if isinstance(val, str) and val in ERROS_EXCEL:
+        return np.nan
+    return val
+
+def linhas_streaming(aba):
+    aba.reset_dimensions()
+    linhas = []
+    ultima_com_dados = -1
+    for numero, linha in enumerate(aba.iter_rows(values_only=True)):
+        convertida = [converter_celula(val) for val in linha]
+        while convertida and convertida[-1] == "":
+            convertida.pop()
+        if convertida:
+            ultima_com_dados = numero
+        linhas.append(convertida)
+    linhas = linhas[:ultima_com_dados + 1]
+    if linhas:
+        largura = max(len(linha) for linha in linhas)
+        linhas = [linha + [""] * (largura - len(linha)) for linha in linhas]
+    return linhas
+
+def ler_grades_excel(ficheiro_carregado, motor=None, diagnosticos=None, abas=None):
+    # abas: chaves de MAPEAMENTO_ABAS a ler (padrão: todas); as demais voltam vazias.
+    motor = escolher_motor_excel(motor)
+    diagnosticos = [] if diagnosticos is None else diagnosticos
+    livro = None
+    try:
+        ficheiro_carregado.seek(0)
+        if motor == 'streaming':
+            from openpyxl import load_workbook
+            livro = load_workbook(ficheiro_carregado, read_only=True, data_only=True, keep_links=False)
+            nomes_das_abas = [aba.title for aba in livro.worksheets]
+        else:
+            xls = pd.ExcelFile(ficheiro_carregado, engine=motor)
+            nomes_das_abas = xls.sheet_names
+    except Exception as e:
+        diagnosticos.append(('erro', f"Erro ao ler a estrutura do arquivo Excel: {e}"))
+        if livro is not None:
+            livro.close()
+        return None
+
+    abas_brutas = {}
+    
+    mapa_nomes_reais = {}
+    for chave, nome_parcial in MAPEAMENTO_ABAS.items():
+        if abas is not None and chave not in abas:
+            continue
+        nome_encontrado = next((nome_aba for nome_aba in nomes_das_abas if nome_parcial.lower() in nome_aba.lower()), None)
+        if nome_encontrado:
+            mapa_nomes_reais[chave] = nome_encontrado
+        else:
+            diagnosticos.append(('aviso', f"Aviso: Não foi possível encontrar a aba que contém '{nome_parcial}'"))
+
+    if mapa_nomes_reais:
+        nomes_para_ler = list(dict.fromkeys(mapa_nomes_reais.values()))
+        try:
+            if motor == 'streaming':
+                grades = {nome: ler_grade(linhas_streaming(livro[nome])) for nome in nomes_para_ler}
+            else:
+                grades = pd.read_excel(xls, sheet_name=nomes_para_ler, header=None)
+            for chave, nome_real in mapa_nomes_reais.items():
+                abas_brutas[chave] = grades[nome_real]
+        except Exception as e:
+            diagnosticos.append(('erro', f"Erro ao ler as abas do Excel: {e}"))
+    if livro is not None:
+        livro.close()
+
+    for chave in MAPEAMENTO_ABAS:
+        abas_brutas.setdefault(chave, pd.DataFrame())
+    return abas_brutas
+
+def calcular_metricas(abas_encontradas, diagnosticos=None):
+    diagnosticos = [] if diagnosticos is None else diagnosticos
+    metricas = {}
+    
+    for chave in ['fisica', 'social', 'urbana', 'ambiental', 'economica', 'sensorial']:
+        df = abas_encontradas[chave]
+        col_escala = encontrar_coluna(df, ['ESCALA (0–5)', 'ESCALA'])
+        if df.empty or not col_escala:
+            metricas[f'media_{chave}'] = 0
+        else:
+            metricas[f'media_{chave}'] = df[col_escala].mean()
+    
+    df_matriz = abas_encontradas['matriz']
+    metricas['it_total'] = 0.0
+    
+    if not df_matriz.empty:
+        try:
+            col_vp = encontrar_coluna(df_matriz, ['VALOR PONDERADO', 'VALOR'])
+            
+            if col_vp:
+                valores_ponderados = pd.to_numeric(df_matriz[col_vp], errors='coerce')
+                soma_total = valores_ponderados.dropna().sum()
+                metricas['it_total'] = soma_total
+                
+                if soma_total == 0:
+                    diagnosticos.append(('aviso', "A coluna 'VALOR PONDERADO' foi encontrada, mas a soma é 0. Verifique os dados."))
+            else:
+                diagnosticos.append(('erro', "Não foi possível encontrar a coluna 'VALOR PONDERADO' na aba 'Matriz' para calcular o Índice."))
+                metricas['it_total'] = 0.0
+                
+        except Exception as e:
+            metricas['it_total'] = 0.0
+            diagnosticos.append(('erro', f"Erro ao CALCULAR o Índice Territorial a partir da 'Matriz': {e}"))
+
+    return metricas
+
+def montar_dados(abas_brutas, metricas=None, diagnosticos=None):
+    # Das grades brutas (header=None) às tabelas que o app e a CLI usam. Com `metricas` (ex.: do
+    # cache em disco) o cálculo do índice é pulado.
+    abas_encontradas = {chave: derivar_tabela(df_raw) for chave, df_raw in abas_brutas.items()}
+
+    for chave in ['fisica', 'social', 'urbana', 'ambiental', 'economica', 'sensorial']:
+        df = abas_encontradas[chave]
+        col_escala = encontrar_coluna(df, ['ESCALA (0–5)', 'ESCALA'])
+        if not df.empty and col_escala:
+            df[col_escala] = pd.to_numeric(df[col_escala], errors='coerce')
+            abas_encontradas[chave] = df.dropna(subset=[col_escala])
+
+    if metricas is None:
+        metricas = calcular_metricas(abas_encontradas, diagnosticos)
+
+    abas_encontradas['brutas'] = abas_brutas
+    abas_encontradas['stakeholders'] = extrair_stakeholders(abas_brutas['economica'])
+    abas_encontradas['metricas'] = metricas
+    return abas_encontradas
+
+def tabela_drivers(df_matriz):
+    colunas_matriz = resolver_colunas(df_matriz, ESQUEMA_MATRIZ)
+    col_indicador = colunas_matriz['indicador']
+    col_vp = colunas_matriz['valor_ponderado']
+    if not (col_indicador and col_vp):
+        return None
+
+    df_drivers = df_matriz.dropna(subset=[col_indicador, col_vp])
+    df_drivers = df_drivers[~df_drivers[col_indicador].str.contains('Índice|Interpretação', na=False, case=False)]
+    
+    col_escala = colunas_matriz['escala']
+    col_peso = colunas_matriz['peso']
+    cols_to_show = [col_indicador, col_escala, col_peso, col_vp]
+    cols_existentes = [col for col in cols_to_show if col in df_drivers.columns]
+    
+    df_drivers_show = df_drivers[cols_existentes].copy()
+    df_drivers_show[col_vp] = pd.to_numeric(df_drivers_show[col_vp], errors='coerce')
+    return df_drivers_show.sort_values(by=col_vp, ascending=False)
+
+DIMENSOES = {
+    'Urbana': 'urbana',
+    'Ambiental': 'ambiental',
+    'Social': 'social',
+    'Econômica': 'economica',
+    'Física': 'fisica',
+    'Sensorial': 'sensorial',
+}
+
+SECOES_LEGISLATIVA = {
+    'parametros': {'exatas': ['indicador', 'valor indicado'], 'parar_em': 'usos'},
+    'usos': {'exatas': ['usos'], 'contem': [['adequação', 'adequacao']]},
+}
+
+SECAO_STAKEHOLDERS = {
+    'stakeholders': {'contem': [['instituição', 'instituicao'], ['potencial']]},
+}
+
+def normalizar_grade(df_raw):
+    # Equivale a aplicar clean_str em todas as células, mas numa única passada do numpy.
+    if df_raw.empty:
+        return np.empty((0, 0), dtype=str)
+    return np.char.strip(np.char.lower(df_raw.to_numpy(dtype=object).astype(str)))
+
+def localizar_secoes(df_raw, buscas, grade=None):
+    # buscas: {nome: regra}. Cada regra pode ter 'exatas' (células iguais à palavra),
+    # 'contem' (grupos de alternativas contidas em alguma célula), 'prefixo' (início da
+    # primeira coluna), 'limite' (linhas examinadas, padrão 30) e 'parar_em' (primeira
+    # linha depois do cabeçalho que contém o texto). Devolve {nome: (cabecalho, parada)},
+    # com -1 quando não encontrado.
+    if grade is None:
+        grade = normalizar_grade(df_raw)
+    secoes = {}
+    for nome, regra in buscas.items():
+        topo = grade[:regra.get('limite', 30)]
+        mascara = np.ones(len(topo), dtype=bool)
+        for palavra in regra.get('exatas', []):
+            mascara &= (topo == palavra).any(axis=1)
+        for alternativas in regra.get('contem', []):
+            mascara &= np.logical_or.reduce([(np.char.find(topo, alt) >= 0).any(axis=1) for alt in alternativas])
+        if 'prefixo' in regra:
+            if topo.shape[1] == 0:
+                mascara[:] = False
+            else:
+                mascara &= np.char.startswith(topo[:, 0], regra['prefixo'].lower())
+
+        cabecalho = int(mascara.argmax()) if mascara.any() else -1
+        parada = -1
+        if cabecalho != -1 and 'parar_em' in regra:
+            linhas_parada = (np.char.find(grade[cabecalho + 1:], regra['parar_em']) >= 0).any(axis=1)
+            if linhas_parada.any():
+                parada = cabecalho + 1 + int(linhas_parada.argmax())
+        secoes[nome] = (cabecalho, parada)
+    return secoes
+
+def processar_tabela_parametros(df_raw, secoes=None):
+    if secoes is None:
+        secoes = localizar_secoes(df_raw, SECOES_LEGISLATIVA)
+    header_row_idx, stop_row_idx = secoes['parametros']
+    
+    if header_row_idx == -1:
+        return pd.DataFrame() 
+
+    df_processado = df_raw.loc[header_row_idx:].copy()
+    new_cols = [clean_str(col) if pd.notna(col) else f"unnamed_{j}" for j, col in enumerate(df_processado.iloc[0])]
+    df_processado.columns = new_cols
+    df_processado = df_processado.iloc[1:].reset_index(drop=True)
+    
+    if stop_row_idx != -1:
+        df_processado = df_processado.loc[:stop_row_idx - header_row_idx - 2]
+        
+    df_processado = df_processado.dropna(how='all')
+    return df_processado
+
+def processar_tabela_usos(df_raw, secoes=None):
+    col_usos_str = 'usos'
+
+    if secoes is None:
+        secoes = localizar_secoes(df_raw, SECOES_LEGISLATIVA)
+    header_row_idx = secoes['usos'][0]
+    
+    if header_row_idx == -1:
+        return pd.DataFrame() 
+
+    df_processado = df_raw.loc[header_row_idx:].copy()
+    new_cols = [clean_str(col) if pd.notna(col) else f"unnamed_{j}" for j, col in enumerate(df_processado.iloc[0])]
+    df_processado.columns = new_cols
+    df_processado = df_processado.iloc[1:].reset_index(drop=True)
+
+    colunas = resolver_colunas(df_processado, ESQUEMA_USOS)
+    col_adeq_final = colunas['adequacao']
+    col_usos_final = colunas['usos']
+    col_indicador_final = colunas['indicador']
+
+    if col_adeq_final and col_usos_final:
+        df_processado[col_adeq_final] = df_processado[col_adeq_final].replace(r'^\s*$', np.nan, regex=True)
+        df_processado[col_adeq_final] = df_processado[col_adeq_final].fillna('Inadequado')
+        df_processado = df_processado.dropna(subset=[col_usos_final])
+        df_processado = df_processado[~df_processado[col_usos_final].str.contains(col_usos_str, case=False, na=False)]
+        if col_indicador_final:
+             df_processado = df_processado[~df_processado[col_indicador_final].str.contains('adequação dos usos', case=False, na=False)]
+    
+    df_processado = df_processado.dropna(how='all')
+    return df_processado
+
+POTENCIAL_NUMERICO = {'Alto': 3, 'Médio': 2, 'Baixo': 1}
+
+def extrair_stakeholders(df_eco_raw):
+    # Tabela INSTITUIÇÃO / POTENCIAL / LOCALIZAÇÃO da aba Econômica, extraída uma vez por
+    # pasta de trabalho. 'situacao' diz até onde a extração chegou.
+    resultado = {
+        'situacao': 'sem_dados',
+        'tabela': pd.DataFrame(),
+        'colunas': {campo: None for campo in ESQUEMA_STAKEHOLDERS},
+    }
+    if df_eco_raw.empty:
+        return resultado
+
+    header_row_index = localizar_secoes(df_eco_raw, SECAO_STAKEHOLDERS)['stakeholders'][0]
+    if header_row_index == -1:
+        resultado['situacao'] = 'sem_cabecalho'
+        return resultado
+
+    df_stakeholders = df_eco_raw.loc[header_row_index:].copy()
+    nomes = pd.Series([clean_str(col) for col in df_stakeholders.iloc[0]]).replace({'nan': 'unnamed', '': 'unnamed'})
+    repeticao = nomes.groupby(nomes).cumcount()
+    df_stakeholders.columns = nomes.where(repeticao == 0, nomes + '_' + repeticao.astype(str)).tolist()
+    df_stakeholders = df_stakeholders.iloc[1:]
+
+    colunas = resolver_colunas(df_stakeholders, ESQUEMA_STAKEHOLDERS)
+    resultado['colunas'] = colunas
+    col_inst_nome, col_pot_nome = colunas['instituicao'], colunas['potencial']
+    if not (col_inst_nome and col_pot_nome):
+        resultado['situacao'] = 'sem_colunas'
+        return resultado
+
+    df_stakeholders = df_stakeholders.dropna(subset=[col_inst_nome, col_pot_nome])
+    potencial_texto = df_stakeholders[col_pot_nome].astype(str)
+    df_stakeholders['Potencial_Num'] = potencial_texto.str.title().map(POTENCIAL_NUMERICO).fillna(0).astype(int)
+    df_stakeholders['Topicos'] = [[t.strip() for t in texto.split('\n') if t.strip()] for texto in potencial_texto]
+
+    resultado['situacao'] = 'ok'
+    resultado['tabela'] = df_stakeholders
+    return resultado
+
+def processar_tabela_infra(df_raw, start_keyword):
+    header_row_idx = localizar_secoes(df_raw, {'infra': {'prefixo': start_keyword, 'limite': 40}})['infra'][0]
+    if header_row_idx != -1:
+        header_row_idx += 1
+            
+    if header_row_idx == -1 or header_row_idx >= len(df_raw):
+        return pd.DataFrame()
+
+    df_processado = df_raw.loc[header_row_idx:].copy()
+    
+    new_cols = [clean_str(col) if pd.notna(col) else f"unnamed_{j}" for j, col in enumerate(df_processado.iloc[0])]
+    df_processado.columns = new_cols
+    df_processado = df_processado.iloc[1:].reset_index(drop=True)
+
+    all_nan_rows = df_processado.isnull().all(axis=1)
+    if all_nan_rows.any():
+        first_nan_row = all_nan_rows.idxmax()
+        df_processado = df_processado.loc[:first_nan_row-1]
+        
+    df_processado = df_processado.loc[:, ~df_processado.columns.str.startswith('unnamed')]
+    df_processado = df_processado.dropna(how='all')
+    
+    col_indicador = encontrar_coluna(df_processado, ['indicador'])
+    if col_indicador:
+        df_processado = df_processado.dropna(subset=[col_indicador])
+        df_processado = df_processado.set_index(col_indicador)
+
+    return df_processado
+
+PARAMETROS_NUMERICOS_COMUNS = [
+    'taxa de ocupação', 
+    'coeficiente de aproveitamento', 
+    'taxa de permeabilidade',
+    'área mínima de lote',
+    'testada mínima',
+    'afast. frontal',
+    'afast. lateral'
+]
+
+ZONAS_LEGISLATIVA = {'leg_ade': "ADE (Local)", 'leg_zr3': "ZR3 (Entorno)"}
+
+def comparar_parametros(df_ade_params, df_zr3_params):
+    # Valores numéricos dos parâmetros comuns às duas zonas, no formato do gráfico comparativo.
+    # None quando as colunas 'Indicador'/'Valor Indicado' não são encontradas.
+    colunas_param_ade = resolver_colunas(df_ade_params, ESQUEMA_PARAMETROS)
+    colunas_param_zr3 = resolver_colunas(df_zr3_params, ESQUEMA_PARAMETROS)
+    col_param_ade = colunas_param_ade['indicador']
+    col_valor_ade = colunas_param_ade['valor']
+    col_param_zr3 = colunas_param_zr3['indicador']
+    col_valor_zr3 = colunas_param_zr3['valor']
+    if not (col_param_ade and col_valor_ade and col_param_zr3 and col_valor_zr3):
+        return None
+
+    dados_grafico = []
+    for param_nome in PARAMETROS_NUMERICOS_COMUNS:
+        val_ade = extrair_dado_visita(df_ade_params, param_nome, col_param_ade, col_valor_ade)
+        val_zr3 = extrair_dado_visita(df_zr3_params, param_nome, col_param_zr3, col_valor_zr3)
+
+        num_ade = extrair_primeiro_numero(val_ade)
+        num_zr3 = extrair_primeiro_numero(val_zr3)
+
+        param_nome_formatado = param_nome.replace('taxa de ', 'T. ').replace('coeficiente de ', 'C. ').replace('afast. ', 'A. ').replace('área mínima de ', 'Área Mín. ').title()
+
+        if num_ade is not None:
+            dados_grafico.append({"Parâmetro": param_nome_formatado, "Zoneamento": "ADE (Local)", "Valor": num_ade})
+        if num_zr3 is not None:
+            dados_grafico.append({"Parâmetro": param_nome_formatado, "Zoneamento": "ZR3 (Entorno)", "Valor": num_zr3})
+    return dados_grafico
+
+def classificar_usos(df, col_usos, col_adeq):
+    df_usos = df.dropna(subset=[col_usos])
+    df_usos = df_usos.copy()
+    
+    df_usos['Categoria'] = df_usos[col_adeq].fillna('Inadequado').astype(str).str.strip().str.title()
+    df_usos['Categoria'] = df_usos['Categoria'].replace(['Nan', 'Não Adequado', ''], 'Inadequado')
+    return {categoria: df_usos[df_usos['Categoria'] == categoria][col_usos] for categoria in ('Adequado', 'Proibido', 'Inadequado')}
+
+def analisar_legislacao(abas_brutas, diagnosticos=None):
+    diagnosticos = [] if diagnosticos is None else diagnosticos
+    if any(abas_brutas[chave].empty for chave in ZONAS_LEGISLATIVA):
+        diagnosticos.append(('aviso', "Abas de Legislação estão vazias ou não puderam ser lidas."))
+        return None
+
+    parametros, usos = {}, {}
+    for chave, zona in ZONAS_LEGISLATIVA.items():
+        secoes = localizar_secoes(abas_brutas[chave], SECOES_LEGISLATIVA)
+        parametros[zona] = processar_tabela_parametros(abas_brutas[chave], secoes)
+        df_usos = processar_tabela_usos(abas_brutas[chave], secoes)
+        colunas_usos = resolver_colunas(df_usos, ESQUEMA_USOS)
+        if df_usos.empty:
+            diagnosticos.append(('erro', f"Não foi possível localizar a tabela (cabeçalho 'USOS' e 'ADEQUAÇÃO') na aba de legislação {zona}."))
+        elif not (colunas_usos['usos'] and colunas_usos['adequacao']):
+            diagnosticos.append(('erro', f"Tabela de Usos de {zona} encontrada, mas os nomes das colunas 'USOS' ou 'ADEQUAÇÃO' não puderam ser confirmados."))
+        else:
+            categorias = classificar_usos(df_usos, colunas_usos['usos'], colunas_usos['adequacao'])
+            usos[zona] = {categoria: [str(uso) for uso in serie] for categoria, serie in categorias.items()}
+
+    comparativo = comparar_parametros(*parametros.values())
+    if comparativo is None:
+        diagnosticos.append(('erro', "Não foi possível encontrar as colunas de 'Indicador' ou 'Valor Indicado' nas tabelas de parâmetros de legislação."))
+    return {'parametros': comparativo or [], 'usos': usos}
+
+def valor_json(valor):
+    if isinstance(valor, np.generic):
+        valor = valor.item()
+    if valor is None or valor is pd.NA or valor is pd.NaT:
+        return None
+    if isinstance(valor, float) and not math.isfinite(valor):
+        return None
+    return valor
+
+def registros_json(df):
+    colunas = [str(col) for col in df.columns]
+    return [
+        {coluna: valor_json(valor) for coluna, valor in zip(colunas, linha)}
+        for linha in df.itertuples(index=False, name=None)
+    ]
+
+def analisar_workbook(origem, motor=None):
+    # Análise completa de uma planilha (caminho ou arquivo binário): métricas, drivers do Índice
+    # Territorial e comparativo legislativo, prontos para JSON, com os diagnósticos da leitura.
+    diagnosticos = []
+    nome = os.fspath(origem) if isinstance(origem, (str, os.PathLike)) else getattr(origem, 'name', None)
+    resultado = {'arquivo': nome, 'ok': False, 'metricas': None, 'drivers': None, 'legislativo': None}
+    try:
+        if isinstance(origem, (str, os.PathLike)):
+            with open(origem, 'rb') as f:
+                origem = io.BytesIO(f.read())
+        abas_brutas = ler_grades_excel(origem, motor, diagnosticos)
+        if abas_brutas is not None:
+            dados = montar_dados(abas_brutas, diagnosticos=diagnosticos)
+            drivers = tabela_drivers(dados['matriz'])
+            resultado['metricas'] = {chave: valor_json(valor) for chave, valor in dados['metricas'].items()}
+            resultado['drivers'] = registros_json(drivers) if drivers is not None else None
+            resultado['legislativo'] = analisar_legislacao(abas_brutas, diagnosticos)
+            resultado['ok'] = True
+    except Exception as e:
+        diagnosticos.append(('erro', f"Erro Crítico ao processar o Excel: {e}"))
+    resultado['diagnosticos'] = [{'nivel': nivel, 'mensagem': mensagem} for nivel, mensagem in diagnosticos]
+    return resultado
+
+COLUNAS_RANKING = [
+    'it_total', 'media_fisica', 'media_economica', 'media_social', 'media_urbana', 'media_ambiental', 'media_sensorial',
+]
+ABAS_PONTUACAO = ('urbana', 'ambiental', 'social', 'economica', 'fisica', 'sensorial', 'matriz')
+
+def arquivos_do_lote(entradas):
+    # Cada entrada pode ser um arquivo, uma pasta (os .xlsx dela) ou um padrão glob ("**" vale).
+    # Arquivos de trava do Excel (~$...) ficam de fora.
+    arquivos = []
+    for entrada in entradas:
+        if os.path.isdir(entrada):
+            candidatos = glob.glob(os.path.join(glob.escape(entrada), "*.xlsx"))
+        elif any(c in entrada for c in "*?["):
+            candidatos = glob.glob(entrada, recursive=True)
+        else:
+            candidatos = [entrada]
+        arquivos += sorted(c for c in candidatos if not os.path.basename(c).startswith("~$"))
+    return list(dict.fromkeys(arquivos))
+
+def pontuar_planilha(caminho, motor=None):
+    # Unidade de trabalho do lote, executada num processo do pool: lê só as abas das médias e da
+    # matriz. Qualquer diagnóstico de erro (ex.: IT não calculado) marca a planilha como falha,
+    # sem valores, e não derruba o lote.
+    inicio = time.perf_counter()
+    diagnosticos = []
+    linha = {'arquivo': os.fspath(caminho), 'ok': False, **{coluna: None for coluna in COLUNAS_RANKING}}
+    try:
+        with open(caminho, 'rb') as f:
+            abas_brutas = ler_grades_excel(io.BytesIO(f.read()), motor, diagnosticos, abas=ABAS_PONTUACAO)
+        if abas_brutas is not None:
+            metricas = montar_dados(abas_brutas, diagnosticos=diagnosticos)['metricas']
+            linha.update({coluna: valor_json(metricas[coluna]) for coluna in COLUNAS_RANKING})
+            linha['ok'] = True
+    except Exception as e:
+        diagnosticos.append(('erro', f"Erro Crítico ao processar o Excel: {e}"))
+    erros = [mensagem for nivel, mensagem in diagnosticos if nivel == 'erro']
+    if erros:
+        linha.update({'ok': False, **{coluna: None for coluna in COLUNAS_RANKING}})
+    linha['avisos'] = len(diagnosticos) - len(erros)
+    linha['erro'] = " | ".join(erros) or None
+    linha['segundos'] = round(time.perf_counter() - inicio, 3)
+    return linha
+
+def tabela_ranking(linhas):
+    # Planilhas lidas primeiro, da maior para a menor it_total; as que falharam ficam no fim, sem posição.
+    df = pd.DataFrame(linhas, columns=['arquivo', 'ok', *COLUNAS_RANKING, 'avisos', 'erro', 'segundos'])
+    df[COLUNAS_RANKING] = df[COLUNAS_RANKING].apply(pd.to_numeric, errors='coerce')
+    df = df.sort_values(['ok', 'it_total', 'arquivo'], ascending=[False, False, True], na_position='last')
+    df = df.reset_index(drop=True)
+    df.insert(0, 'posicao', pd.array([i + 1 if ok else None for i, ok in enumerate(df['ok'])], dtype='Int64'))
+    return df
+
+def analisar_lote(arquivos, processos=None, motor=None, ao_concluir=None):
+    # Uma planilha por tarefa num ProcessPoolExecutor: a leitura do Excel é CPU e segura a GIL,
+    # então só processos escalam com os núcleos. Devolve (ranking, processos usados).
+    processos = max(1, min(processos or os.cpu_count() or 1, len(arquivos) or 1))
+    linhas = []
+    if processos == 1:
+        for caminho in arquivos:
+            linhas.append(pontuar_planilha(caminho, motor))
+            if ao_concluir:
+                ao_concluir(linhas[-1], len(linhas), len(arquivos))
+        return tabela_ranking(linhas), processos
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processos) as executor:
+        futuros = {executor.submit(pontuar_planilha, caminho, motor): caminho for caminho in arquivos}
+        for futuro in concurrent.futures.as_completed(futuros):
+            try:
+                linha = futuro.result()
+            except Exception as e:
+                # O processo morreu (ex.: falta de memória); a planilha entra como falha.
+                linha = {'arquivo': os.fspath(futuros[futuro]), 'ok': False, 'avisos': 0,
+                         'erro': f"Falha no processo de análise: {e!r}"}
+            linhas.append(linha)
+            if ao_concluir:
+                ao_concluir(linha, len(linhas), len(arquivos))
+    return tabela_ranking(linhas), processos
+
+def gravar_ranking(df, caminho):
+    if str(caminho).lower().endswith(".parquet"):
+        # Precisa de pyarrow ou fastparquet (opcionais); sem eles o pandas levanta ImportError.
+        df.to_parquet(caminho, index=False)
+    else:
+        df.to_csv(caminho, index=False)
+
+def main_lote(args):
+    arquivos = arquivos_do_lote(args.planilhas)
+    if not arquivos:
+        print("Nenhuma planilha .xlsx encontrada nas entradas informadas.", file=sys.stderr)
+        return 1
+
+    def mostrar_progresso(linha, feitas, total):
+        situacao = "ok" if linha['ok'] else "ERRO"
+        print(f"[{feitas}/{total}] {situacao} {linha['arquivo']}", file=sys.stderr)
+
+    inicio = time.perf_counter()
+    df, processos = analisar_lote(arquivos, args.processos, args.motor, mostrar_progresso)
+    duracao = time.perf_counter() - inicio
+    try:
+        gravar_ranking(df, args.ranking)
+    except ImportError as e:
+        print(f"Não foi possível gravar Parquet ({e}); instale pyarrow ou use um arquivo .csv.", file=sys.stderr)
+        return 2
+
+    falhas = df[~df['ok']]
+    print(f"{len(df)} planilhas em {duracao:.1f} s com {processos} processo(s) "
+          f"({len(df) / duracao:.1f} planilhas/s); {len(falhas)} com falha. Ranking em {args.ranking}", file=sys.stderr)
+    for linha in falhas.itertuples():
+        print(f"  falha: {linha.arquivo}: {linha.erro}", file=sys.stderr)
+    return 0 if falhas.empty else 1
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="cosmos-analyze",
+        description="Analisa planilhas de KPIs do Studio Cosmos sem Streamlit: uma planilha vira JSON; "
+                    "com --ranking, um lote de planilhas vira uma tabela comparativa.",
+    )
+    parser.add_argument("planilhas", nargs="+", help="arquivo .xlsx de KPIs; com --ranking, também pastas e padrões glob")
+    parser.add_argument("--motor", choices=MOTORES_EXCEL, help="leitor do Excel (padrão: COSMOS_EXCEL_ENGINE ou automático)")
+    parser.add_argument("--saida", help="grava o JSON neste arquivo em vez da saída padrão")
+    parser.add_argument("--compacto", action="store_true", help="JSON em uma linha, sem indentação")
+    parser.add_argument("--ranking", help="modo lote: grava it_total e médias por planilha neste .csv ou .parquet")
+    parser.add_argument("--processos", type=int, help="modo lote: processos em paralelo (padrão: núcleos da máquina)")
+    args = parser.parse_args(argv)
+
+    if args.ranking:
+        return main_lote(args)
+    if len(args.planilhas) != 1:
+        parser.error("sem --ranking, informe uma única planilha")
+
+    resultado = analisar_workbook(args.planilhas[0], args.motor)
+    texto = json.dumps(resultado, ensure_ascii=False, indent=None if args.compacto else 2, default=str)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        sys.stdout.write(texto + "\n")
+    for diagnostico in resultado['diagnosticos']:
+        print(f"{diagnostico['nivel']}: {diagnostico['mensagem']}", file=sys.stderr)
+    return 0 if resultado['ok'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+import datetime
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# Cache em disco das grades brutas de uma planilha, por SHA-256 do conteúdo: uma pasta com um
+# único grades.parquet (todas as abas, coluna a coluna) e um meta.json com tipos, métricas e
+# diagnósticos. Uma entrada de outra versão ou ilegível é tratada como ausente (None).
+
+VERSAO_CACHE_DISCO = 2
+CODIGOS_CELULA = {'nulo': 0, 'texto': 1, 'inteiro': 2, 'real': 3, 'bool': 4, 'data': 5, 'hora': 6}
+
+def codigo_celula(val):
+    if val is None:
+        return CODIGOS_CELULA['nulo']
+    if isinstance(val, str):
+        return CODIGOS_CELULA['texto']
+    if isinstance(val, (bool, np.bool_)):
+        return CODIGOS_CELULA['bool']
+    if isinstance(val, (int, np.integer)) and -2**63 <= val < 2**63:
+        return CODIGOS_CELULA['inteiro']
+    if isinstance(val, float):
+        return CODIGOS_CELULA['real']
+    if isinstance(val, datetime.datetime) and val is not pd.NaT:
+        return CODIGOS_CELULA['data']
+    if isinstance(val, datetime.time):
+        return CODIGOS_CELULA['hora']
+    raise TypeError(f"Tipo de célula não suportado no cache: {type(val).__name__}")
+
+def codificar_grade(df_raw):
+    # Colunas de tipo único (texto, número) vão direto para o Parquet; as mistas (object) viram
+    # um código de tipo por célula e uma coluna por tipo presente.
+    colunas = {}
+    for j in range(df_raw.shape[1]):
+        serie = df_raw.iloc[:, j].reset_index(drop=True)
+        if serie.dtype != object:
+            colunas[str(j)] = serie
+            continue
+        valores = serie.tolist()
+        codigos = np.array([codigo_celula(val) for val in valores], dtype=np.int8)
+        colunas[f"{j}#tipo"] = pd.Series(codigos)
+        presentes = set(codigos.tolist())
+        if presentes & {CODIGOS_CELULA['texto'], CODIGOS_CELULA['hora']}:
+            colunas[f"{j}#texto"] = pd.Series(
+                [val.isoformat() if c == CODIGOS_CELULA['hora'] else val if c == CODIGOS_CELULA['texto'] else None
+                 for val, c in zip(valores, codigos)], dtype=object)
+        if presentes & {CODIGOS_CELULA['inteiro'], CODIGOS_CELULA['bool']}:
+            colunas[f"{j}#inteiro"] = pd.Series(
+                [int(val) if c in (CODIGOS_CELULA['inteiro'], CODIGOS_CELULA['bool']) else None
+                 for val, c in zip(valores, codigos)], dtype='Int64')
+        if CODIGOS_CELULA['real'] in presentes:
+            colunas[f"{j}#real"] = pd.Series(
+                [val if c == CODIGOS_CELULA['real'] else np.nan for val, c in zip(valores, codigos)], dtype='float64')
+        if CODIGOS_CELULA['data'] in presentes:
+            colunas[f"{j}#data"] = pd.to_datetime(pd.Series(
+                [val if c == CODIGOS_CELULA['data'] else None for val, c in zip(valores, codigos)], dtype=object))
+    return colunas
+
+def completar_coluna(serie, n_linhas):
+    # Todas as abas ficam num só Parquet, então as colunas são completadas até a maior aba; os
+    # tipos sem nulo (int, bool) passam para os anuláveis do pandas para não virarem float.
+    if len(serie) == n_linhas:
+        return serie
+    if serie.dtype.kind in 'iu':
+        serie = serie.astype(serie.dtype.name.replace('int', 'Int').replace('uInt', 'UInt'))
+    elif serie.dtype.kind == 'b':
+        serie = serie.astype('boolean')
+    return serie.reindex(pd.RangeIndex(n_linhas))
+
+def decodificar_grade(tabela, chave, tipos, n_linhas, indice):
+    # Reconstrói a grade coluna a coluna com máscaras do NumPy (sem laço por célula), com os
+    # mesmos tipos do leitor do Excel: str, int, float, bool, datetime e time do Python.
+    colunas = {}
+    for j, tipo in enumerate(tipos):
+        if tipo != 'object':
+            serie = tabela[f"{chave}:{j}"].iloc[:n_linhas]
+            colunas[j] = serie if str(serie.dtype) == tipo else serie.astype(tipo)
+            continue
+        tabela_aba = {sufixo: tabela[f"{chave}:{j}#{sufixo}"].iloc[:n_linhas]
+                      for sufixo in ('texto', 'inteiro', 'real', 'data') if f"{chave}:{j}#{sufixo}" in tabela}
+        codigos = tabela[f"{chave}:{j}#tipo"].iloc[:n_linhas].to_numpy(dtype='int8')
+        valores = np.full(len(codigos), None, dtype=object)
+        for nome, codigo in CODIGOS_CELULA.items():
+            posicoes = np.flatnonzero(codigos == codigo)
+            if nome == 'nulo' or not len(posicoes):
+                continue
+            if nome == 'texto':
+                valores[posicoes] = tabela_aba['texto'].to_numpy(dtype=object)[posicoes]
+            elif nome == 'hora':
+                valores[posicoes] = [datetime.time.fromisoformat(t) for t in tabela_aba['texto'].to_numpy(dtype=object)[posicoes]]
+            elif nome == 'inteiro':
+                valores[posicoes] = tabela_aba['inteiro'].to_numpy(dtype='int64', na_value=0)[posicoes].tolist()
+            elif nome == 'bool':
+                valores[posicoes] = tabela_aba['inteiro'].to_numpy(dtype='int64', na_value=0)[posicoes].astype(bool).tolist()
+            elif nome == 'real':
+                valores[posicoes] = tabela_aba['real'].to_numpy()[posicoes].tolist()
+            else:
+                valores[posicoes] = tabela_aba['data'].dt.to_pydatetime()[posicoes]
+        colunas[j] = pd.Series(valores, dtype=object)
+    df = pd.DataFrame(colunas)
+    df.columns = pd.Index(np.arange(len(tipos), dtype=np.int64))
+    df.index = pd.RangeIndex(indice[0], indice[1]) if indice else pd.RangeIndex(len(df))
+    return df
+
+def ler_cache_disco(pasta_cache, hash_conteudo):
+    pasta = pathlib.Path(pasta_cache) / hash_conteudo
+    if not pasta.is_dir():
+        return None
+    try:
+        meta = json.loads((pasta / "meta.json").read_text(encoding="utf-8"))
+        if meta.get('versao') != VERSAO_CACHE_DISCO:
+            return None
+        abas_brutas = {}
+        tabela = None
+        for chave, info in meta['abas'].items():
+            if not info['tipos'] and not info['linhas']:
+                abas_brutas[chave] = pd.DataFrame()
+                continue
+            if tabela is None:
+                tabela = pd.read_parquet(pasta / "grades.parquet")
+            abas_brutas[chave] = decodificar_grade(tabela, chave, info['tipos'], info['linhas'], info['indice'])
+        os.utime(pasta)
+    except Exception:
+        return None
+    return abas_brutas, meta['metricas'], [tuple(d) for d in meta['diagnosticos']]
+
+def podar_cache_disco(pasta_cache, max_bytes):
+    entradas = []
+    for pasta in pasta_cache.iterdir():
+        if pasta.is_dir() and not pasta.name.startswith('.'):
+            tamanho = sum(arquivo.stat().st_size for arquivo in pasta.iterdir())
+            entradas.append((pasta.stat().st_mtime, tamanho, pasta))
+    total = sum(tamanho for _, tamanho, _ in entradas)
+    for _, tamanho, pasta in sorted(entradas):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(pasta, ignore_errors=True)
+        total -= tamanho
+
+def gravar_cache_disco(pasta_cache, hash_conteudo, abas_brutas, metricas, diagnosticos, max_bytes):
+    pasta_cache = pathlib.Path(pasta_cache)
+    pasta_tmp = None
+    try:
+        pasta_cache.mkdir(parents=True, exist_ok=True)
+        pasta_tmp = pathlib.Path(tempfile.mkdtemp(dir=pasta_cache, prefix=".tmp-"))
+        abas = {}
+        colunas = {}
+        for chave, df_raw in abas_brutas.items():
+            indice = None
+            if isinstance(df_raw.index, pd.RangeIndex) and df_raw.index.step == 1:
+                indice = [df_raw.index.start, df_raw.index.stop]
+            elif len(df_raw):
+                raise TypeError(f"Índice não suportado no cache: {type(df_raw.index).__name__}")
+            abas[chave] = {'linhas': len(df_raw), 'tipos': [str(d) for d in df_raw.dtypes], 'indice': indice}
+            for nome, serie in codificar_grade(df_raw).items():
+                colunas[f"{chave}:{nome}"] = serie
+        if colunas:
+            n_linhas = max(len(serie) for serie in colunas.values())
+            tabela = pd.DataFrame({nome: completar_coluna(serie, n_linhas) for nome, serie in colunas.items()})
+            tabela.to_parquet(pasta_tmp / "grades.parquet", index=False)
+        meta = {
+            'versao': VERSAO_CACHE_DISCO,
+            'abas': abas,
+            'metricas': {chave: float(valor) for chave, valor in metricas.items()},
+            'diagnosticos': [list(d) for d in diagnosticos],
+        }
+        (pasta_tmp / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+        destino = pasta_cache / hash_conteudo
+        if destino.exists():
+            # Entrada de um formato antigo ou corrompida: substituída pela nova.
+            shutil.rmtree(destino, ignore_errors=True)
+        os.replace(pasta_tmp, destino)
+        pasta_tmp = None
+        podar_cache_disco(pasta_cache, max_bytes)
+    except Exception:
+        pass
+    finally:
+        if pasta_tmp is not None:
+            shutil.rmtree(pasta_tmp, ignore_errors=True)
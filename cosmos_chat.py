@@ -0,0 +1,91 @@
+import re
+import unicodedata
+
+from cosmos_analise import DIMENSOES, tabela_drivers
+
+# Respostas diretas do chatbot, sem Streamlit e sem o modelo: perguntas curtas sobre as médias das
+# dimensões, o Índice Territorial e os drivers da matriz são respondidas a partir de
+# dados_resposta_rapida; o resto (responder_rapido devolve None) segue para o LLM.
+
+def normalizar_pergunta(pergunta):
+    texto = unicodedata.normalize('NFKD', str(pergunta).lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(re.findall(r'\w+', texto))
+
+PADRAO_PERGUNTA_ABERTA = re.compile(
+    r'\b(estrategi\w*|por que|porque|como|melhor\w*ar|sugest\w*|expli\w*|recomend\w*|risco\w*|justific\w*|situacao|potencial|signific\w*|defin\w*|o que e)\b'
+)
+PADRAO_DRIVERS = re.compile(r'\b(drivers?|maior (impacto|peso)|principais indicadores|mais pesam)\b')
+PADRAO_PESO = re.compile(r'\b(valor ponderado|pesos?)\b')
+PADRAO_INDICADOR = re.compile(r'\bindicador\w*')
+PADRAO_MENOR = re.compile(r'\b(menor|pior|piores|mais baix\w*|mais fraca\w*)\b')
+PADRAO_MAIOR = re.compile(r'\b(maior|melhor|melhores|mais alt\w*|mais forte\w*|destaque)\b')
+PADRAO_RANKING = re.compile(r'\b(ranking|ordem|classificacao|ordenad\w*)\b')
+PADRAO_MEDIA = re.compile(r'\b(medias?|notas?|pontuac\w*|score|valor)\b')
+PADRAO_DIMENSAO = re.compile(r'\bdimens\w*')
+PADRAO_IT = re.compile(r'\b(it|indice territorial|indice total)\b')
+PADRAO_OUTRO_ASSUNTO = re.compile(
+    r'\b(parceir\w*|stakeholders?|instituic\w*|taxas?|coeficientes?|afast\w*|recuos?|testadas?|lotes?|gabarito|'
+    r'zonas?|zoneamento|ade|zr3|legisla\w*|parametros?|usos?|visitas?|campo|relatorios?|infraestrutura|mapas?)\b'
+)
+MAX_PALAVRAS_RAPIDA = 20
+
+def dados_resposta_rapida(dados):
+    drivers = []
+    if not dados['matriz'].empty:
+        df_drivers = tabela_drivers(dados['matriz'])
+        if df_drivers is not None:
+            col_indicador, col_vp = df_drivers.columns[0], df_drivers.columns[-1]
+            drivers = [
+                (str(indicador), float(valor))
+                for indicador, valor in df_drivers[[col_indicador, col_vp]].dropna().itertuples(index=False, name=None)
+            ]
+    medias = {chave: float(dados['metricas'][f'media_{chave}']) for chave in DIMENSOES.values()}
+    return {'it_total': float(dados['metricas']['it_total']), 'medias': medias, 'drivers': drivers}
+
+def responder_rapido(pergunta, rapido):
+    # Roteador de intenção: consultas diretas às métricas são respondidas na hora, sem o modelo.
+    # Qualquer pergunta aberta (estratégia, justificativa, etc.) segue para o LLM (retorna None).
+    texto = normalizar_pergunta(pergunta)
+    if not texto or len(texto.split()) > MAX_PALAVRAS_RAPIDA or PADRAO_PERGUNTA_ABERTA.search(texto):
+        return None
+
+    nomes = {chave: nome for nome, chave in DIMENSOES.items()}
+    palavras = set(texto.split())
+    citadas = [chave for chave in DIMENSOES.values() if chave in palavras]
+    medias = rapido['medias']
+
+    # Perguntas sobre indicadores, sobre outro assunto da planilha (legislação, visita, parceiros...)
+    # ou sobre extremos/ranking dentro de uma dimensão citada não têm resposta nas médias: vão para
+    # o modelo, que vê as linhas da planilha.
+    if PADRAO_OUTRO_ASSUNTO.search(texto):
+        return None
+    extremo_ou_ranking = PADRAO_MENOR.search(texto) or PADRAO_MAIOR.search(texto) or PADRAO_RANKING.search(texto)
+    if citadas and (PADRAO_INDICADOR.search(texto) or extremo_ou_ranking):
+        return None
+    if PADRAO_INDICADOR.search(texto) and not PADRAO_DRIVERS.search(texto):
+        return None
+
+    if PADRAO_DRIVERS.search(texto) or (PADRAO_PESO.search(texto) and extremo_ou_ranking):
+        if not rapido['drivers']:
+            return None
+        linhas = [f"{i}. {indicador} — {valor:.2f}" for i, (indicador, valor) in enumerate(rapido['drivers'][:5], start=1)]
+        return "Principais drivers de impacto (valor ponderado, da Matriz de Pesos):\n\n" + "\n".join(linhas)
+
+    if PADRAO_DIMENSAO.search(texto) and not citadas and extremo_ou_ranking:
+        ordem = sorted(medias, key=medias.get, reverse=True)
+        if PADRAO_RANKING.search(texto) or (PADRAO_MENOR.search(texto) and PADRAO_MAIOR.search(texto)):
+            linhas = [f"{i}. {nomes[chave]} — {medias[chave]:.2f}" for i, chave in enumerate(ordem, start=1)]
+            return "Ranking das dimensões pela média (0-5):\n\n" + "\n".join(linhas)
+        chave = ordem[-1] if PADRAO_MENOR.search(texto) else ordem[0]
+        extremo = "menor" if PADRAO_MENOR.search(texto) else "maior"
+        return f"A dimensão com {extremo} média é a **{nomes[chave]}**, com **{medias[chave]:.2f}** (escala 0-5)."
+
+    if citadas and PADRAO_MEDIA.search(texto):
+        linhas = [f"- Média da dimensão {nomes[chave]}: **{medias[chave]:.2f}** (escala 0-5)" for chave in citadas]
+        return "\n".join(linhas)
+
+    if PADRAO_IT.search(texto):
+        it_valor = rapido['it_total']
+        return f"O Índice Territorial (IT) total é **{it_valor:.2f}** ({'Alto Potencial' if it_valor > 3.5 else 'Potencial Moderado'})."
+    return None
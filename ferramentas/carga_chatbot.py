@@ -0,0 +1,231 @@
+import argparse
+import functools
+import io
+import json
+import multiprocessing
+import os
+import pathlib
+import queue
+import statistics
+import sys
+import threading
+import time
+
+# Teste de carga do "🤖 IA Chatbot": N sessões simuladas em paralelo (cada uma com seu AppTest)
+# fazem perguntas à página real, apontada para um endpoint de completions (por padrão o
+# servidor_llm_mock local). Reporta p50/p95/p99 por turno e vazão.
+# --modo threads (padrão) roda as sessões no mesmo processo, como o servidor do Streamlit, e
+# portanto compartilha o agendador de chamadas ao modelo; --modo processos isola cada sessão.
+#
+#   python ferramentas/carga_chatbot.py --planilha dados.xlsx --sessoes 8 --turnos 5
+
+PASTA = pathlib.Path(__file__).resolve().parent
+APP_PADRAO = PASTA.parent / "app.py"
+PAGINA_CHATBOT = "🤖 IA Chatbot"
+PERGUNTAS_PADRAO = [
+    "Qual a estratégia para a dimensão social?",
+    "Quais os principais riscos observados na visita?",
+    "Como a dimensão ambiental se relaciona com o projeto?",
+    "Explique o potencial econômico do terreno.",
+    "Que parceiros e stakeholders podem apoiar o projeto?",
+    "Quais recomendações para melhorar a dimensão sensorial?",
+]
+
+
+class ArquivoCarregado(io.BytesIO):
+    def __init__(self, caminho):
+        with open(caminho, "rb") as f:
+            super().__init__(f.read())
+        self.name = os.path.basename(caminho)
+        self.file_id = self.name
+
+
+@functools.lru_cache(maxsize=None)
+def codigo_do_app(caminho):
+    return compile(pathlib.Path(caminho).read_text(encoding="utf-8"), caminho, "exec")
+
+
+def executar_pagina():
+    # Roda o app.py com a planilha "carregada" e o menu fixo na página do chatbot: o AppTest não
+    # simula file_uploader nem componentes customizados como o option_menu.
+    import streamlit as st
+    import streamlit_option_menu
+
+    def file_uploader(label, type=None, accept_multiple_files=False, **kwargs):
+        return [] if accept_multiple_files else ArquivoCarregado(os.environ["COSMOS_CARGA_PLANILHA"])
+
+    def option_menu(menu_title=None, options=None, **kwargs):
+        return PAGINA_CHATBOT if PAGINA_CHATBOT in options else options[0]
+
+    st.sidebar.file_uploader = file_uploader
+    streamlit_option_menu.option_menu = option_menu
+    caminho = os.environ["COSMOS_CARGA_APP"]
+    # Como o `streamlit run`, deixa importáveis os módulos ao lado do app (ex.: cosmos_analise).
+    if os.path.dirname(caminho) not in sys.path:
+        sys.path.insert(0, os.path.dirname(caminho))
+    exec(codigo_do_app(caminho), {"__name__": "__main__", "__file__": caminho})
+
+
+def _script_chatbot():
+    import carga_chatbot
+    carga_chatbot.executar_pagina()
+
+
+def sessao(numero, perguntas, turnos, timeout, largada, fila):
+    # Sempre manda (resultados, falha) pela fila. Se o app não carregar, a sessão quebra a
+    # barreira (abort) para a largada e as demais sessões não ficarem esperando por ela.
+    resultados = []
+    falha = None
+    try:
+        sys.path.insert(0, str(PASTA))
+        from streamlit.testing.v1 import AppTest
+
+        at = AppTest.from_function(_script_chatbot, default_timeout=timeout)
+        at.secrets["HUGGINGFACE_API_TOKEN"] = os.environ.get("COSMOS_CARGA_TOKEN", "mock")
+        at.run()
+        largada.wait()
+    except threading.BrokenBarrierError:
+        falha = f"sessão {numero}: largada cancelada"
+    except Exception as e:
+        largada.abort()
+        falha = f"sessão {numero} não carregou: {e}"
+    else:
+        for turno in range(turnos):
+            pergunta = perguntas[(numero + turno) % len(perguntas)]
+            t0 = time.perf_counter()
+            erro = None
+            try:
+                at.chat_input[0].set_value(pergunta).run()
+                if at.exception:
+                    erro = str(at.exception[0].value)
+                elif at.error:
+                    erro = at.error[0].value
+            except Exception as e:
+                erro = str(e)
+            resultados.append({'sessao': numero, 'turno': turno, 'inicio': t0, 'latencia': time.perf_counter() - t0,
+                               'erro': erro})
+    fila.put((resultados, falha))
+
+
+def percentil(valores, p):
+    if not valores:
+        return float("nan")
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados)) - 1))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga da página do chatbot do Studio Cosmos.")
+    parser.add_argument("--planilha", required=True, help="arquivo .xlsx de KPIs usado por todas as sessões")
+    parser.add_argument("--sessoes", type=int, default=4, help="sessões simultâneas")
+    parser.add_argument("--turnos", type=int, default=5, help="perguntas por sessão")
+    parser.add_argument("--perguntas", help="arquivo texto com uma pergunta por linha")
+    parser.add_argument("--app", default=str(APP_PADRAO))
+    parser.add_argument("--base-url", help="endpoint de completions; sem ele sobe o servidor mock local")
+    parser.add_argument("--latencia", type=float, default=0.3, help="mock: segundos até o primeiro token")
+    parser.add_argument("--tokens-por-segundo", type=float, default=40.0, help="mock: taxa de geração")
+    parser.add_argument("--tokens", type=int, default=120, help="mock: tamanho da resposta")
+    parser.add_argument("--taxa-erro", type=float, default=0.0, help="mock: fração de requisições com erro")
+    parser.add_argument("--codigo-erro", type=int, default=503, help="mock: status HTTP das falhas injetadas")
+    parser.add_argument("--com-cache", action="store_true", help="mantém o cache de respostas ligado")
+    parser.add_argument("--timeout", type=float, default=120.0, help="tempo máximo de cada turno (s)")
+    parser.add_argument("--modo", choices=("threads", "processos"), default="threads")
+    parser.add_argument("--json", help="grava o relatório neste arquivo")
+    args = parser.parse_args()
+
+    perguntas = PERGUNTAS_PADRAO
+    if args.perguntas:
+        perguntas = [linha.strip() for linha in pathlib.Path(args.perguntas).read_text(encoding="utf-8").splitlines() if linha.strip()]
+
+    servidor = None
+    base_url = args.base_url
+    if not base_url:
+        sys.path.insert(0, str(PASTA))
+        from servidor_llm_mock import ConfiguracaoMock, iniciar_servidor
+        config = ConfiguracaoMock(args.latencia, args.tokens_por_segundo, args.tokens, args.taxa_erro, args.codigo_erro)
+        servidor, base_url = iniciar_servidor(config)
+
+    os.environ["COSMOS_LLM_BASE_URL"] = base_url
+    os.environ["COSMOS_CARGA_PLANILHA"] = str(pathlib.Path(args.planilha).resolve())
+    os.environ["COSMOS_CARGA_APP"] = str(pathlib.Path(args.app).resolve())
+    if not args.com_cache:
+        os.environ["COSMOS_CACHE_RESPOSTAS"] = "desligado"
+
+    if args.modo == "processos":
+        contexto = multiprocessing.get_context("spawn")
+        largada = contexto.Barrier(args.sessoes + 1)
+        fila = contexto.Queue()
+        criar = contexto.Process
+    else:
+        sys.path.insert(0, str(PASTA))
+        largada = threading.Barrier(args.sessoes + 1)
+        fila = queue.Queue()
+        criar = threading.Thread
+    processos = [
+        criar(target=sessao, args=(i, perguntas, args.turnos, args.timeout, largada, fila), daemon=True)
+        for i in range(args.sessoes)
+    ]
+    for processo in processos:
+        processo.start()
+    # Cada sessão carrega o app antes da largada (barreira): a medição cobre só os turnos.
+    # Os prazos evitam esperar para sempre por uma sessão travada ou morta.
+    try:
+        largada.wait(timeout=args.timeout)
+    except threading.BrokenBarrierError:
+        pass
+    prazo = time.monotonic() + args.timeout * (args.turnos + 1)
+    resultados = []
+    falhas = []
+    for _ in processos:
+        try:
+            turnos_sessao, falha = fila.get(timeout=max(0.0, prazo - time.monotonic()))
+        except queue.Empty:
+            falhas.append(f"{sum(p.is_alive() for p in processos)} sessão(ões) sem resposta no prazo")
+            break
+        resultados.extend(turnos_sessao)
+        if falha:
+            falhas.append(falha)
+    for processo in processos:
+        processo.join(timeout=max(0.0, prazo - time.monotonic()))
+    if not resultados:
+        if servidor is not None:
+            servidor.shutdown()
+        sys.exit("Nenhum turno executado:\n  " + "\n  ".join(falhas))
+
+    latencias = [r['latencia'] for r in resultados if not r['erro']]
+    erros = [r for r in resultados if r['erro']]
+    duracao = max(r['inicio'] + r['latencia'] for r in resultados) - min(r['inicio'] for r in resultados)
+    relatorio = {
+        'base_url': base_url,
+        'modo': args.modo,
+        'sessoes': args.sessoes,
+        'turnos_por_sessao': args.turnos,
+        'turnos': len(resultados),
+        'erros': len(erros),
+        'duracao_s': duracao,
+        'vazao_turnos_s': len(resultados) / duracao if duracao > 0 else float("nan"),
+        'latencia_p50_s': percentil(latencias, 50),
+        'latencia_p95_s': percentil(latencias, 95),
+        'latencia_p99_s': percentil(latencias, 99),
+        'latencia_media_s': statistics.fmean(latencias) if latencias else float("nan"),
+        'exemplos_erro': sorted({r['erro'][:200] for r in erros})[:5],
+        'falhas_sessao': falhas,
+    }
+
+    print(f"Endpoint: {base_url}")
+    print(f"Sessões: {args.sessoes} x {args.turnos} turnos = {len(resultados)} turnos ({len(erros)} com erro)")
+    print(f"Latência por turno: p50 {relatorio['latencia_p50_s']:.3f} s | p95 {relatorio['latencia_p95_s']:.3f} s | "
+          f"p99 {relatorio['latencia_p99_s']:.3f} s")
+    print(f"Vazão: {relatorio['vazao_turnos_s']:.2f} turnos/s em {duracao:.1f} s")
+    for exemplo in relatorio['exemplos_erro']:
+        print(f"  erro: {exemplo}")
+    for falha in falhas:
+        print(f"  falha: {falha}")
+    if args.json:
+        pathlib.Path(args.json).write_text(json.dumps(relatorio, indent=2, ensure_ascii=False), encoding="utf-8")
+    if servidor is not None:
+        servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
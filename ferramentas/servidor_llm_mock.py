@@ -0,0 +1,167 @@
+import argparse
+import http.server
+import json
+import random
+import threading
+import time
+import uuid
+
+# Servidor de completions local, compatível com a rota OpenAI/HF usada pelo InferenceClient
+# (POST .../v1/chat/completions, com ou sem stream). Serve para testar e medir o chatbot
+# sem o endpoint do Hugging Face: aponte o app com COSMOS_LLM_BASE_URL=http://127.0.0.1:<porta>.
+
+PALAVRAS = (
+    "A análise indica que o terreno apresenta potencial moderado, com destaque para a dimensão "
+    "urbana e pontos de atenção na dimensão sensorial. Recomenda-se priorizar as estratégias "
+    "descritas no resumo analítico e acompanhar os indicadores de maior peso na matriz."
+).split()
+
+
+class ConfiguracaoMock:
+    def __init__(self, latencia=0.3, tokens_por_segundo=40.0, tokens_resposta=120, taxa_erro=0.0,
+                 codigo_erro=503, semente=None):
+        self.latencia = latencia
+        self.tokens_por_segundo = tokens_por_segundo
+        self.tokens_resposta = tokens_resposta
+        self.taxa_erro = taxa_erro
+        self.codigo_erro = codigo_erro
+        self.aleatorio = random.Random(semente)
+        self.trava = threading.Lock()
+        self.contadores = {'requisicoes': 0, 'erros_injetados': 0, 'streams': 0}
+
+    def sortear_erro(self):
+        with self.trava:
+            self.contadores['requisicoes'] += 1
+            if self.taxa_erro and self.aleatorio.random() < self.taxa_erro:
+                self.contadores['erros_injetados'] += 1
+                return True
+        return False
+
+
+def gerar_tokens(n):
+    return [PALAVRAS[i % len(PALAVRAS)] + " " for i in range(n)]
+
+
+def criar_handler(config):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def responder_json(self, codigo, corpo):
+            dados = json.dumps(corpo, ensure_ascii=False).encode("utf-8")
+            self.send_response(codigo)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(dados)))
+            self.end_headers()
+            self.wfile.write(dados)
+
+        def do_GET(self):
+            if self.path.rstrip("/") in ("/health", "/v1/models"):
+                self.responder_json(200, {'status': 'ok', **config.contadores})
+            else:
+                self.responder_json(404, {'error': 'rota não encontrada'})
+
+        def do_POST(self):
+            tamanho = int(self.headers.get("Content-Length", 0))
+            try:
+                pedido = json.loads(self.rfile.read(tamanho) or b"{}")
+            except ValueError:
+                self.responder_json(400, {'error': 'JSON inválido'})
+                return
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self.responder_json(404, {'error': 'rota não encontrada'})
+                return
+
+            time.sleep(config.latencia)
+            if config.sortear_erro():
+                self.responder_json(config.codigo_erro, {'error': f'erro injetado ({config.codigo_erro})'})
+                return
+
+            modelo = pedido.get("model") or "mock"
+            limite = int(pedido.get("max_tokens") or config.tokens_resposta)
+            tokens = gerar_tokens(min(limite, config.tokens_resposta))
+            caracteres_entrada = sum(len(str(m.get("content", ""))) for m in pedido.get("messages", []))
+            uso = {
+                'prompt_tokens': caracteres_entrada // 4,
+                'completion_tokens': len(tokens),
+                'total_tokens': caracteres_entrada // 4 + len(tokens),
+            }
+            identificador = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+            intervalo = 1.0 / config.tokens_por_segundo if config.tokens_por_segundo > 0 else 0.0
+
+            if pedido.get("stream"):
+                with config.trava:
+                    config.contadores['streams'] += 1
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for token in tokens:
+                    time.sleep(intervalo)
+                    self.enviar_evento({
+                        'id': identificador, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                        'model': modelo,
+                        'choices': [{'index': 0, 'delta': {'role': 'assistant', 'content': token}, 'finish_reason': None}],
+                    })
+                self.enviar_evento({
+                    'id': identificador, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                    'model': modelo, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}], 'usage': uso,
+                })
+                self.enviar_pedaco(b"data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+                return
+
+            time.sleep(intervalo * len(tokens))
+            self.responder_json(200, {
+                'id': identificador, 'object': 'chat.completion', 'created': int(time.time()), 'model': modelo,
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': "".join(tokens).strip()}}],
+                'usage': uso,
+            })
+
+        def enviar_evento(self, corpo):
+            self.enviar_pedaco(f"data: {json.dumps(corpo, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+        def enviar_pedaco(self, dados):
+            self.wfile.write(f"{len(dados):x}\r\n".encode() + dados + b"\r\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+def iniciar_servidor(config=None, host="127.0.0.1", porta=0):
+    config = config or ConfiguracaoMock()
+    servidor = http.server.ThreadingHTTPServer((host, porta), criar_handler(config))
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://{host}:{servidor.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor de completions falso para testar o chatbot do Studio Cosmos.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8089)
+    parser.add_argument("--latencia", type=float, default=0.3, help="segundos antes do primeiro token")
+    parser.add_argument("--tokens-por-segundo", type=float, default=40.0, help="0 = sem espera entre tokens")
+    parser.add_argument("--tokens", type=int, default=120, help="tamanho da resposta em tokens")
+    parser.add_argument("--taxa-erro", type=float, default=0.0, help="fração de requisições que falham (0 a 1)")
+    parser.add_argument("--codigo-erro", type=int, default=503, help="status HTTP das falhas injetadas (ex.: 429, 503)")
+    parser.add_argument("--semente", type=int, default=None)
+    args = parser.parse_args()
+
+    config = ConfiguracaoMock(args.latencia, args.tokens_por_segundo, args.tokens, args.taxa_erro,
+                              args.codigo_erro, args.semente)
+    servidor, url = iniciar_servidor(config, args.host, args.porta)
+    print(f"Servidor mock em {url} (use COSMOS_LLM_BASE_URL={url})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,377 @@
+import io
+import re
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+import cosmos_analise
+from cosmos_analise import (
+    COLUNAS_RANKING,
+    MAPEAMENTO_ABAS,
+    SECAO_STAKEHOLDERS,
+    SECOES_LEGISLATIVA,
+    arquivos_do_lote,
+    calamine_disponivel,
+    clean_str,
+    derivar_tabela,
+    encontrar_coluna,
+    ler_grades_excel,
+    localizar_secoes,
+    main,
+    pontuar_planilha,
+    processar_tabela_infra,
+    processar_tabela_parametros,
+    processar_tabela_usos,
+    tabela_ranking,
+)
+
+# Os leitores e localizadores otimizados têm de devolver exatamente o que o código antigo
+# devolvia. As versões antigas (iterrows + clean_str, read_excel com header=0) ficam aqui como
+# referência e são comparadas em planilhas sintéticas pequenas, lidas com os três motores.
+
+MOTORES = [
+    pytest.param('calamine', marks=pytest.mark.skipif(not calamine_disponivel(), reason="python-calamine não instalado")),
+    'streaming',
+    'openpyxl',
+]
+
+
+def find_header_row(df_raw, keywords):
+    for i, row in df_raw.head(30).iterrows():
+        row_values = [clean_str(val) for val in row.values]
+        has_all_keywords = True
+        for keyword in keywords:
+            if keyword not in row_values:
+                has_all_keywords = False
+                break
+        if has_all_keywords:
+            return i
+    return -1
+
+
+def processar_tabela_parametros_antigo(df_raw):
+    keywords = ['indicador', 'valor indicado']
+    header_row_idx = find_header_row(df_raw, keywords)
+
+    if header_row_idx == -1:
+        return pd.DataFrame()
+
+    df_processado = df_raw.loc[header_row_idx:].copy()
+    new_cols = [clean_str(col) if pd.notna(col) else f"unnamed_{j}" for j, col in enumerate(df_processado.iloc[0])]
+    df_processado.columns = new_cols
+    df_processado = df_processado.iloc[1:].reset_index(drop=True)
+
+    stop_keyword = 'usos'
+    stop_row_mask = df_processado.apply(lambda row: row.astype(str).str.contains(stop_keyword, case=False, na=False).any(), axis=1)
+
+    if stop_row_mask.any():
+        stop_row_idx = stop_row_mask.idxmax()
+        df_processado = df_processado.loc[:stop_row_idx-1]
+
+    df_processado = df_processado.dropna(how='all')
+    return df_processado
+
+
+def processar_tabela_usos_antigo(df_raw):
+    header_row_idx = -1
+    col_usos_str = 'usos'
+    col_adeq_str = 'adequação'
+    col_adeq_str_alt = 'adequacao'
+
+    for i, row in df_raw.head(30).iterrows():
+        row_values = [clean_str(val) for val in row.values]
+        has_usos = col_usos_str in row_values
+        has_adeq = any(col_adeq_str in val or col_adeq_str_alt in val for val in row_values)
+
+        if has_usos and has_adeq:
+            header_row_idx = i
+            break
+
+    if header_row_idx == -1:
+        return pd.DataFrame()
+
+    df_processado = df_raw.loc[header_row_idx:].copy()
+    new_cols = [clean_str(col) if pd.notna(col) else f"unnamed_{j}" for j, col in enumerate(df_processado.iloc[0])]
+    df_processado.columns = new_cols
+    df_processado = df_processado.iloc[1:].reset_index(drop=True)
+
+    col_adeq_final = encontrar_coluna(df_processado, [col_adeq_str, col_adeq_str_alt])
+    col_usos_final = encontrar_coluna(df_processado, [col_usos_str])
+    col_indicador_final = encontrar_coluna(df_processado, ['indicador'])
+
+    if col_adeq_final and col_usos_final:
+        df_processado[col_adeq_final] = df_processado[col_adeq_final].replace(r'^\s*$', np.nan, regex=True)
+        df_processado[col_adeq_final] = df_processado[col_adeq_final].fillna('Inadequado')
+        df_processado = df_processado.dropna(subset=[col_usos_final])
+        df_processado = df_processado[~df_processado[col_usos_final].str.contains(col_usos_str, case=False, na=False)]
+        if col_indicador_final:
+             df_processado = df_processado[~df_processado[col_indicador_final].str.contains('adequação dos usos', case=False, na=False)]
+
+    df_processado = df_processado.dropna(how='all')
+    return df_processado
+
+
+def processar_tabela_infra_antigo(df_raw, start_keyword):
+    header_row_idx = -1
+    for i, row in df_raw.head(40).iterrows():
+        first_cell_val = clean_str(str(row.iloc[0]))
+        if first_cell_val.startswith(start_keyword.lower()):
+            header_row_idx = i + 1
+            break
+
+    if header_row_idx == -1 or header_row_idx >= len(df_raw):
+        return pd.DataFrame()
+
+    df_processado = df_raw.loc[header_row_idx:].copy()
+
+    new_cols = [clean_str(col) if pd.notna(col) else f"unnamed_{j}" for j, col in enumerate(df_processado.iloc[0])]
+    df_processado.columns = new_cols
+    df_processado = df_processado.iloc[1:].reset_index(drop=True)
+
+    all_nan_rows = df_processado.isnull().all(axis=1)
+    if all_nan_rows.any():
+        first_nan_row = all_nan_rows.idxmax()
+        df_processado = df_processado.loc[:first_nan_row-1]
+
+    df_processado = df_processado.loc[:, ~df_processado.columns.str.startswith('unnamed')]
+    df_processado = df_processado.dropna(how='all')
+
+    col_indicador = encontrar_coluna(df_processado, ['indicador'])
+    if col_indicador:
+        df_processado = df_processado.dropna(subset=[col_indicador])
+        df_processado = df_processado.set_index(col_indicador)
+
+    return df_processado
+
+
+def cabecalho_stakeholders_antigo(df_eco_raw):
+    for i, row in df_eco_raw.head(30).iterrows():
+        row_values = [clean_str(val) for val in row.values]
+        has_instituicao = any('instituição' in val or 'instituicao' in val for val in row_values)
+        has_potencial = any('potencial' in val for val in row_values)
+
+        if has_instituicao and has_potencial:
+            return i
+    return -1
+
+
+def preencher(aba, linhas, inicio=1):
+    for numero, linha in enumerate(linhas, start=inicio):
+        for coluna, valor in enumerate(linha, start=1):
+            if valor is not None:
+                aba.cell(row=numero, column=coluna, value=valor)
+
+
+def legislativa(cabecalho_em, com_usos=True):
+    linhas = [["Quadro de parâmetros"]] + [[None]] * (cabecalho_em - 1)
+    linhas += [
+        [" INDICADOR ", "Valor indicado", "Observação", None],
+        ["Taxa de ocupação", "50%", None, None],
+        ["Coeficiente de aproveitamento", 1.5, "máx.", None],
+        [None, None, None, None],
+        ["Taxa de permeabilidade", 0.2, None, 3],
+        ["Testada mínima", "12 m", "#N/A", None],
+    ]
+    if com_usos:
+        linhas += [
+            [None],
+            ["Indicador", "Usos", "Adequação ao zoneamento", None],
+            ["Adequação dos usos", "Usos", None, None],
+            [None, "Residencial", "Adequado", None],
+            [None, "Comercial", " ", None],
+            [None, "Industrial", None, None],
+            [None, None, None, None],
+            [None, "Serviços", "Inadequado", None],
+        ]
+    return linhas
+
+
+def economica(cabecalho_em):
+    linhas = [["Dimensão Econômica"]] + [[None]] * (cabecalho_em - 1)
+    linhas += [
+        ["Indicador", "Valor", "Peso", "VALOR PONDERADO"],
+        ["Renda média", 3.0, 2, 6],
+        ["Emprego", 2.5, 1, 2.5],
+        [None],
+        ["Infraestrutura existente"],
+        ["Indicador", "Distância (m)", "Situação", None],
+        ["Escola", 350, "Boa", None],
+        ["Posto de saúde", 1200.0, None, None],
+        [None, None, None, None],
+        ["Parceiros potenciais"],
+        ["Instituição", "Potencial", "Localização", None],
+        ["Associação do bairro", "alto", "Centro", None],
+        ["Cooperativa", "Médio\nFinanciamento\nCapacitação", None, None],
+        [None, "Baixo", "Norte", None],
+    ]
+    return linhas
+
+
+def planilha_sintetica(variante=0):
+    livro = Workbook()
+    livro.remove(livro.active)
+    preencher(livro.create_sheet(MAPEAMENTO_ABAS['leg_ade']), legislativa(2 + variante))
+    preencher(livro.create_sheet(MAPEAMENTO_ABAS['leg_zr3']), legislativa(5 + variante, com_usos=variante % 2 == 0), inicio=2)
+    preencher(livro.create_sheet(MAPEAMENTO_ABAS['economica']), economica(1 + variante))
+    preencher(livro.create_sheet(MAPEAMENTO_ABAS['urbana']), [
+        ["Indicador", "Valor", "Peso", "Valor ponderado", "Análise", None, "Nota"],
+        ["Densidade", 4, 2.0, 8, "Texto", None, None],
+        ["Mobilidade", 3.25, 1, None, None, None, True],
+        [None, None, None, None, None, None, None],
+        ["Vazio", "#DIV/0!", 0, 0.0, "  espaço  ", None, None],
+    ])
+    livro.create_sheet(MAPEAMENTO_ABAS['social'])
+    gerado = io.BytesIO()
+    livro.save(gerado)
+    # O Excel grava textos com espaços nas pontas com xml:space="preserve"; o openpyxl não, e o
+    # calamine então descarta células só com espaços. Reescreve como o Excel faria.
+    ficheiro = io.BytesIO()
+    with zipfile.ZipFile(gerado) as origem, zipfile.ZipFile(ficheiro, 'w') as destino:
+        for nome in origem.namelist():
+            conteudo = origem.read(nome)
+            if nome.startswith('xl/worksheets/'):
+                conteudo = re.sub(rb'<t>(\s[^<]*|[^<]*\s)</t>', rb'<t xml:space="preserve">\1</t>', conteudo)
+            destino.writestr(nome, conteudo)
+    ficheiro.seek(0)
+    return ficheiro
+
+
+@pytest.fixture(params=[0, 1, 3])
+def planilha(request):
+    return planilha_sintetica(request.param)
+
+
+@pytest.mark.parametrize('motor', MOTORES)
+def test_localizar_secoes_igual_ao_codigo_antigo(planilha, motor):
+    abas = ler_grades_excel(planilha, motor)
+    for chave in ('leg_ade', 'leg_zr3', 'economica', 'urbana', 'social', 'visita'):
+        df_raw = abas[chave]
+        secoes = localizar_secoes(df_raw, {**SECOES_LEGISLATIVA, **SECAO_STAKEHOLDERS})
+        assert secoes['parametros'][0] == find_header_row(df_raw, ['indicador', 'valor indicado'])
+        assert secoes['stakeholders'][0] == cabecalho_stakeholders_antigo(df_raw)
+        pd.testing.assert_frame_equal(processar_tabela_parametros(df_raw), processar_tabela_parametros_antigo(df_raw))
+        pd.testing.assert_frame_equal(processar_tabela_usos(df_raw), processar_tabela_usos_antigo(df_raw))
+        for palavra in ('infraestrutura', 'Parceiros', 'indicador', 'inexistente'):
+            pd.testing.assert_frame_equal(processar_tabela_infra(df_raw, palavra), processar_tabela_infra_antigo(df_raw, palavra))
+
+
+def test_localizar_secoes_grade_vazia():
+    assert localizar_secoes(pd.DataFrame(), {**SECOES_LEGISLATIVA, 'infra': {'prefixo': 'x'}}) == {
+        'parametros': (-1, -1), 'usos': (-1, -1), 'infra': (-1, -1),
+    }
+
+
+@pytest.mark.parametrize('motor', MOTORES)
+def test_derivar_tabela_igual_a_read_excel_header_0(planilha, motor):
+    abas = ler_grades_excel(planilha, motor)
+    # O motor 'streaming' não existe no pandas: a referência é o leitor openpyxl completo.
+    motor_pandas = 'openpyxl' if motor == 'streaming' else motor
+    for chave in ('leg_ade', 'leg_zr3', 'economica', 'urbana', 'social'):
+        planilha.seek(0)
+        esperado = pd.read_excel(planilha, sheet_name=MAPEAMENTO_ABAS[chave], header=0, engine=motor_pandas)
+        obtido = derivar_tabela(abas[chave])
+        if esperado.empty and obtido.empty:
+            continue
+        pd.testing.assert_frame_equal(obtido, esperado)
+
+
+@pytest.mark.parametrize('motor', ['streaming', 'openpyxl'])
+def test_motores_devolvem_grades_identicas(planilha, motor):
+    referencia = ler_grades_excel(planilha, 'calamine' if calamine_disponivel() else 'openpyxl')
+    planilha.seek(0)
+    abas = ler_grades_excel(planilha, motor)
+    assert abas.keys() == referencia.keys()
+    for chave in abas:
+        pd.testing.assert_frame_equal(abas[chave], referencia[chave])
+
+
+def test_motor_desconhecido_cai_no_mais_rapido(monkeypatch):
+    assert cosmos_analise.escolher_motor_excel('xyz') == ('calamine' if calamine_disponivel() else 'streaming')
+    monkeypatch.setattr(cosmos_analise, 'calamine_disponivel', lambda: False)
+    assert cosmos_analise.escolher_motor_excel('calamine') == 'streaming'
+
+
+def planilha_kpis(caminho, escalas, valores_ponderados, coluna_valor="VALOR PONDERADO"):
+    # Planilha mínima do modo lote: as seis dimensões com ESCALA e a matriz de pesos.
+    livro = Workbook()
+    livro.remove(livro.active)
+    for chave in ('urbana', 'ambiental', 'social', 'economica', 'fisica', 'sensorial'):
+        aba = livro.create_sheet(MAPEAMENTO_ABAS[chave])
+        aba.append(["INDICADOR", "ESCALA (0–5)"])
+        for numero, escala in enumerate(escalas, start=1):
+            aba.append([f"Indicador {numero}", escala])
+    matriz = livro.create_sheet(MAPEAMENTO_ABAS['matriz'])
+    matriz.append(["INDICADOR", "PESO", coluna_valor])
+    for numero, valor in enumerate(valores_ponderados, start=1):
+        matriz.append([f"Indicador {numero}", 1, valor])
+    livro.save(caminho)
+    return str(caminho)
+
+
+def arquivo_corrompido(caminho):
+    caminho.write_bytes(b"nao e um xlsx")
+    return str(caminho)
+
+
+def sem_valor_ponderado(caminho):
+    return planilha_kpis(caminho, [2, 4], [1.5, 2.25], coluna_valor="PONTOS")
+
+
+def test_arquivos_do_lote(tmp_path):
+    for nome in ("b.xlsx", "a.xlsx", "~$a.xlsx", "notas.txt", "sub/c.xlsx", "sub/~$c.xlsx"):
+        (tmp_path / nome).parent.mkdir(exist_ok=True)
+        (tmp_path / nome).write_bytes(b"")
+    pasta = str(tmp_path)
+    assert arquivos_do_lote([pasta]) == [f"{pasta}/a.xlsx", f"{pasta}/b.xlsx"]
+    assert arquivos_do_lote([f"{pasta}/**/*.xlsx"]) == [f"{pasta}/a.xlsx", f"{pasta}/b.xlsx", f"{pasta}/sub/c.xlsx"]
+    assert arquivos_do_lote([f"{pasta}/sub/c.xlsx", pasta, f"{pasta}/a.xlsx", f"{pasta}/~$a.xlsx"]) == [
+        f"{pasta}/sub/c.xlsx", f"{pasta}/a.xlsx", f"{pasta}/b.xlsx",
+    ]
+
+
+def test_pontuar_planilha(tmp_path):
+    linha = pontuar_planilha(planilha_kpis(tmp_path / "ok.xlsx", [2, 4], [1.5, 2.25]), 'openpyxl')
+    assert linha['ok'] and linha['erro'] is None and linha['avisos'] == 0
+    assert linha['it_total'] == 3.75
+    assert all(linha[coluna] == 3.0 for coluna in COLUNAS_RANKING if coluna != 'it_total')
+
+
+@pytest.mark.parametrize('criar, erro', [
+    (arquivo_corrompido, "Erro ao ler a estrutura do arquivo Excel"),
+    (sem_valor_ponderado, "'VALOR PONDERADO'"),
+])
+def test_pontuar_planilha_com_erro_falha_sem_valores(tmp_path, criar, erro):
+    linha = pontuar_planilha(criar(tmp_path / "ruim.xlsx"), 'openpyxl')
+    assert linha['ok'] is False
+    assert all(linha[coluna] is None for coluna in COLUNAS_RANKING)
+    assert erro in linha['erro']
+
+
+def test_tabela_ranking():
+    def linha(arquivo, it_total, ok=True):
+        return {'arquivo': arquivo, 'ok': ok, **{coluna: None for coluna in COLUNAS_RANKING}, 'it_total': it_total,
+                'avisos': 0, 'erro': None if ok else "falhou", 'segundos': 0.1}
+
+    df = tabela_ranking([linha("c", 2.0), linha("x", None, ok=False), linha("b", 5.0), linha("a", 2.0), linha("y", None, ok=False)])
+    assert df['arquivo'].tolist() == ["b", "a", "c", "x", "y"]
+    assert df['posicao'].tolist() == [1, 2, 3, pd.NA, pd.NA]
+    assert str(df['posicao'].dtype) == 'Int64'
+
+
+def test_main_ranking(tmp_path):
+    lote = tmp_path / "lote"
+    lote.mkdir()
+    planilha_kpis(lote / "alta.xlsx", [5, 5], [3.0, 1.5])
+    planilha_kpis(lote / "baixa.xlsx", [1, 2], [0.5, 0.25])
+    arquivo_corrompido(lote / "corrompida.xlsx")
+    saida = tmp_path / "ranking.csv"
+
+    assert main([str(lote), "--ranking", str(saida), "--processos", "2", "--motor", "openpyxl"]) == 1
+    df = pd.read_csv(saida)
+    assert [nome.rsplit("/", 1)[-1] for nome in df['arquivo']] == ["alta.xlsx", "baixa.xlsx", "corrompida.xlsx"]
+    assert df['posicao'].tolist()[:2] == [1, 2] and pd.isna(df['posicao'].iloc[2])
+    assert df['it_total'].tolist()[:2] == [4.5, 0.75] and pd.isna(df['it_total'].iloc[2])
+    assert df['ok'].tolist() == [True, True, False]
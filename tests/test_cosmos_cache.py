@@ -0,0 +1,114 @@
+import datetime
+import io
+import json
+import math
+import os
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+from cosmos_analise import MAPEAMENTO_ABAS, calamine_disponivel, ler_grades_excel
+from cosmos_cache import gravar_cache_disco, ler_cache_disco, podar_cache_disco
+
+# O cache em disco tem de devolver as grades exatamente como o leitor do Excel as entregou:
+# mesmos valores e mesmo tipo Python em cada célula, para os três motores de leitura.
+
+MOTORES = [
+    pytest.param('calamine', marks=pytest.mark.skipif(not calamine_disponivel(), reason="python-calamine não instalado")),
+    'streaming',
+    'openpyxl',
+]
+METRICAS = {'it_total': 3.25, 'media_urbana': 2.5}
+DIAGNOSTICOS = [('aviso', "Aviso: Não foi possível encontrar a aba que contém 'Resumo analítico'")]
+
+
+def planilha_tipos():
+    livro = Workbook()
+    livro.remove(livro.active)
+    mista = livro.create_sheet(MAPEAMENTO_ABAS['urbana'])
+    for linha in [
+        ["Indicador", "Valor", "Peso", "Data", "Misto"],
+        ["Densidade", 4, 2.5, datetime.datetime(2024, 3, 1, 8, 30), "texto"],
+        ["Mobilidade", 3.75, 1, datetime.datetime(2023, 12, 31), 12345678901234],
+        [None, None, None, None, None],
+        ["Ruído", "#DIV/0!", 0, datetime.time(14, 5, 30), True],
+        ["Verde", 2, 0.1, None, False],
+        ["Água", -7, 1e-9, "31/12/2023", 2.5],
+        [None, None, None, None, datetime.datetime(2020, 1, 1)],
+    ]:
+        mista.append(linha)
+    numerica = livro.create_sheet(MAPEAMENTO_ABAS['matriz'])
+    for linha in [[1, 2.5, 3], [4, 5, 6.75], [7, None, 9]]:
+        numerica.append(linha)
+    livro.create_sheet(MAPEAMENTO_ABAS['social'])
+    ficheiro = io.BytesIO()
+    livro.save(ficheiro)
+    ficheiro.seek(0)
+    return ficheiro
+
+
+def mesma_celula(original, lida):
+    if type(original) is not type(lida):
+        return False
+    if isinstance(original, float) and math.isnan(original):
+        return math.isnan(lida)
+    return original == lida
+
+
+@pytest.mark.parametrize('motor', MOTORES)
+def test_cache_devolve_as_mesmas_grades(tmp_path, motor):
+    abas_brutas = ler_grades_excel(planilha_tipos(), motor)
+    gravar_cache_disco(tmp_path, "abc", abas_brutas, METRICAS, DIAGNOSTICOS, 2**30)
+    lidas, metricas, diagnosticos = ler_cache_disco(tmp_path, "abc")
+
+    assert metricas == METRICAS
+    assert diagnosticos == DIAGNOSTICOS
+    assert lidas.keys() == abas_brutas.keys()
+    for chave, df_raw in abas_brutas.items():
+        pd.testing.assert_frame_equal(lidas[chave], df_raw, check_exact=True)
+        for coluna in df_raw.columns:
+            for original, lida in zip(df_raw[coluna].tolist(), lidas[chave][coluna].tolist()):
+                assert mesma_celula(original, lida), (chave, coluna, original, lida)
+
+
+def test_cache_cobre_todos_os_tipos_de_celula():
+    urbana = ler_grades_excel(planilha_tipos(), 'openpyxl')['urbana']
+    tipos = {type(val) for val in urbana.to_numpy().ravel().tolist()}
+    assert {str, int, float, bool, datetime.datetime, datetime.time} <= tipos
+
+
+def test_cache_ausente(tmp_path):
+    assert ler_cache_disco(tmp_path, "abc") is None
+
+
+def test_cache_de_outra_versao(tmp_path):
+    gravar_cache_disco(tmp_path, "abc", ler_grades_excel(planilha_tipos(), 'openpyxl'), METRICAS, [], 2**30)
+    meta = json.loads((tmp_path / "abc" / "meta.json").read_text(encoding="utf-8"))
+    meta['versao'] -= 1
+    (tmp_path / "abc" / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+    assert ler_cache_disco(tmp_path, "abc") is None
+
+
+@pytest.mark.parametrize('arquivo, conteudo', [('grades.parquet', b"corrompido"), ('meta.json', b"{")])
+def test_cache_corrompido(tmp_path, arquivo, conteudo):
+    gravar_cache_disco(tmp_path, "abc", ler_grades_excel(planilha_tipos(), 'openpyxl'), METRICAS, [], 2**30)
+    (tmp_path / "abc" / arquivo).write_bytes(conteudo)
+    assert ler_cache_disco(tmp_path, "abc") is None
+
+
+def test_entrada_corrompida_e_substituida(tmp_path):
+    (tmp_path / "abc").mkdir()
+    (tmp_path / "abc" / "meta.json").write_bytes(b"{")
+    gravar_cache_disco(tmp_path, "abc", ler_grades_excel(planilha_tipos(), 'openpyxl'), METRICAS, [], 2**30)
+    assert ler_cache_disco(tmp_path, "abc") is not None
+
+
+def test_poda_remove_as_entradas_mais_antigas(tmp_path):
+    abas_brutas = ler_grades_excel(planilha_tipos(), 'openpyxl')
+    for numero, nome in enumerate(("antiga", "media", "nova")):
+        gravar_cache_disco(tmp_path, nome, abas_brutas, METRICAS, [], 2**30)
+        os.utime(tmp_path / nome, (1_000_000 + numero, 1_000_000 + numero))
+    tamanho = sum(arquivo.stat().st_size for arquivo in (tmp_path / "nova").iterdir())
+    podar_cache_disco(tmp_path, 2 * tamanho)
+    assert sorted(pasta.name for pasta in tmp_path.iterdir()) == ["media", "nova"]
@@ -0,0 +1,60 @@
+import pytest
+
+from cosmos_chat import normalizar_pergunta, responder_rapido
+
+# Tabela de perguntas do roteador de respostas diretas: as que têm resposta nas médias, no IT ou
+# nos drivers são respondidas na hora; as demais (None) precisam seguir para o modelo.
+
+RAPIDO = {
+    'it_total': 3.8,
+    'medias': {'urbana': 3.1, 'ambiental': 2.4, 'social': 1.9, 'economica': 4.2, 'fisica': 3.0, 'sensorial': 2.8},
+    'drivers': [('Densidade', 8.0), ('Renda média', 6.5), ('Mobilidade', 4.25)],
+}
+
+RESPOSTAS_DIRETAS = [
+    ("Qual a dimensão com maior média?", "A dimensão com maior média é a **Econômica**, com **4.20** (escala 0-5)."),
+    ("Qual a dimensão mais fraca?", "A dimensão com menor média é a **Social**, com **1.90** (escala 0-5)."),
+    ("Mostre o ranking das dimensões", "Ranking das dimensões pela média (0-5):\n\n1. Econômica — 4.20"),
+    ("Quais as dimensões com maior e menor média?", "Ranking das dimensões pela média (0-5):"),
+    ("Qual a média da dimensão social?", "- Média da dimensão Social: **1.90** (escala 0-5)"),
+    ("Qual a nota ambiental?", "- Média da dimensão Ambiental: **2.40** (escala 0-5)"),
+    ("Qual o IT total?", "O Índice Territorial (IT) total é **3.80** (Alto Potencial)."),
+    ("Qual o índice territorial?", "O Índice Territorial (IT) total é **3.80** (Alto Potencial)."),
+    ("Quais os drivers de impacto?", "Principais drivers de impacto (valor ponderado, da Matriz de Pesos):\n\n1. Densidade — 8.00"),
+    ("Quais indicadores têm maior peso?", "Principais drivers de impacto (valor ponderado, da Matriz de Pesos):"),
+]
+
+PARA_O_MODELO = [
+    "Qual o maior valor de taxa de ocupação entre ADE e ZR3?",
+    "Qual stakeholder tem a maior pontuação?",
+    "Qual o menor valor de afastamento lateral?",
+    "Qual a nota mais baixa do relatório de visita?",
+    "Quais parceiros têm maior peso?",
+    "Qual o IT da visita?",
+    "Qual o maior valor da matriz?",
+    "Qual a maior pontuação?",
+    "Qual o indicador com maior nota na dimensão urbana?",
+    "Qual o pior indicador da dimensão social?",
+    "Qual a estratégia para a dimensão social?",
+    "Explique a média da dimensão urbana",
+    "",
+    "Qual a dimensão com maior média " + "considerando " * 20,
+]
+
+
+@pytest.mark.parametrize('pergunta, inicio', RESPOSTAS_DIRETAS)
+def test_responde_sem_o_modelo(pergunta, inicio):
+    assert responder_rapido(pergunta, RAPIDO).startswith(inicio)
+
+
+@pytest.mark.parametrize('pergunta', PARA_O_MODELO)
+def test_segue_para_o_modelo(pergunta):
+    assert responder_rapido(pergunta, RAPIDO) is None
+
+
+def test_drivers_sem_matriz_seguem_para_o_modelo():
+    assert responder_rapido("Quais os drivers de impacto?", {**RAPIDO, 'drivers': []}) is None
+
+
+def test_normalizar_pergunta():
+    assert normalizar_pergunta("  Qual a Dimensão  ECONÔMICA? ") == "qual a dimensao economica"